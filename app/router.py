@@ -5,6 +5,11 @@ from app.utils.voluum_data_handler import VoluumDataHandler
 from app.utils.db_handler import DBHandler
 from app.utils.ongage_data_handler import OngageDataHandler
 from app.utils.mmd_data_handler import MMDDataHandler
+from app.utils.hlr_handler import (
+    HLRBatchHandler, split_csv_lines, classify_hlr_result, iter_hlr_results, parse_cache_ttl_days, HLR_APIKEY, HLR_SECRET,
+    HLR_BATCH_MAX_ROWS, HLR_MAX_CONCURRENT_BATCHES, HLR_DOWNLOAD_CHUNK_BYTES,
+    HLR_CACHE_TTL_DAYS, HLR_CACHE_LOOKUP_CHUNK_ROWS,
+)
 from app.schema import RecordRequest, SyncDataInRangeRequest, SyncDate
 from fastapi.responses import JSONResponse, FileResponse
 from time import time
@@ -17,11 +22,19 @@ import time as time_mod
 from datetime import datetime, timedelta, UTC
 from fastapi.responses import StreamingResponse
 import json
+import re
+import shutil
+import glob
+import threading
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 load_dotenv()
 
 UPLOAD_ROOT = os.getenv("UPLOAD_ROOT", "uploads")
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+# Rows per clean_csv_records call when processing an uploaded file
+CSV_PROCESS_CHUNK_ROWS = int(os.getenv("CSV_PROCESS_CHUNK_ROWS", "200000"))
 
 RAW_DIR = os.path.join(UPLOAD_ROOT, "raw")
 PROCESSED_DIR = os.path.join(UPLOAD_ROOT, "processed")
@@ -36,8 +49,8 @@ DB_DIR = os.path.join(DB_ROOT, "exports")
 RAW_ENCRYPTED_DIR = os.path.join(UPLOAD_ROOT, "raw_encrypted")
 PROCESSED_ENCRYPTED_DIR = os.path.join(UPLOAD_ROOT, "processed_encrypted")
 
-HLR_APIKEY = os.getenv("HLRLOOKUP_APIKEY")
-HLR_SECRET = os.getenv("HLRLOOKUP_SECRET")
+# HLR progress is written to uploaded_csv_files at most this often while batches run
+HLR_PROGRESS_WRITE_SECONDS = float(os.getenv("HLR_PROGRESS_WRITE_SECONDS", "30"))
 
 BROADCAST_ROOT = os.path.join(UPLOAD_ROOT, "broadcasts")
 
@@ -50,7 +63,12 @@ router = APIRouter()
 data_handler = VoluumDataHandler()
 db_handler = DBHandler(50000)
 ongage_data_handler = OngageDataHandler()
-mmd_data_handler = MMDDataHandler()
+mmd_data_handler = MMDDataHandler(db_handler)
+hlr_batch_handler = HLRBatchHandler()
+
+if db_handler.suppression_index is not None:
+    # Build in the background so startup is not blocked; lookups wait for it if they arrive first
+    threading.Thread(target=db_handler.suppression_index.ensure_fresh, daemon=True).start()
 
 os.makedirs(RAW_DIR, exist_ok=True)
 os.makedirs(PROCESSED_DIR, exist_ok=True)
@@ -78,25 +96,13 @@ def sync_voluum_reports(request_data: SyncDate):
     data = data_handler.get_cleaned_data(from_date=request_data.from_date, to_date=request_data.to_date)
     print(f"Data fetched and cleaned in {time() - start_time} seconds.")
     start_time = time()
-    ts_source_row_count = db_handler.insert_raw_data_into_ts_source(data.to_numpy())
-    print(f"Inserted {ts_source_row_count} rows into ts_source in {time() - start_time} seconds.")
-    blacklist_records = data[data['category'] == 'BLACKLIST'].to_numpy()
-    whitelist_records = data[data['category'] == 'WHITELIST'].to_numpy()
-    monitor_records = data[data['category'] == 'MONITOR'].to_numpy()
-    start_time = time()
-    blacklist_row_count = db_handler.upsert_data_into_blacklist_and_monitor('blacklist', blacklist_records)
-    print(f"Upserted {blacklist_row_count} rows into blacklist in {time() - start_time} seconds.")
-    start_time = time()
-    whitelist_row_count = db_handler.upsert_data_into_whitelist('whitelist', whitelist_records)
-    print(f"Upserted {whitelist_row_count} rows into whitelist in {time() - start_time} seconds.")
-    start_time = time()
-    monitor_row_count = db_handler.upsert_data_into_blacklist_and_monitor('monitor', monitor_records)
-    print(f"Upserted {monitor_row_count} rows into monitor in {time() - start_time} seconds.")
+    row_counts = db_handler.sync_voluum_report_data(data)
+    print(f"Synced report rows into ts_source/blacklist/whitelist/monitor in {time() - start_time} seconds.")
     return {
         "row_counts": {
-            "blacklist_rows": blacklist_row_count,
-            "monitor_rows": monitor_row_count,
-            "whitelist_rows": whitelist_row_count
+            "blacklist_rows": row_counts["blacklist_rows"],
+            "monitor_rows": row_counts["monitor_rows"],
+            "whitelist_rows": row_counts["whitelist_rows"]
         }
     }
 
@@ -111,20 +117,8 @@ def sync_voluum_reports_for_range(request_data: SyncDataInRangeRequest):
         data = data_handler.get_cleaned_data(from_date=from_date_str, to_date=to_date_str)
         print(f"Data fetched and cleaned in {time() - start_time} seconds.")
         start_time = time()
-        db_handler.insert_raw_data_into_ts_source(data.to_numpy())
-        print(f"Inserted rows into ts_source in {time() - start_time} seconds.")
-        blacklist_records = data[data['category'] == 'BLACKLIST'].to_numpy()
-        whitelist_records = data[data['category'] == 'WHITELIST'].to_numpy()
-        monitor_records = data[data['category'] == 'MONITOR'].to_numpy()
-        start_time = time()
-        db_handler.upsert_data_into_blacklist_and_monitor('blacklist', blacklist_records)
-        print(f"Upserted rows into blacklist in {time() - start_time} seconds.")
-        start_time = time()
-        db_handler.upsert_data_into_whitelist('whitelist', whitelist_records)
-        print(f"Upserted rows into whitelist in {time() - start_time} seconds.")
-        start_time = time()
-        db_handler.upsert_data_into_blacklist_and_monitor('monitor', monitor_records)
-        print(f"Upserted rows into monitor in {time() - start_time} seconds.")
+        db_handler.sync_voluum_report_data(data)
+        print(f"Synced report rows into ts_source/blacklist/whitelist/monitor in {time() - start_time} seconds.")
     return {
         "status": "success"
     }
@@ -196,96 +190,160 @@ def get_metrics():
 
 @router.post("/upload")
 async def process_csv(file: UploadFile = File(...)):
-    # Read CSV text
+    # Stream the upload to disk, counting non-blank lines as chunks arrive
 
     try:
-        content = (await file.read())
         file_id = str(uuid.uuid4())
         raw_path = os.path.join(RAW_DIR, f"{file_id}.csv")
 
-        # Save file to disk
+        row_count = 0
+        carry = b""
         with open(raw_path, "wb") as f:
-            f.write(content)
-        
-        text = content.decode("utf-8", errors="replace")
-        row_count = sum(1 for line in text.splitlines() if line.strip())
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                f.write(chunk)
+                lines = re.split(rb"[\r\n]", carry + chunk)
+                carry = lines.pop()
+                row_count += sum(1 for line in lines if line.strip())
+        if carry.strip():
+            row_count += 1
 
         return db_handler.create_file_entry(file_id, file.filename, raw_path, row_count)
     except Exception as e:  
         raise HTTPException(status_code=500, detail=str(e))
 
-def _process_file_job(file_id: str, include_main_database, include_conversion, include_blacklist, include_monitor):
+def _iter_record_chunks(raw_path: str, chunk_size: int):
     """
-    Runs in background. Reads raw CSV, cleans, writes processed CSV,
-    computes stats, updates DB.
+    Yield the raw CSV as lists of {"record": value} rows, chunk_size rows at a time.
+    Single-column file, same parsing as the old DictReader(fieldnames=["record"]).
     """
-    try:
-        meta = db_handler.get_file_paths(file_id)
-        if not meta:
-            return
-
-        raw_path = meta["raw_file_path"]
-        processed_path = os.path.join(PROCESSED_DIR, f"{file_id}.csv")
-
-        # Read raw CSV
-        with open(raw_path, "r", encoding="utf-8", newline="") as f:
-            content = f.read()
-
-        # Your earlier parser used fieldnames=["record"].
-        # If your CSV is single-column lines, keep it:
-        content = content.replace("\ufeff", "")
-        reader = csv.DictReader(io.StringIO(content), fieldnames=["record"])
-        rows = list(reader)
-        total = len(rows)
-        processed_rows, removed_blacklist, removed_monitor, removed_conversion, removed_maindatabase = db_handler.clean_csv_records(rows, include_main_database, include_conversion, include_blacklist, include_monitor)
-
-        # Compute basic stats (adjust to your real logic)
-        # If clean_csv_records removes records, we can infer removed = total - clean
-        clean_count = len(processed_rows)
-
-        # Write processed rows to CSV (1 column)
-        with open(processed_path, "w", encoding="utf-8", newline="") as out:
-            w = csv.writer(out)
-            for pr in processed_rows:
-                # If pr is dict-like, adapt accordingly.
-                # If it's already the value for "record", write single column:
-                w.writerow([pr])
-
-        db_handler.upsert_stats(
-            file_id=file_id,
-            total=total,
-            rb=removed_blacklist,
-            rm=removed_monitor,
-            rc=removed_conversion,
-            rmd=removed_maindatabase,
-            final_clean=clean_count,
-        )
-        db_handler.mark_processed(
-            file_id=file_id,
-            processed_path=processed_path,
-            total=total,
-            clean=clean_count,
-        )
+    with open(raw_path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader((line.replace("\ufeff", "") for line in f), fieldnames=["record"])
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def _process_file_job(file_id: str, include_main_database, include_conversion, include_blacklist, include_monitor, job=None):
+    """
+    Runs in a job worker. Streams the raw CSV in CSV_PROCESS_CHUNK_ROWS chunks,
+    cleans each chunk and appends it to the processed CSV, then updates stats.
+    Records already seen in an earlier chunk are dropped via file_processing_keys.
+    Each chunk is one transaction: its main_database insert commits together with
+    the checkpoint of counters and output size, so a retry after a worker crash
+    resumes from the last finished chunk and redoes an unfinished one from scratch.
+    """
+    meta = db_handler.get_file_paths(file_id)
+    if not meta:
+        return
+
+    raw_path = meta["raw_file_path"]
+    processed_path = os.path.join(PROCESSED_DIR, f"{file_id}.csv")
+
+    progress = job.progress if job and os.path.exists(processed_path) else {}
+    chunk_rows = progress.get("chunk_rows", CSV_PROCESS_CHUNK_ROWS)
+    rows_done = progress.get("rows", 0)
+    total, clean_count = 0, progress.get("clean", 0)
+    removed_blacklist = progress.get("rb", 0)
+    removed_monitor = progress.get("rm", 0)
+    removed_conversion = progress.get("rc", 0)
+    removed_maindatabase = progress.get("rmd", 0)
+
+    if rows_done:
+        # Drop anything written after the last checkpoint
+        with open(processed_path, "r+b") as out:
+            out.truncate(progress["bytes"])
+        print(f"[{file_id}] resuming after {rows_done} rows")
+    else:
+        # Keys left by an earlier attempt that is not being resumed
+        db_handler.clear_file_processing_keys(file_id)
+
+    with open(processed_path, "a" if rows_done else "w", encoding="utf-8", newline="") as out:
+        w = csv.writer(out)
+        for rows in _iter_record_chunks(raw_path, chunk_rows):
+            total += len(rows)
+            if total <= rows_done:
+                continue
 
-    except Exception as e:
-        print(e)
-        db_handler.mark_failed(file_id, str(e))
+            def commit_chunk(cursor, result):
+                processed_rows, rb, rm, rc, rmd = result
+                # Write processed rows to CSV (1 column)
+                w.writerows([pr] for pr in processed_rows)
+                if job:
+                    out.flush()
+                    os.fsync(out.fileno())
+                    job.checkpoint({
+                        "chunk_rows": chunk_rows, "rows": total, "bytes": out.tell(),
+                        "clean": clean_count + len(processed_rows),
+                        "rb": removed_blacklist + rb, "rm": removed_monitor + rm,
+                        "rc": removed_conversion + rc, "rmd": removed_maindatabase + rmd,
+                    }, cursor)
+
+            processed_rows, rb, rm, rc, rmd = db_handler.clean_csv_chunk(
+                rows, include_main_database, include_conversion, include_blacklist, include_monitor, commit_chunk, file_id,
+            )
+            removed_blacklist += rb
+            removed_monitor += rm
+            removed_conversion += rc
+            removed_maindatabase += rmd
+            clean_count += len(processed_rows)
+            print(f"[{file_id}] processed {total} rows, {clean_count} clean so far")
+
+    db_handler.upsert_stats(
+        file_id=file_id,
+        total=total,
+        rb=removed_blacklist,
+        rm=removed_monitor,
+        rc=removed_conversion,
+        rmd=removed_maindatabase,
+        final_clean=clean_count,
+    )
+    db_handler.mark_processed(
+        file_id=file_id,
+        processed_path=processed_path,
+        total=total,
+        clean=clean_count,
+    )
+    db_handler.clear_file_processing_keys(file_id)
+
+def _mark_file_job_failed(file_id: str, error_message: str):
+    """on_failure for process_file jobs: drop the file's de-duplication keys, then mark the file failed."""
+    db_handler.clear_file_processing_keys(file_id)
+    db_handler.mark_failed(file_id, error_message)
+
+@router.get("/suppression-index")
+def get_suppression_index_stats():
+    if db_handler.suppression_index is None:
+        raise HTTPException(status_code=400, detail="Suppression index is disabled (SUPPRESSION_INDEX_ENABLED)")
+    return db_handler.suppression_index.stats()
+
+@router.post("/suppression-index/rebuild")
+def rebuild_suppression_index(background_tasks: BackgroundTasks):
+    if db_handler.suppression_index is None:
+        raise HTTPException(status_code=400, detail="Suppression index is disabled (SUPPRESSION_INDEX_ENABLED)")
+    background_tasks.add_task(db_handler.suppression_index.rebuild)
+    return {"ok": True, "status": "rebuilding"}
 
 @router.get("/files")
 def list_files(status: str | None = Query(default=None)):
-    db = DBHandler()
     try:
         if status:
             statuses = status.split(",")
-            rows = db.list_files(statuses)
+            rows = db_handler.list_files(statuses)
         else:
-            rows = db.list_files()
+            rows = db_handler.list_files()
         return {"items": rows}
     except Exception as e:
         print(e)
 
 @router.post("/{file_id}/process")
-def start_processing(file_id: str, background_tasks: BackgroundTasks, include_conversion: bool = Query(False), include_main_database: bool = Query(False), include_blacklist: bool = Query(False), include_monitor: bool = Query(False)):
+def start_processing(file_id: str, include_conversion: bool = Query(False), include_main_database: bool = Query(False), include_blacklist: bool = Query(False), include_monitor: bool = Query(False)):
     try:
         # Try to mark processing (fails if another processing exists due to DB unique index)
         try:
@@ -297,8 +355,14 @@ def start_processing(file_id: str, background_tasks: BackgroundTasks, include_co
         if not ok:
             raise HTTPException(status_code=400, detail="File not found or not eligible for processing")
 
-        background_tasks.add_task(_process_file_job, file_id, include_main_database, include_conversion, include_blacklist, include_monitor)
-        return {"ok": True, "file_id": file_id, "status": "processing"}
+        job_id = db_handler.enqueue_job("process_file", {
+            "file_id": file_id,
+            "include_main_database": include_main_database,
+            "include_conversion": include_conversion,
+            "include_blacklist": include_blacklist,
+            "include_monitor": include_monitor,
+        })
+        return {"ok": True, "file_id": file_id, "job_id": job_id, "status": "processing"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -470,184 +534,240 @@ def manual_update_download(import_id: str):
     download_name = f"result_{meta['original_filename']}"
     return FileResponse(path, media_type="text/csv", filename=download_name)
 
-def _hlr_job(file_id: str):
+def _hlr_temp_paths(file_id: str) -> list[str]:
+    """The HLR job's intermediate files (cache misses, batch parts and their raw results)."""
+    return glob.glob(os.path.join(HLR_DIR, f"{file_id}_misses.csv")) + glob.glob(os.path.join(HLR_DIR, f"{file_id}_part*.csv"))
+
+def _hlr_job(file_id: str, job=None):
     """
-    Runs in background.
-    Uploads processed CSV to HLRLookup Batch API, starts processing, polls until complete,
-    downloads results to disk, updates DB.
+    Runs in a job worker.
+    Numbers with a fresh result in hlr_lookup_cache (TTL per live_status, see
+    HLR_CACHE_TTL_DAYS) are resolved locally. The cache misses are split into
+    HLR_BATCH_MAX_ROWS-line parts and run as HLRLookup batches, HLR_MAX_CONCURRENT_BATCHES
+    at a time (upload, start, adaptive polling, streamed result download). Each batch's results are parsed as soon as it
+    finishes; the raw results are concatenated into one file for /hlr/raw.
+    The job checkpoints the number of parts, every created/started batch ID and every
+    parsed batch (with the clean file's size), so a retry reattaches to the batches
+    already paid for instead of creating them again. Intermediate files are kept
+    until the job succeeds or finally fails (_mark_hlr_job_failed).
     """
-    try:
-        if not HLR_APIKEY or not HLR_SECRET:
-            raise Exception("Missing HLRLOOKUP_APIKEY/HLRLOOKUP_SECRET env vars")
-
-        meta = db_handler.get_file_paths(file_id)
-        if not meta:
-            raise Exception("File not found")
-
-        processed_path = meta.get("processed_file_path")
-        if meta.get("status") != "processed" or not processed_path or not os.path.exists(processed_path):
-            raise Exception("File not processed or processed file missing")
-
-        # 1) Create batch
-        create_url = f"https://batches.hlrlookup.com/batches/?apikey={HLR_APIKEY}&secret={HLR_SECRET}"
-        payload = {
-            "filename": f"{file_id}.csv",
-            "type": "HLR_V2",
-            "batchArguments": {
-                "cache_days_private": 30,
-                "cache_days_global": 30,
-                "save_to_cache": "YES",
-            }
-        }
-        r = requests.post(create_url, json=payload, timeout=60)
-        r.raise_for_status()
-        batch = r.json()
-        batch_id = str(batch.get("id"))
-        if not batch_id:
-            raise Exception(f"HLR batch create failed: {batch}")
-
-        db_handler.set_hlr_batch_id(file_id, batch_id)
-
-        # 2) Upload source file
-        db_handler.set_hlr_status(file_id, "uploading")
-        upload_url = f"https://batches.hlrlookup.com/batches/{batch_id}/source?apikey={HLR_APIKEY}&secret={HLR_SECRET}"
-
-        with open(processed_path, "rb") as f:
-            ur = requests.post(
-                upload_url,
-                data=f,
-                headers={"Content-Type": "text/csv"},
-                timeout=300,
-            )
-        ur.raise_for_status()
-
-        # 3) Start processing
-        start_url = f"https://batches.hlrlookup.com/batches/{batch_id}/?apikey={HLR_APIKEY}&secret={HLR_SECRET}"
-        sr = requests.put(start_url, json={"status": "PROCESSING"}, timeout=60)
-        sr.raise_for_status()
-
-        db_handler.set_hlr_status(file_id, "processing")
-
-        # 4) Poll status until COMPLETE (or FAILED)
-        status_url = f"https://batches.hlrlookup.com/batches/{batch_id}?apikey={HLR_APIKEY}&secret={HLR_SECRET}"
-
-        max_wait_seconds = int(os.getenv("HLR_POLL_MAX_SECONDS", "18000"))  # 5 hour default
-        poll_every = int(os.getenv("HLR_POLL_EVERY_SECONDS", "5"))
-        elapsed = 0
-
-        while True:
-            gr = requests.get(status_url, timeout=60)
-            gr.raise_for_status()
-            info = gr.json()
+    if not HLR_APIKEY or not HLR_SECRET:
+        raise Exception("Missing HLRLOOKUP_APIKEY/HLRLOOKUP_SECRET env vars")
 
-            api_status = (info.get("status") or "").upper()
-            num_items = info.get("numItems")
-            num_complete = info.get("numComplete")
-
-            # keep progress in DB
-            mapped = "processing"
-            if api_status in ("COMPLETE", "COMPLETED"):
-                mapped = "complete"
-            elif api_status in ("FAILED", "ERROR"):
-                mapped = "failed"
-
-            db_handler.update_hlr_progress(file_id, mapped if mapped != "complete" else "processing", num_items, num_complete)
-
-            if mapped == "complete":
-                break
-            if mapped == "failed":
-                raise Exception(f"HLR batch failed: {info}")
-
-            time_mod.sleep(poll_every)
-            elapsed += poll_every
-            if elapsed >= max_wait_seconds:
-                raise Exception("HLR polling timed out")
+    meta = db_handler.get_file_paths(file_id)
+    if not meta:
+        raise Exception("File not found")
+
+    processed_path = meta.get("processed_file_path")
+    if meta.get("status") != "processed" or not processed_path or not os.path.exists(processed_path):
+        raise Exception("File not processed or processed file missing")
+
+    final_hlr_path = os.path.join(HLR_DIR, f"{file_id}_hlr_clean.csv")
+    misses_path = os.path.join(HLR_DIR, f"{file_id}_misses.csv")
+    part_path_fmt = os.path.join(HLR_DIR, f"{file_id}_part{{}}.csv")
+    raw_part_path_fmt = os.path.join(HLR_DIR, f"{file_id}_part{{}}_raw.csv")
+
+    progress = dict(job.progress) if job else {}
+    resuming = (
+        "parts" in progress
+        and os.path.exists(final_hlr_path)
+        and all(os.path.exists(part_path_fmt.format(index)) for index in range(progress["parts"]))
+    )
+    if not resuming:
+        progress = {}
+    else:
+        # Drop results written after the last checkpoint
+        with open(final_hlr_path, "r+b") as clean_file:
+            clean_file.truncate(progress["bytes"])
+        print(f"[{file_id}] HLR resuming: {len(progress['parsed'])}/{progress['parts']} batches parsed, {len(progress['batches'])} created")
+
+    progress_lock = threading.Lock()
+
+    def save_checkpoint(**changes):
+        """Merge `changes` into the saved progress; list and dict values extend what is there."""
+        with progress_lock:
+            for key, value in changes.items():
+                if isinstance(value, list):
+                    value = progress.get(key, []) + value
+                elif isinstance(value, dict):
+                    value = {**progress.get(key, {}), **value}
+                progress[key] = value
+            if job:
+                job.checkpoint(json.loads(json.dumps(progress)))
+
+    with open(final_hlr_path, "a" if resuming else "w", newline="", encoding="utf-8") as clean_file:
+        writer = csv.writer(clean_file)
+        live_count = progress.get("live", 0)
+
+        def record_results(results):
+            """
+            Write one chunk of (number, live_status, network, raw row or None) results:
+            live -> clean file (+ raw row to api_hlr_live_numbers), the rest -> blacklist/monitor.
+            """
+            nonlocal live_count
+            by_class = {"live": [], "risky": [], "dead": [], "monitor": []}
+            hlr_live_data = []
+            for number, live_status, network, row in results:
+                category = classify_hlr_result(live_status, network)
+                if category:
+                    by_class[category].append(number)
+                if category == "live" and row is not None:
+                    hlr_live_data.append(row)
 
-        # 5) Download results
-        results_url = f"https://batches.hlrlookup.com/batches/{batch_id}/results?apikey={HLR_APIKEY}&secret={HLR_SECRET}"
-        rr = requests.get(results_url, timeout=300)
-        rr.raise_for_status()
+            db_handler.insert_raw_hlr_data(hlr_live_data)
+            writer.writerows([n] for n in by_class["live"])
+            live_count += len(by_class["live"])
 
-        hlr_raw_path = os.path.join(HLR_DIR, f"{file_id}_raw.csv")
-        with open(hlr_raw_path, "wb") as f:
-            f.write(rr.content)
+            # -----------------------------
+            # INSERT NON-LIVE INTO BLACKLIST
+            # -----------------------------
 
-        db_handler.set_hlr_raw_path(file_id, hlr_raw_path)
+            if by_class["dead"]:
+                db_handler.insert_hlr_data("blacklist", by_class["dead"], "CSV_CLEAN_UPLOAD", "HLR_FAILED")
+            if by_class["monitor"]:
+                db_handler.insert_hlr_data("monitor", by_class["monitor"], "CSV_CLEAN_UPLOAD", "HLR_MONITORED")
+            if by_class["risky"]:
+                db_handler.insert_hlr_data("blacklist", by_class["risky"], "CSV_CLEAN_UPLOAD", "HLR_RISKY_NETWORK")
+            return len(by_class["live"])
 
-        # -----------------------------
-        # PARSE CSV
-        # -----------------------------
+        def clean_file_offset():
+            clean_file.flush()
+            os.fsync(clean_file.fileno())
+            return clean_file.tell()
 
-        live_numbers: list[str] = []
-        dead_numbers: list[str] = []
-        monitor_numbers: list[str] = []
-        risky_networks = json.load(open('app/utils/risky_operators.json', 'r'))["risky_networks"]
-        risky_numbers = []
-        hlr_live_data = []
-        with open(hlr_raw_path, newline="", encoding="utf-8") as csvfile:
-            reader = csv.DictReader(csvfile)
-
-            for row in reader:
-                status = (row.get("live_status") or "").upper()
-
-                number = (
-                    row.get("formatted_telephone_number")
-                    or row.get("detected_telephone_number")
-                    or ""
-                ).strip()
-
-                if not number:
-                    continue
-
-                if status == "LIVE":
-                    current_network_name = (row.get("current_network_details.name") or "").lower().replace(" ", "")
-                    if current_network_name in risky_networks:
-                        risky_numbers.append(number)
-                        continue
-                    live_numbers.append(number)
-                    hlr_live_data.append(row)
-                elif status in ["NOT_AVAILABLE_NETWORK_ONLY", "NOT_APPLICABLE", "NO_TELESERVICE_PROVISIONED", "DEAD"]:
-                    dead_numbers.append(number)
-                elif status in ["NO_COVERAGE", "INCONCLUSIVE", "ABSENT_SUBSCRIBER"]:
-                    monitor_numbers.append(number)
-        db_handler.insert_raw_hlr_data(hlr_live_data)
-        # -----------------------------
-        # WRITE FINAL CLEAN FILE
-        # -----------------------------
+        if not resuming:
+            writer.writerow(["phone_number"])
 
-        final_hlr_path = os.path.join(HLR_DIR, f"{file_id}_hlr_clean.csv")
+            # -----------------------------
+            # PRE-HLR CACHE: RESOLVE RECENTLY CHECKED NUMBERS LOCALLY
+            # -----------------------------
+
+            ttl_days = parse_cache_ttl_days(HLR_CACHE_TTL_DAYS)
+            cache_lookups, cache_hits = 0, 0
+            with open(misses_path, "w", encoding="utf-8", newline="") as misses_file:
+                for rows in _iter_record_chunks(processed_path, HLR_CACHE_LOOKUP_CHUNK_ROWS):
+                    numbers = [row["record"].strip() for row in rows if row["record"] and row["record"].strip()]
+                    cached = db_handler.get_cached_hlr_results(numbers, ttl_days)
+                    record_results([(number, *cached[number], None) for number in numbers if number in cached])
+                    misses_file.writelines(f"{number}\n" for number in numbers if number not in cached)
+                    cache_lookups += len(numbers)
+                    cache_hits += sum(1 for number in numbers if number in cached)
+            db_handler.set_hlr_cache_stats(file_id, cache_lookups, cache_hits)
+            print(f"[{file_id}] HLR cache: {cache_hits}/{cache_lookups} numbers resolved locally")
+
+            for path in glob.glob(part_path_fmt.format("*")):
+                os.remove(path)
+            parts = len(split_csv_lines(misses_path, HLR_BATCH_MAX_ROWS, part_path_fmt))
+            save_checkpoint(parts=parts, bytes=clean_file_offset(), live=live_count, batches={}, started=[], parsed=[])
+
+        batch_paths = [part_path_fmt.format(index) for index in range(progress["parts"])]
+        print(f"[{file_id}] HLR: {len(batch_paths)} batches of up to {HLR_BATCH_MAX_ROWS} numbers")
 
-        with open(final_hlr_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["phone_number"])
-            for n in live_numbers:
-                writer.writerow([n])
+        db_handler.set_hlr_status(file_id, "uploading")
+        batch_ids = {int(index): batch_id for index, batch_id in progress["batches"].items()}
+        if batch_ids:
+            db_handler.set_hlr_batch_id(file_id, ",".join(batch_ids[i] for i in sorted(batch_ids)))
+        batch_progress = {}  # part index -> (num_items, num_complete)
+        last_progress_write = [0.0]
+        # Set when a batch fails so the others stop polling
+        cancelled = threading.Event()
+
+        def write_progress():
+            with progress_lock:
+                last_progress_write[0] = time()
+                items = sum(p[0] for p in batch_progress.values())
+                complete = sum(p[1] for p in batch_progress.values())
+            db_handler.update_hlr_progress(file_id, "processing", items, complete)
+
+        def report_progress(index, num_items, num_complete):
+            with progress_lock:
+                batch_progress[index] = (num_items or 0, num_complete or 0)
+                due = time() - last_progress_write[0] >= HLR_PROGRESS_WRITE_SECONDS
+            # One DB write per HLR_PROGRESS_WRITE_SECONDS across all batches, not one per poll
+            if due:
+                write_progress()
+
+        def run_batch(index, part_path):
+            with progress_lock:
+                batch_id = batch_ids.get(index)
+                started = index in progress["started"]
+            if batch_id is None:
+                batch_id = hlr_batch_handler.create_batch(f"{file_id}_{index}.csv")
+                save_checkpoint(batches={str(index): batch_id})
+                with progress_lock:
+                    batch_ids[index] = batch_id
+                    joined = ",".join(batch_ids[i] for i in sorted(batch_ids))
+                db_handler.set_hlr_batch_id(file_id, joined)
+
+            if not started:
+                hlr_batch_handler.upload_source(batch_id, part_path)
+                hlr_batch_handler.start_batch(batch_id)
+                save_checkpoint(started=[index])
+            hlr_batch_handler.wait_for_batch(
+                batch_id,
+                on_progress=lambda items, complete: report_progress(index, items, complete),
+                cancel_event=cancelled,
+            )
+            return hlr_batch_handler.download_results(batch_id, raw_part_path_fmt.format(index))
 
         # -----------------------------
-        # INSERT NON-LIVE INTO BLACKLIST
+        # RUN BATCHES FOR CACHE MISSES, PARSE EACH AS IT COMPLETES
         # -----------------------------
 
-        if dead_numbers:
-            db_handler.insert_hlr_data("blacklist", dead_numbers, "CSV_CLEAN_UPLOAD", "HLR_FAILED")
-        if monitor_numbers:
-            db_handler.insert_hlr_data("monitor", monitor_numbers, "CSV_CLEAN_UPLOAD", "HLR_MONITORED")
-        if risky_numbers:
-            db_handler.insert_hlr_data("blacklist", risky_numbers, "CSV_CLEAN_UPLOAD", "HLR_RISKY_NETWORK")
+        part_raw_paths = [raw_part_path_fmt.format(index) for index in range(len(batch_paths))]
+        pending = [index for index in range(len(batch_paths)) if index not in progress["parsed"]]
 
-        # -----------------------------
-        # MARK COMPLETE
-        # -----------------------------
+        with ThreadPoolExecutor(max_workers=HLR_MAX_CONCURRENT_BATCHES) as executor:
+            futures = {executor.submit(run_batch, index, batch_paths[index]): index for index in pending}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    part_raw_paths[index] = raw_path = future.result()
+                except Exception:
+                    cancelled.set()
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+
+                batch_live = 0
+                for chunk in iter_hlr_results(raw_path):
+                    batch_live += record_results([(number, live_status, network, row) for number, _, live_status, network, row in chunk])
+                    db_handler.upsert_hlr_cache([(sent_number, live_status, network) for _, sent_number, live_status, network, _ in chunk])
+                save_checkpoint(parsed=[index], bytes=clean_file_offset(), live=live_count)
+                print(f"[{file_id}] HLR batch {index + 1}/{len(batch_paths)} done: {batch_live} live")
+
+    write_progress()
+
+    # One raw file for /hlr/raw, batches in source order with a single header
+    hlr_raw_path = os.path.join(HLR_DIR, f"{file_id}_raw.csv")
+    with open(hlr_raw_path, "wb") as out:
+        for index, raw_path in enumerate(part_raw_paths):
+            with open(raw_path, "rb") as f:
+                if index > 0:
+                    f.readline()
+                shutil.copyfileobj(f, out, HLR_DOWNLOAD_CHUNK_BYTES)
+    db_handler.set_hlr_raw_path(file_id, hlr_raw_path)
+
+    # -----------------------------
+    # MARK COMPLETE
+    # -----------------------------
+
+    db_handler.mark_hlr_complete(
+        file_id=file_id,
+        result_path=final_hlr_path,
+    )
+    print(f"[{file_id}] HLR complete: {live_count} live numbers")
 
-        db_handler.mark_hlr_complete(
-            file_id=file_id,
-            result_path=final_hlr_path,
-        )
+    for path in _hlr_temp_paths(file_id):
+        os.remove(path)
 
-    except Exception as e:
-        db_handler.mark_hlr_failed(file_id, str(e))
+def _mark_hlr_job_failed(file_id: str, error_message: str):
+    """on_failure for HLR jobs: drop the intermediate files kept for retries, then mark the file failed."""
+    for path in _hlr_temp_paths(file_id):
+        os.remove(path)
+    db_handler.mark_hlr_failed(file_id, error_message)
 
 @router.post("/{file_id}/hlr")
-def start_hlr(file_id: str, background_tasks: BackgroundTasks):
+def start_hlr(file_id: str):
     try:
         try:
             ok = db_handler.mark_hlr_processing(file_id=file_id, lock_owner="hlr")
@@ -657,8 +777,8 @@ def start_hlr(file_id: str, background_tasks: BackgroundTasks):
         if not ok:
             raise HTTPException(status_code=400, detail="File not eligible for HLR (must be processed and not already active)")
 
-        background_tasks.add_task(_hlr_job, file_id)
-        return {"ok": True, "file_id": file_id, "hlr_status": "processing"}
+        job_id = db_handler.enqueue_job("hlr", {"file_id": file_id})
+        return {"ok": True, "file_id": file_id, "job_id": job_id, "hlr_status": "processing"}
     except HTTPException:
         raise
     except Exception as e:
@@ -722,7 +842,7 @@ def download_hlr_raw(file_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/process_db")
-async def process_csv(background_tasks: BackgroundTasks, table_name: str | None = Query(default=None)):
+async def process_csv(table_name: str | None = Query(default=None)):
     # Read CSV text
 
     try:
@@ -732,8 +852,8 @@ async def process_csv(background_tasks: BackgroundTasks, table_name: str | None
         
         db_handler.create_db_entry(table_name, file_id, csv_path)
         print(f"csv_path: {csv_path}")
-        background_tasks.add_task(_process_db_export_job, file_id, table_name)
-        return {"file_id": file_id, "table_name": table_name, "status": "processing"}
+        job_id = db_handler.enqueue_job("db_export", {"file_id": file_id, "table_name": table_name})
+        return {"file_id": file_id, "job_id": job_id, "table_name": table_name, "status": "processing"}
     except Exception as e:  
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -748,26 +868,18 @@ def _process_db_export_job(file_id: str, table_name: str):
     """
     Runs in background. Exports the specified table to CSV,
     """
-    try:
-        meta = db_handler.get_db_exports_path(file_id)
-        if not meta:
-            return
-
-        file_path = meta["file_path"]
-        table_name = meta["table_name"]
-        db_export_status = db_handler.export_db_to_csv(table_name, file_path)
+    meta = db_handler.get_db_exports_path(file_id)
+    if not meta:
+        return
 
-        if db_export_status:
-            db_handler.upsert_db_export_status(
-                file_id=file_id,
-                status="completed",
-            )
+    file_path = meta["file_path"]
+    table_name = meta["table_name"]
+    db_export_status = db_handler.export_db_to_csv(table_name, file_path)
 
-    except Exception as e:
-        print(e)
+    if db_export_status:
         db_handler.upsert_db_export_status(
-            file_id = file_id, 
-            status="failed",
+            file_id=file_id,
+            status="completed",
         )
 
 @router.get("/db-download")
@@ -796,61 +908,45 @@ def download_processed(table_name: str | None = Query(default=None)):
 @router.get("/get-live-broadcasts-stream")
 def get_live_broadcasts_stream(search: str | None = Query(default=None)):
     date = datetime.utcnow().strftime("%Y-%m-%d")
-    handler = MMDDataHandler()
+    handler = MMDDataHandler(db_handler)
 
     def event_generator():
         # --- step 1: get broadcasts ---
         broadcasts = handler.get_broadcasts(date)
-        handler.get_links()
-
-        broadcast_df = pd.DataFrame(broadcasts)
-        broadcast_df["link_id"] = broadcast_df["message_body"].apply(
-            lambda x: x.split("{{link:")[1].split("}}")[0]
-        )
-        broadcast_df["url"] = broadcast_df["link_id"].apply(
-            lambda x: handler.links_dict.get(int(x), None)
-        )
-        broadcast_df["campaign_id"] = broadcast_df["url"].apply(
-            lambda x: x.split("m/")[1] if x else None
-        )
-        broadcast_df["real_price"] = broadcast_df["real_price"].apply(
-            lambda price: price / 100
-        )
-
-        # --- step 2: filter & limit (NO API CALLS YET) ---
-        grouped = {}
-        for _, row in broadcast_df.iterrows():
-            if row["state"] in [0, 2]:
-                continue
-            if search and search.lower() not in row["name"].lower():
-                continue
-
-            name = row["name"].split("_chunk")[0]
-            grouped.setdefault(name, [])
-
-            # if len(grouped[name]) >= 10:
-            #     continue
-
-            grouped[name].append(row)
-        
-        grouped_rows = {}
-        # --- step 3: sequential processing + streaming ---
-        for broadcast_name, rows in grouped.items():
-            results = []
-
-            for row in rows:
-                try:
-                    grouped_rows, data = handler.process_single_row(row, grouped_rows)
-                    if data:
-                        results.append(data)
-
-                        # 🔥 SEND PARTIAL UPDATE
-                        yield f"data: {json.dumps({'type': 'row','broadcast': broadcast_name,'row': data})}\n\n"
 
-                except Exception as e:
-                    yield f"data: {json.dumps({'type': 'error','broadcast': broadcast_name,'error': str(e)})}\n\n"
+        broadcast_df = handler.prepare_broadcasts(broadcasts)
+        if broadcast_df.empty:
+            yield "event: done\ndata: completed\n\n"
+            return
 
-                # t.sleep(0.25)  # <-- natural rate limiting
+        # --- step 2: filter (NO API CALLS YET) ---
+        selected = broadcast_df[~broadcast_df["state"].isin([0, 2])]
+        if search:
+            selected = selected[selected["name"].str.lower().str.contains(search.lower(), regex=False)]
+
+        def row_stats(rows):
+            stats = handler.broadcast_stats(handler.add_campaign_totals(rows)).astype(object)
+            return stats.where(stats.notna(), None).to_dict("records")
+
+        # --- step 3: per broadcast, fetch its campaign windows and stream its rows ---
+        for broadcast_name, rows in selected.groupby(selected["name"].str.split("_chunk").str[0], sort=False):
+            try:
+                results = [(data, None) for data in row_stats(rows)]
+            except Exception:
+                # A failed window only fails the rows that need it: redo the group row by row
+                results = []
+                for i in range(len(rows)):
+                    try:
+                        results.extend((data, None) for data in row_stats(rows.iloc[[i]]))
+                    except Exception as e:
+                        results.append((None, e))
+
+            for data, error in results:
+                if error is None:
+                    # 🔥 SEND PARTIAL UPDATE
+                    yield f"data: {json.dumps({'type': 'row','broadcast': broadcast_name,'row': data})}\n\n"
+                else:
+                    yield f"data: {json.dumps({'type': 'error','broadcast': broadcast_name,'error': str(error)})}\n\n"
 
             # 🔥 SEND BROADCAST COMPLETE EVENT
             yield f"data: {json.dumps({'type': 'broadcast_done','broadcast': broadcast_name})}\n\n"
@@ -920,7 +1016,7 @@ def list_encrypted_files(status: str | None = Query(default=None)):
         print(e)
 
 @router.post("/{file_id}/process-encrypted")
-def start_processing(file_id: str, background_tasks: BackgroundTasks):
+def start_processing(file_id: str):
     try:
         # Try to mark processing (fails if another processing exists due to DB unique index)
         try:
@@ -931,8 +1027,8 @@ def start_processing(file_id: str, background_tasks: BackgroundTasks):
         if not ok:
             raise HTTPException(status_code=400, detail="File not found or not eligible for processing")
 
-        background_tasks.add_task(_process_encrypted_file_job, file_id)
-        return {"ok": True, "file_id": file_id, "status": "processing"}
+        job_id = db_handler.enqueue_job("encrypt_file", {"file_id": file_id})
+        return {"ok": True, "file_id": file_id, "job_id": job_id, "status": "processing"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -979,42 +1075,38 @@ def _process_encrypted_file_job(file_id: str):
     Runs in background. Reads raw CSV, cleans, writes processed CSV,
     computes stats, updates DB.
     """
-    try:
-        meta = db_handler.get_encrypted_file_paths(file_id)
-        if not meta:
-            return
-
-        raw_path = meta["raw_file_path"]
-        processed_path = os.path.join(PROCESSED_ENCRYPTED_DIR, f"{file_id}.csv")
-
-        # Read raw CSV
-        with open(raw_path, "r", encoding="utf-8", newline="") as f:
-            content = f.read()
-        # Your earlier parser used fieldnames=["record"].
-        # If your CSV is single-column lines, keep it:
-        reader = csv.DictReader(io.StringIO(content), fieldnames=["record"])
-        rows = list(reader)
-        print("Starting")
-        values = [row['record'] for row in rows]
-        print(values)
-        encrypted_rows = db_handler.encrypt_and_save_csv(values)
-        print("Ending", encrypted_rows)
-
-        # Write processed rows to CSV (1 column)
-        with open(processed_path, "w", encoding="utf-8", newline="") as out:
-            w = csv.writer(out)
-            for pr, en_r in zip(values, encrypted_rows):
-                # If pr is dict-like, adapt accordingly.
-                # If it's already the value for "record", write single column:
-                w.writerow([pr, en_r])
-
-        db_handler.mark_encrypted_processed(
-            file_id=file_id,
-            processed_path=processed_path,
-        )
-
-    except Exception as e:
-        db_handler.mark_encrypted_failed(file_id, str(e))
+    meta = db_handler.get_encrypted_file_paths(file_id)
+    if not meta:
+        return
+
+    raw_path = meta["raw_file_path"]
+    processed_path = os.path.join(PROCESSED_ENCRYPTED_DIR, f"{file_id}.csv")
+
+    # Read raw CSV
+    with open(raw_path, "r", encoding="utf-8", newline="") as f:
+        content = f.read()
+    # Your earlier parser used fieldnames=["record"].
+    # If your CSV is single-column lines, keep it:
+    reader = csv.DictReader(io.StringIO(content), fieldnames=["record"])
+    rows = list(reader)
+    print("Starting")
+    values = [row['record'] for row in rows]
+    print(values)
+    encrypted_rows = db_handler.encrypt_and_save_csv(values)
+    print("Ending", encrypted_rows)
+
+    # Write processed rows to CSV (1 column)
+    with open(processed_path, "w", encoding="utf-8", newline="") as out:
+        w = csv.writer(out)
+        for pr, en_r in zip(values, encrypted_rows):
+            # If pr is dict-like, adapt accordingly.
+            # If it's already the value for "record", write single column:
+            w.writerow([pr, en_r])
+
+    db_handler.mark_encrypted_processed(
+        file_id=file_id,
+        processed_path=processed_path,
+    )
 
 # --------------------------------------------
 @router.get("/files-broadcasts")
@@ -1270,7 +1362,7 @@ class SmartCleaningProcessRequest(BaseModel):
     offers: list[str]
 
 @router.post("/{file_id}/process-smart-cleaning-files-voluum")
-def start_processing_smart_cleaning_voluum(file_id: str, body: SmartCleaningProcessRequest, background_tasks: BackgroundTasks, filter_regs: bool = Query(False), filter_last_24h: bool = Query(False)):
+def start_processing_smart_cleaning_voluum(file_id: str, body: SmartCleaningProcessRequest, filter_regs: bool = Query(False), filter_last_24h: bool = Query(False)):
     if not body.offers:
         raise HTTPException(status_code=400, detail="At least one offer is required")
     try:
@@ -1280,8 +1372,13 @@ def start_processing_smart_cleaning_voluum(file_id: str, body: SmartCleaningProc
     if not ok:
         raise HTTPException(status_code=400, detail="File not found or not eligible for processing")
 
-    background_tasks.add_task(_process_smart_cleaning_files_voluum_job, file_id, body.offers, filter_regs, filter_last_24h)
-    return {"ok": True, "file_id": file_id, "status": "processing"}
+    job_id = db_handler.enqueue_job("smart_cleaning_voluum", {
+        "file_id": file_id,
+        "offer_names": body.offers,
+        "filter_regs": filter_regs,
+        "filter_last_24h": filter_last_24h,
+    })
+    return {"ok": True, "file_id": file_id, "job_id": job_id, "status": "processing"}
 
 @router.post("/{file_id}/archive-smart-cleaning-files-voluum")
 def archive_smart_cleaning_voluum_file(file_id: str):
@@ -1328,68 +1425,64 @@ def _process_smart_cleaning_files_voluum_job(file_id: str, offer_names: list[str
     Runs in background. Reads raw CSV, cleans, writes processed CSV,
     computes stats, updates DB. Supports multiple offers.
     """
-    try:
-        meta = db_handler.get_smart_cleaning_files_voluum_file_paths(file_id)
-        if not meta:
-            return
-        raw_path = meta["raw_file_path"]
-        processed_path = os.path.join(PROCESSED_SMART_CLEANING_VOLUUM_DIR, f"{file_id}.csv")
-        # Read raw CSV — may have 1 column (uploaded) or 2 columns (country-code search)
-        with open(raw_path, "r", encoding="utf-8", newline="") as f:
-            content = f.read()
-
-        # Detect if CSV has 2 columns (record, timestamp_created) or 1 column (record only)
-        first_line = content.split("\n")[0] if content else ""
-        has_timestamp = "," in first_line
-
-        if has_timestamp:
-            reader = csv.DictReader(io.StringIO(content), fieldnames=["record", "timestamp_created"])
-            rows = list(reader)
-            values = [row['record'] for row in rows]
-            # Build a dict mapping phone number -> timestamp string
-            timestamp_map = {}
-            for row in rows:
-                timestamp_map[row['record']] = row['timestamp_created']
-        else:
-            reader = csv.DictReader(io.StringIO(content), fieldnames=["record"])
-            rows = list(reader)
-            values = [row['record'] for row in rows]
-            timestamp_map = {}
-
-        # If filter_last_24h, remove numbers that appear in voluum_live_events
-        # within the last 24 hours for the selected offer(s)
-        if filter_last_24h:
-            live_24h_numbers = db_handler.get_live_events_last_24h(offer_names)
-            before_count = len(values)
-            values = [v for v in values if v not in live_24h_numbers]
-            print(f"After last-24h SNS filtering: {len(values)} keys remain (removed {before_count - len(values)})")
-
-        # Filter across all selected offers
-        filtered_rows = values
-        for offer_name in offer_names:
-            filtered_rows = db_handler.filter_phone_numbers_offers(filtered_rows, offer_name, filter_regs)
-
-        count = len(filtered_rows)
-        if filtered_rows:
-            with open(processed_path, "w", encoding="utf-8", newline="") as out:
-                w = csv.writer(out)
-                for pr in filtered_rows:
-                    ts = timestamp_map.get(pr, "")
-                    if ts:
-                        w.writerow([pr, ts])
-                    else:
-                        w.writerow([pr])
-
-        combined_offer_name = "^".join(offer_names)
-        db_handler.mark_smart_cleaning_files_voluum_processed(
-            file_id=file_id,
-            processed_path=processed_path,
-            record_count=count,
-            offer_name=combined_offer_name
-        )
-
-    except Exception as e:
-        db_handler.mark_smart_cleaning_files_voluum_failed(file_id, str(e))
+    meta = db_handler.get_smart_cleaning_files_voluum_file_paths(file_id)
+    if not meta:
+        return
+    raw_path = meta["raw_file_path"]
+    processed_path = os.path.join(PROCESSED_SMART_CLEANING_VOLUUM_DIR, f"{file_id}.csv")
+    # Read raw CSV — may have 1 column (uploaded) or 2 columns (country-code search)
+    with open(raw_path, "r", encoding="utf-8", newline="") as f:
+        content = f.read()
+
+    # Detect if CSV has 2 columns (record, timestamp_created) or 1 column (record only)
+    first_line = content.split("\n")[0] if content else ""
+    has_timestamp = "," in first_line
+
+    if has_timestamp:
+        reader = csv.DictReader(io.StringIO(content), fieldnames=["record", "timestamp_created"])
+        rows = list(reader)
+        values = [row['record'] for row in rows]
+        # Build a dict mapping phone number -> timestamp string
+        timestamp_map = {}
+        for row in rows:
+            timestamp_map[row['record']] = row['timestamp_created']
+    else:
+        reader = csv.DictReader(io.StringIO(content), fieldnames=["record"])
+        rows = list(reader)
+        values = [row['record'] for row in rows]
+        timestamp_map = {}
+
+    # If filter_last_24h, remove numbers that appear in voluum_live_events
+    # within the last 24 hours for the selected offer(s)
+    if filter_last_24h:
+        live_24h_numbers = db_handler.get_live_events_last_24h(offer_names)
+        before_count = len(values)
+        values = [v for v in values if v not in live_24h_numbers]
+        print(f"After last-24h SNS filtering: {len(values)} keys remain (removed {before_count - len(values)})")
+
+    # Filter across all selected offers
+    filtered_rows = values
+    for offer_name in offer_names:
+        filtered_rows = db_handler.filter_phone_numbers_offers(filtered_rows, offer_name, filter_regs)
+
+    count = len(filtered_rows)
+    if filtered_rows:
+        with open(processed_path, "w", encoding="utf-8", newline="") as out:
+            w = csv.writer(out)
+            for pr in filtered_rows:
+                ts = timestamp_map.get(pr, "")
+                if ts:
+                    w.writerow([pr, ts])
+                else:
+                    w.writerow([pr])
+
+    combined_offer_name = "^".join(offer_names)
+    db_handler.mark_smart_cleaning_files_voluum_processed(
+        file_id=file_id,
+        processed_path=processed_path,
+        record_count=count,
+        offer_name=combined_offer_name
+    )
 
 # ------------ REG Search Routes --------------
 
@@ -1429,7 +1522,7 @@ class RegSearchProcessRequest(BaseModel):
     offers: list[str]
 
 @router.post("/reg-search/{file_id}/process")
-def process_reg_search(file_id: str, body: RegSearchProcessRequest, background_tasks: BackgroundTasks):
+def process_reg_search(file_id: str, body: RegSearchProcessRequest):
     if not body.offers:
         raise HTTPException(status_code=400, detail="At least one offer is required")
     try:
@@ -1439,8 +1532,8 @@ def process_reg_search(file_id: str, body: RegSearchProcessRequest, background_t
     if not ok:
         raise HTTPException(status_code=400, detail="Entry not found or not eligible for processing")
 
-    background_tasks.add_task(_process_reg_search_job, file_id, body.offers)
-    return {"ok": True, "file_id": file_id, "status": "processing"}
+    job_id = db_handler.enqueue_job("reg_search", {"file_id": file_id, "offer_names": body.offers})
+    return {"ok": True, "file_id": file_id, "job_id": job_id, "status": "processing"}
 
 @router.get("/reg-search/{file_id}/download")
 def download_reg_search(file_id: str):
@@ -1483,36 +1576,32 @@ def _process_reg_search_job(file_id: str, offer_names: list[str]):
     Background job: find REG-only numbers for the given country + multiple offers,
     write them to CSV, update DB. Reads from_date/to_date from DB.
     """
-    try:
-        meta = db_handler.get_reg_search_meta(file_id)
-        if not meta:
-            return
-
-        country_code = meta["country_code"]
-        from_date = meta.get("from_date")
-        to_date = meta.get("to_date")
-        processed_path = os.path.join(PROCESSED_REG_SEARCH_DIR, f"{file_id}.csv")
-
-        reg_only_numbers = db_handler.find_reg_only_numbers(country_code, offer_names, from_date, to_date)
-        count = len(reg_only_numbers)
-
-        # Write to CSV
-        with open(processed_path, "w", encoding="utf-8", newline="") as out:
-            w = csv.writer(out)
-            for num in reg_only_numbers:
-                w.writerow([num])
-
-        offers_joined = "^".join(offer_names)
-        db_handler.mark_reg_search_processed(
-            file_id=file_id,
-            cleaned_path=processed_path,
-            total_regs=count,
-            clean_count=count,
-            offer_name=offers_joined,
-        )
-
-    except Exception as e:
-        db_handler.mark_reg_search_failed(file_id, str(e))
+    meta = db_handler.get_reg_search_meta(file_id)
+    if not meta:
+        return
+
+    country_code = meta["country_code"]
+    from_date = meta.get("from_date")
+    to_date = meta.get("to_date")
+    processed_path = os.path.join(PROCESSED_REG_SEARCH_DIR, f"{file_id}.csv")
+
+    reg_only_numbers = db_handler.find_reg_only_numbers(country_code, offer_names, from_date, to_date)
+    count = len(reg_only_numbers)
+
+    # Write to CSV
+    with open(processed_path, "w", encoding="utf-8", newline="") as out:
+        w = csv.writer(out)
+        for num in reg_only_numbers:
+            w.writerow([num])
+
+    offers_joined = "^".join(offer_names)
+    db_handler.mark_reg_search_processed(
+        file_id=file_id,
+        cleaned_path=processed_path,
+        total_regs=count,
+        clean_count=count,
+        offer_name=offers_joined,
+    )
 
 # ------------ Blacklist CSV Import Routes --------------
 
@@ -1546,4 +1635,35 @@ async def import_blacklist_csv(file: UploadFile = File(...)):
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
 
-# --------------------------------------------
\ No newline at end of file
+# --------------------------------------------
+
+# ------------ Background Jobs --------------
+
+def _mark_db_export_failed(file_id: str, error_message: str):
+    db_handler.upsert_db_export_status(file_id=file_id, status="failed")
+
+# Job type -> (job function, on_failure(file_id, error_message)); run by worker.py processes.
+# Job functions raise on failure; the attempt is retried and on_failure is used once max_attempts is used up.
+JOB_HANDLERS = {
+    "process_file": (_process_file_job, _mark_file_job_failed),
+    "hlr": (_hlr_job, _mark_hlr_job_failed),
+    "db_export": (_process_db_export_job, _mark_db_export_failed),
+    "encrypt_file": (_process_encrypted_file_job, db_handler.mark_encrypted_failed),
+    "smart_cleaning_voluum": (_process_smart_cleaning_files_voluum_job, db_handler.mark_smart_cleaning_files_voluum_failed),
+    "reg_search": (_process_reg_search_job, db_handler.mark_reg_search_failed),
+}
+
+@router.get("/jobs")
+def list_jobs(status: str | None = Query(default=None), limit: int = Query(100, ge=1, le=1000)):
+    try:
+        statuses = status.split(",") if status else None
+        return {"items": db_handler.list_jobs(statuses, limit)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: int):
+    row = db_handler.get_job(job_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return row
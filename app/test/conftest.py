@@ -0,0 +1,5 @@
+import base64
+import os
+
+# The handlers build an EncryptionHandler at import time; the unit tests never encrypt anything
+os.environ.setdefault("AES_KEY", base64.urlsafe_b64encode(b"0" * 32).decode())
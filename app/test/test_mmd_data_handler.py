@@ -0,0 +1,225 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+import requests
+
+from app.utils import mmd_data_handler
+from app.utils.mmd_data_handler import BROADCAST_DLR_COUNTS, MMDDataHandler, VOLUUM_WINDOW_FORMAT
+from app.utils.voluum_data_handler import TokenBucket
+
+
+def test_campaign_windows_closed_window_spans_24_hours():
+    from_dates, to_dates = MMDDataHandler().campaign_windows(
+        pd.Series(["2026-01-20T13:45:12.123Z", "2026-01-20T00:00:00.000Z"])
+    )
+    assert from_dates.tolist() == ["2026-01-20T13:00:00.000Z", "2026-01-20T00:00:00.000Z"]
+    assert to_dates.tolist() == ["2026-01-21T13:00:00.000Z", "2026-01-21T00:00:00.000Z"]
+
+
+def test_campaign_windows_open_window_ends_at_the_current_hour():
+    sent = pd.Timestamp.now(tz="UTC") - pd.Timedelta(hours=2)
+    from_dates, to_dates = MMDDataHandler().campaign_windows(
+        pd.Series([sent.strftime("%Y-%m-%dT%H:%M:%S.000Z")])
+    )
+    now = pd.Timestamp.now(tz="UTC").floor("h")
+    assert from_dates.tolist() == [sent.floor("h").strftime(VOLUUM_WINDOW_FORMAT)]
+    assert to_dates.tolist() == [now.strftime(VOLUUM_WINDOW_FORMAT)]
+
+
+def broadcast(broadcast_id, message_body, dlr):
+    return {
+        "id": broadcast_id,
+        "name": f"bc_chunk{broadcast_id}",
+        "state": 1,
+        "send_date": "2026-01-20T13:45:12.123Z",
+        "estimated_price": 1234,
+        "recipient_count": 10,
+        "real_price": 250,
+        "message_body": message_body,
+        "broadcastConversion": {"uniqueClicks": 1, "totalClicks": 2, "recipientCount": 10, "conversion": "10"},
+        "dlr": dlr,
+    }
+
+
+def test_prepare_broadcasts_handles_missing_links_and_dlr(monkeypatch):
+    handler = MMDDataHandler()
+    handler.links_dict = {1: "https://trk.io/m/aaa"}
+    fetched_after = []
+
+    def fetch_links(after_id=None):
+        fetched_after.append(after_id)
+        return {}
+
+    monkeypatch.setattr(handler, "fetch_links", fetch_links)
+
+    df = handler.prepare_broadcasts([
+        broadcast(1, "hi {{link:1}} x", {"delivered_count": 5, "sent_count": 6, "undelivered_count": 1, "rejected_count": 0}),
+        broadcast(2, "no link here", None),
+        broadcast(3, "hi {{link:55}} x", {}),
+        broadcast(4, "hi {{link:1}} x", {"delivered_count": 2}),
+    ])
+
+    # Only the unknown link triggers one incremental sync
+    assert fetched_after == [1]
+    assert df["campaign_id"].tolist()[0] == "aaa"
+    assert df["campaign_id"].iloc[1:3].isna().all()
+    assert df["campaign_id"].iloc[3] == "aaa"
+    assert df["link_id"].isna().tolist() == [False, True, False, False]
+    assert df["dlr.delivered_count"].tolist() == [5, 0, 0, 2]
+    assert df["dlr.sent_count"].tolist() == [6, 0, 0, 0]
+    assert df["dlr.rejected_count"].dtype == "int64"
+    assert df["real_price"].tolist() == [2.5] * 4
+
+
+def test_prepare_broadcasts_without_any_dlr_or_links(monkeypatch):
+    handler = MMDDataHandler()
+    monkeypatch.setattr(handler, "fetch_links", lambda after_id=None: {})
+
+    df = handler.prepare_broadcasts([broadcast(1, "no link", None), broadcast(2, "still none", None)])
+
+    assert df["campaign_id"].isna().all()
+    assert (df[[f"dlr.{count}" for count in BROADCAST_DLR_COUNTS]] == 0).all().all()
+
+
+def test_prepare_broadcasts_empty():
+    assert MMDDataHandler().prepare_broadcasts([]).empty
+
+
+class FakeVoluumSession:
+    """Records each POSTed batch and answers with respond(campaign ids, call number)."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.batches = []
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        campaign_ids = [entry["campaignId"] for entry in json["costUpdateRequests"]]
+        self.batches.append(campaign_ids)
+        status = self.respond(campaign_ids, len(self.batches))
+        if isinstance(status, Exception):
+            raise status
+        return SimpleNamespace(status_code=status)
+
+
+@pytest.fixture
+def cost_updates(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(mmd_data_handler, "VOLUUM_COST_UPDATE_BATCH_SIZE", 2)
+    monkeypatch.setattr(mmd_data_handler, "VOLUUM_COST_UPDATE_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(mmd_data_handler, "VOLUUM_BACKOFF_SECONDS", 1)
+    monkeypatch.setattr(mmd_data_handler, "voluum_cost_limiter", TokenBucket(0, 1))
+    monkeypatch.setattr(mmd_data_handler.access_key_handler, "get_access_token", lambda: "token")
+    monkeypatch.setattr(mmd_data_handler.time, "sleep", sleeps.append)
+
+    def submit(respond, campaign_ids):
+        session = FakeVoluumSession(respond)
+        monkeypatch.setattr(mmd_data_handler, "voluum_session", session)
+        statuses = MMDDataHandler().submit_cost_updates([{"campaignId": campaign_id, "cost": 1.0} for campaign_id in campaign_ids])
+        return statuses, session.batches, sleeps
+
+    return submit
+
+
+def test_submit_cost_updates_sends_batches(cost_updates):
+    statuses, batches, sleeps = cost_updates(lambda ids, call: 200, ["a", "b", "c", "d", "e"])
+    assert batches == [["a", "b"], ["c", "d"], ["e"]]
+    assert statuses == dict.fromkeys("abcde", 200)
+    assert sleeps == []
+
+
+def test_submit_cost_updates_splits_a_rejected_batch(cost_updates, monkeypatch):
+    monkeypatch.setattr(mmd_data_handler, "VOLUUM_COST_UPDATE_BATCH_SIZE", 4)
+    statuses, batches, _ = cost_updates(lambda ids, call: 400 if "bad" in ids else 200, ["a", "bad", "c", "d"])
+    assert batches == [["a", "bad", "c", "d"], ["a", "bad"], ["a"], ["bad"], ["c", "d"]]
+    assert statuses == {"a": 200, "bad": 400, "c": 200, "d": 200}
+
+
+def test_submit_cost_updates_does_not_split_on_auth_errors(cost_updates):
+    statuses, batches, _ = cost_updates(lambda ids, call: 401, ["a", "b"])
+    assert batches == [["a", "b"]]
+    assert statuses == {"a": 401, "b": 401}
+
+
+def test_submit_cost_updates_retries_with_backoff(cost_updates):
+    statuses, batches, sleeps = cost_updates(lambda ids, call: 503 if call < 3 else 200, ["a", "b"])
+    assert batches == [["a", "b"]] * 3
+    assert sleeps == [1, 2]
+    assert statuses == {"a": 200, "b": 200}
+
+
+def test_submit_cost_updates_gives_up_after_max_attempts(cost_updates):
+    statuses, batches, sleeps = cost_updates(lambda ids, call: requests.ConnectionError("down"), ["a"])
+    assert batches == [["a"]] * 3
+    assert sleeps == [1, 2]
+    assert statuses == {"a": 0}
+
+
+class FakeBroadcastStore:
+    def __init__(self, state):
+        self.state = state
+        self.stored = []
+        self.syncs = []
+
+    def get_mmd_broadcast_sync(self):
+        return self.state
+
+    def upsert_mmd_broadcasts(self, broadcasts):
+        self.stored.extend(broadcasts)
+
+    def set_mmd_broadcast_sync(self, covered_from, synced_at, refreshed_at=None):
+        self.syncs.append((covered_from, synced_at, refreshed_at))
+
+
+SEND_FROM = datetime(2026, 1, 20, tzinfo=timezone.utc)
+SETTLE = timedelta(hours=mmd_data_handler.MMD_BROADCAST_SETTLE_HOURS)
+OVERLAP = timedelta(seconds=mmd_data_handler.MMD_BROADCAST_SYNC_OVERLAP_SECONDS)
+
+
+def sync_stop_point(monkeypatch, state, send_from=SEND_FROM, refresh=True):
+    """Run sync_broadcasts and return (stop_before passed to fetch_broadcasts, recorded sync row)."""
+    store = FakeBroadcastStore(state)
+    handler = MMDDataHandler(store)
+    stops = []
+
+    def fetch_broadcasts(stop_before):
+        stops.append(stop_before)
+        return [{"id": 1, "send_date": "2026-01-21T10:00:00.000Z"}]
+
+    monkeypatch.setattr(handler, "fetch_broadcasts", fetch_broadcasts)
+    handler.sync_broadcasts(send_from, refresh)
+    assert [broadcast_id for broadcast_id, _, _ in store.stored] == [1]
+    assert len(stops) == 1 and len(store.syncs) == 1
+    return stops[0], store.syncs[0]
+
+
+def test_sync_broadcasts_first_sync_fetches_from_send_from(monkeypatch):
+    stop_before, (covered_from, synced_at, refreshed_at) = sync_stop_point(monkeypatch, None)
+    assert stop_before == covered_from == SEND_FROM
+    assert refreshed_at == synced_at
+
+
+def test_sync_broadcasts_store_not_reaching_back_fetches_from_send_from(monkeypatch):
+    now = datetime.now(timezone.utc)
+    state = (SEND_FROM + timedelta(days=2), now, now)
+    stop_before, (covered_from, _, refreshed_at) = sync_stop_point(monkeypatch, state)
+    assert stop_before == covered_from == SEND_FROM
+    assert refreshed_at is not None
+
+
+def test_sync_broadcasts_refresh_reaches_back_the_settle_window(monkeypatch):
+    refreshed = datetime.now(timezone.utc) - timedelta(hours=1)
+    state = (SEND_FROM - timedelta(days=5), refreshed + timedelta(minutes=30), refreshed)
+    stop_before, (covered_from, synced_at, refreshed_at) = sync_stop_point(monkeypatch, state, refresh=True)
+    assert stop_before == covered_from == refreshed - SETTLE
+    assert refreshed_at == synced_at
+
+
+def test_sync_broadcasts_tail_sync_reaches_back_the_overlap_only(monkeypatch):
+    synced = datetime.now(timezone.utc) - timedelta(minutes=2)
+    state = (SEND_FROM - timedelta(days=5), synced, synced - timedelta(minutes=5))
+    stop_before, (covered_from, _, refreshed_at) = sync_stop_point(monkeypatch, state, refresh=False)
+    assert stop_before == covered_from == synced - OVERLAP
+    # Not a settle refresh: refreshed_at is left as it was
+    assert refreshed_at is None
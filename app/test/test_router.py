@@ -0,0 +1,36 @@
+import psycopg2
+import pytest
+
+try:
+    from app.router import _iter_record_chunks
+except psycopg2.OperationalError:
+    pytest.skip("app.router opens its database pool at import", allow_module_level=True)
+
+
+def write_csv(tmp_path, content):
+    path = tmp_path / "raw.csv"
+    path.write_bytes(content.encode("utf-8"))
+    return str(path)
+
+
+def records(chunks):
+    return [[row["record"] for row in chunk] for chunk in chunks]
+
+
+def test_iter_record_chunks_yields_full_chunks_then_the_rest(tmp_path):
+    path = write_csv(tmp_path, "".join(f"44700{i}\n" for i in range(5)))
+    assert records(_iter_record_chunks(path, 2)) == [["447000", "447001"], ["447002", "447003"], ["447004"]]
+
+
+def test_iter_record_chunks_exact_multiple_has_no_empty_chunk(tmp_path):
+    path = write_csv(tmp_path, "1\n2\n3\n4\n")
+    assert records(_iter_record_chunks(path, 2)) == [["1", "2"], ["3", "4"]]
+
+
+def test_iter_record_chunks_strips_bom_and_handles_crlf(tmp_path):
+    path = write_csv(tmp_path, "\ufeff447001\r\n447002\r\n447003")
+    assert records(_iter_record_chunks(path, 10)) == [["447001", "447002", "447003"]]
+
+
+def test_iter_record_chunks_empty_file(tmp_path):
+    assert list(_iter_record_chunks(write_csv(tmp_path, ""), 10)) == []
@@ -0,0 +1,60 @@
+import pytest
+
+from app.utils import voluum_data_handler
+from app.utils.voluum_data_handler import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(voluum_data_handler, "monotonic", clock.monotonic)
+    monkeypatch.setattr(voluum_data_handler, "sleep", clock.sleep)
+    return clock
+
+
+def test_acquire_spends_the_burst_without_waiting(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+
+def test_acquire_waits_for_the_next_token_once_empty(clock):
+    bucket = TokenBucket(rate=2, capacity=1)
+    bucket.acquire()
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5), pytest.approx(0.5)]
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_acquire_refills_while_idle_up_to_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=2)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 10
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_acquire_is_a_no_op_without_a_rate(clock):
+    bucket = TokenBucket(rate=0, capacity=0)
+    for _ in range(100):
+        bucket.acquire()
+    assert clock.sleeps == []
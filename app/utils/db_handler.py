@@ -1,9 +1,9 @@
 import psycopg2
 from psycopg2 import sql
-from psycopg2.extras import execute_values
+from psycopg2.extras import execute_values, Json
 import os
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, date, timedelta
 from time import time
 import pandas as pd
 import numpy as np
@@ -11,18 +11,149 @@ import json
 from contextlib import contextmanager
 from datetime import datetime
 from app.utils.encryption_handler import EncryptionHandler
+from app.utils.db_pool import get_pool
+from app.utils.suppression_index import get_suppression_index, SUPPRESSION_INDEX_ENABLED
 from pathlib import Path
 import csv
+import io
 
 load_dotenv()
 
+# Voluum report row -> staging/table column
+VOLUUM_REPORT_COLUMNS = {
+    "customVariable1": "custom_variable_1",
+    "ip": "ip",
+    "osVersion": "os_version",
+    "browserVersion": "browser_version",
+    "category": "category",
+    "Click2Reg": "click_2_reg",
+    "Reg2FTD": "reg_2_ftd",
+    "clicks": "clicks",
+    "conversions": "conversions",
+    "cost": "cost",
+    "costSources": "cost_sources",
+    "cpv": "cpv",
+    "customConversions1": "custom_conversions_1",
+    "customConversions2": "custom_conversions_2",
+    "customConversions3": "custom_conversions_3",
+    "customRevenue1": "custom_revenue_1",
+    "customRevenue2": "custom_revenue_2",
+    "customRevenue3": "custom_revenue_3",
+    "cv": "cv",
+    "epv": "epv",
+    "errors": "errors",
+    "profit": "profit",
+    "revenue": "revenue",
+    "roi": "roi",
+    "suspiciousClicks": "suspicious_clicks",
+    "suspiciousClicksPercentage": "suspicious_clicks_percentage",
+    "suspiciousVisits": "suspicious_visits",
+    "suspiciousVisitsPercentage": "suspicious_visits_percentage",
+    "uniqueVisits": "unique_visits",
+    "visits": "visits",
+}
+
+# Category tables a Voluum clicker can live in (exactly one at a time)
+CATEGORY_TABLES = [("blacklist", "BLACKLIST"), ("monitor", "MONITOR"), ("whitelist", "WHITELIST")]
+
+# Columns shared by api_voluum_ts_sources, whitelist, blacklist and monitor
+VOLUUM_METRIC_COLUMNS = [
+    "click_2_reg", "reg_2_ftd", "clicks", "conversions", "cost", "cost_sources", "cpv",
+    "custom_conversions_1", "custom_conversions_2", "custom_conversions_3",
+    "custom_revenue_1", "custom_revenue_2", "custom_revenue_3",
+    "cv", "epv", "errors", "profit", "revenue", "roi",
+    "suspicious_clicks", "suspicious_clicks_percentage",
+    "suspicious_visits", "suspicious_visits_percentage",
+    "unique_visits", "visits",
+]
+
+# raw_live_voluum_sns_data partitioning: "day" or "week" partitions, created this many
+# partitions ahead, dropped once entirely older than the retention window (0 keeps everything)
+RAW_LIVE_PARTITION_INTERVAL = os.getenv("RAW_LIVE_PARTITION_INTERVAL", "day")
+RAW_LIVE_PARTITIONS_AHEAD = int(os.getenv("RAW_LIVE_PARTITIONS_AHEAD", "7"))
+RAW_LIVE_RETENTION_DAYS = int(os.getenv("RAW_LIVE_RETENTION_DAYS", "90"))
+
+# HLR result field -> api_hlr_live_numbers column (besides custom_variable_1)
+HLR_RAW_COLUMNS = {
+    "error": "error",
+
+    "request_parameters.telephone_number": "request_parameters_telephone_number",
+    "request_parameters.cache_days_private": "request_parameters_cache_days_private",
+    "request_parameters.cache_days_global": "request_parameters_cache_days_global",
+    "request_parameters.save_to_cache": "request_parameters_save_to_cache",
+    "request_parameters.output_format": "request_parameters_output_format",
+
+    "credits_spent": "credits_spent",
+
+    "detected_telephone_number": "detected_telephone_number",
+    "formatted_telephone_number": "formatted_telephone_number",
+    "telephone_number_type": "telephone_number_type",
+
+    "live_status": "live_status",
+
+    "original_network": "original_network",
+    "original_network_details.name": "original_network_details_name",
+    "original_network_details.mccmnc": "original_network_details_mccmnc",
+    "original_network_details.country_name": "original_network_details_country_name",
+    "original_network_details.country_iso3": "original_network_details_country_iso3",
+    "original_network_details.area": "original_network_details_area",
+    "original_network_details.country_prefix": "original_network_details_country_prefix",
+
+    "current_network": "current_network",
+    "current_network_details.name": "current_network_details_name",
+    "current_network_details.mccmnc": "current_network_details_mccmnc",
+    "current_network_details.country_name": "current_network_details_country_name",
+    "current_network_details.country_iso3": "current_network_details_country_iso3",
+    "current_network_details.country_prefix": "current_network_details_country_prefix",
+
+    "is_ported": "is_ported",
+    "timestamp": "timestamp",
+}
+
+# Live event payload key -> column, shared by raw_live_voluum_sns_data and voluum_live_events
+LIVE_EVENT_FIELDS = {
+    "clickId": "click_id",
+    "campaignId": "campaign_id",
+    "offerId": "offer_id",
+    "timestamp": "timestamp",
+    "externalId": "external_id",
+    "trafficSourceId": "traffic_source_id",
+    "landerId": "lander_id",
+    "affiliateNetworkId": "affiliate_network_id",
+    "brand": "brand",
+    "browser": "browser",
+    "browserVersion": "browser_version",
+    "device": "device",
+    "model": "model",
+    "os": "os",
+    "osVersion": "os_version",
+    "city": "city",
+    "region": "region",
+    "countryCode": "country_code",
+    "isp": "isp",
+    "ip": "ip",
+    "referrer": "referrer",
+    "url": "url",
+    "userAgent": "user_agent",
+    "language": "language",
+    "mobileCarrier": "mobile_carrier",
+    "connectionType": "connection_type",
+    "flowId": "flow_id",
+    "pathId": "path_id",
+}
+
 class DBHandler:
     def __init__(self, batch_size=10000):
         self.db_host = os.getenv("DB_HOST")
         self.db_name = os.getenv("DB_NAME")
         self.db_user = os.getenv("DB_USER")
         self.db_pass = os.getenv("DB_PASSWORD")
-        self.connect()
+        self.pool = get_pool({
+            "host": self.db_host,
+            "database": self.db_name,
+            "user": self.db_user,
+            "password": self.db_pass,
+        })
         self.batch_size = batch_size
         # Loading the country code file
         self.country_codes = json.load(open('app/utils/country_codes.json', 'r'))
@@ -34,22 +165,15 @@ class DBHandler:
             reverse=True,
         )
         self.encryption_handler = EncryptionHandler()
+        # Optional in-memory membership index (SUPPRESSION_INDEX_ENABLED=true); None means plain SQL lookups
+        self.suppression_index = get_suppression_index(self._cursor) if SUPPRESSION_INDEX_ENABLED else None
 
-    def connect(self):
-        try:
-            self.connection = psycopg2.connect(
-                host=self.db_host,
-                database=self.db_name,
-                user=self.db_user,
-                password=self.db_pass
-            )
-        except Exception as e:
-            self.connection = psycopg2.connect(
-                host=self.db_host,
-                database=self.db_name,
-                user=self.db_user,
-                password=self.db_pass
-            )
+    def _get_suppression_index(self, table_name):
+        """The refreshed suppression index if it covers table_name, else None."""
+        if self.suppression_index is None or table_name not in self.suppression_index.tables:
+            return None
+        self.suppression_index.ensure_fresh()
+        return self.suppression_index
 
     def get_country_code_from_phone(self, phone: str) -> str | None:
         """
@@ -71,23 +195,66 @@ class DBHandler:
                 return iso2
         return None
 
+    def get_country_codes_from_phones(self, phones: pd.Series) -> pd.Series:
+        """
+        Vectorised get_country_code_from_phone for a whole Series.
+        Matches one prefix length at a time, longest first, so each row keeps
+        the longest calling code it starts with. Unmatched rows are None.
+        """
+        phones = phones.astype(str).str.strip().str.replace(r"^(\+|00)", "", regex=True)
+        result = pd.Series(None, index=phones.index, dtype=object)
+        for length in sorted({len(prefix) for prefix, _ in self._calling_code_prefixes}, reverse=True):
+            unmatched = result.isna()
+            if not unmatched.any():
+                break
+            result[unmatched] = phones[unmatched].str[:length].map(self.calling_codes)
+        return result.where(result.notna(), None)
+
     @contextmanager
     def _cursor(self):
         """
-        Safe cursor context manager.
-        - Reconnects if the connection is closed/broken.
-        - On success: the caller is responsible for commit().
-        - On exception: automatically rolls back so the connection
-          stays usable for other queries.
+        Unit-of-work cursor context manager.
+        - Checks out a connection from the shared pool (blocks if all are busy).
+        - On success: commits, so every `with self._cursor()` block is one transaction.
+        - On exception: rolls back and discards the connection if it is broken.
+        - Always returns the connection to the pool, so concurrent requests and
+          background jobs never share a transaction.
         """
-        if self.connection.closed:
-            self.connect()
+        connection = self.pool.getconn()
         try:
-            with self.connection.cursor() as cursor:
+            with connection.cursor() as cursor:
                 yield cursor
+            connection.commit()
         except Exception:
-            self.connection.rollback()
+            # psycopg2 flags connection.closed when the socket died mid-query
+            if not connection.closed:
+                connection.rollback()
             raise
+        finally:
+            self.pool.putconn(connection, discard=bool(connection.closed))
+
+    def _copy_from_dataframe(self, cursor, table_name, df, columns):
+        """
+        Stream a DataFrame into `table_name` with COPY FROM STDIN (CSV).
+        `columns` maps DataFrame column -> table column. The frame is written
+        in chunks of batch_size rows so the CSV buffer never holds the whole frame.
+        NaN/None become NULL. Integral float columns (ints upcast by NaN) are
+        written as integers so they COPY cleanly into integer columns.
+        """
+        frame = df[list(columns.keys())].copy()
+        for col in frame.columns:
+            if pd.api.types.is_float_dtype(frame[col]) and (frame[col].dropna() % 1 == 0).all():
+                frame[col] = frame[col].astype("Int64")
+        copy_query = sql.SQL("COPY {tbl} ({cols}) FROM STDIN WITH (FORMAT csv)").format(
+            tbl=sql.Identifier(table_name),
+            cols=sql.SQL(", ").join(sql.Identifier(c) for c in columns.values()),
+        )
+        for i in range(0, len(frame), self.batch_size):
+            buffer = io.StringIO()
+            frame.iloc[i:i + self.batch_size].to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor.copy_expert(copy_query, buffer)
+        return len(frame)
 
     def get_all_records_from_table(self, table_name):
         query = f"SELECT * FROM \"{table_name}\";"
@@ -96,180 +263,166 @@ class DBHandler:
             records = cursor.fetchall()
         return records
 
-    def insert_raw_data_into_ts_source(self, data):
-        insert_query = f"""
-        INSERT INTO public."api_voluum_ts_sources" ( click_2_reg, reg_2_ftd, browser_version, custom_variable_1, timestamp_created, category, cost, conversions, clicks, cost_sources, cpv, custom_conversions_1, custom_conversions_2, custom_conversions_3, custom_revenue_1, custom_revenue_2, custom_revenue_3, cv, epv, errors, profit, revenue, roi, suspicious_clicks, suspicious_clicks_percentage, suspicious_visits, suspicious_visits_percentage, unique_visits, visits, ip, os_version, data_source
-        ) VALUES %s
+    def _prepare_voluum_report_frame(self, data: pd.DataFrame) -> pd.DataFrame:
+        frame = data[list(VOLUUM_REPORT_COLUMNS.keys())].copy()
+        frame["customVariable1"] = frame["customVariable1"].astype("int64")
+        frame["costSources"] = frame["costSources"].str.join(",")
+        frame["country_code"] = self.get_country_codes_from_phones(frame["customVariable1"])
+        return frame
+
+    def _load_voluum_report_staging(self, cursor, data: pd.DataFrame) -> int:
+        """
+        Create the per-transaction staging table and COPY the cleaned report into it.
+        Column types are taken from api_voluum_ts_sources so COPY parses values
+        exactly like the target tables.
+        """
+        staging_columns = list(VOLUUM_REPORT_COLUMNS.values())
+        cursor.execute(f"""
+            CREATE TEMP TABLE voluum_report_staging ON COMMIT DROP AS
+            SELECT {", ".join(staging_columns)}, NULL::varchar AS country_code
+            FROM public."api_voluum_ts_sources"
+            WITH NO DATA;
+        """)
+        columns = dict(VOLUUM_REPORT_COLUMNS, country_code="country_code")
+        return self._copy_from_dataframe(cursor, "voluum_report_staging", self._prepare_voluum_report_frame(data), columns)
+
+    def _reconcile_voluum_categories(self, cursor) -> dict:
+        """
+        Give every number in voluum_report_staging exactly one final category
+        (BLACKLIST beats MONITOR beats WHITELIST if a number shows up twice),
+        then delete it from the category tables it no longer belongs to.
+        One joined DELETE per table, inside the caller's transaction, so a number
+        is never visible in two of blacklist / monitor / whitelist at once.
+        Returns the deleted keys per table, for the suppression index.
+        """
+        cursor.execute("""
+            CREATE TEMP TABLE voluum_category_staging ON COMMIT DROP AS
+            SELECT DISTINCT ON (custom_variable_1::varchar)
+                custom_variable_1::varchar AS custom_variable_1,
+                category
+            FROM voluum_report_staging
+            WHERE category IN ('BLACKLIST', 'MONITOR', 'WHITELIST')
+            ORDER BY custom_variable_1::varchar,
+                CASE category WHEN 'BLACKLIST' THEN 0 WHEN 'MONITOR' THEN 1 ELSE 2 END;
+            CREATE UNIQUE INDEX ON voluum_category_staging (custom_variable_1);
+            ANALYZE voluum_category_staging;
+        """)
+        deleted = {}
+        for table_name, category in CATEGORY_TABLES:
+            cursor.execute(f"""
+                DELETE FROM public."{table_name}" t
+                USING voluum_category_staging c
+                WHERE t.custom_variable_1 = c.custom_variable_1
+                  AND c.category <> %s
+                RETURNING t.custom_variable_1;
+            """, (category,))
+            deleted[table_name] = [row[0] for row in cursor.fetchall()]
+            print(f"Removed {len(deleted[table_name])} re-categorised rows from {table_name}.")
+        return deleted
+
+    def _merge_voluum_report_staging(self, cursor, table_name: str, category: str, now) -> int:
+        """
+        Set-based upsert of one category from voluum_report_staging into
+        whitelist / blacklist / monitor. Returns the number of rows merged.
+        """
+        metrics = VOLUUM_METRIC_COLUMNS
+        if table_name == "whitelist":
+            extra_columns = ["source", "country_code"]
+            extra_values = ["'VOLUUM'", "s.country_code"]
+            extra_updates = ["country_code"]
+        else:
+            extra_columns = ["reason", "source"]
+            extra_values = ["'OS_VERSION'", "'VOLUUM'"]
+            extra_updates = ["reason"]
+
+        insert_columns = ["custom_variable_1", "ip", "os_version", "browser_version", "timestamp_created"] + extra_columns + metrics
+        select_values = ["c.custom_variable_1", "s.ip", "s.os_version", "s.browser_version", "%s"] + extra_values + [f"s.{c}" for c in metrics]
+        update_columns = ["ip", "os_version", "browser_version"] + extra_updates + metrics
+
+        query = f"""
+            INSERT INTO public."{table_name}" ({", ".join(insert_columns)})
+            SELECT DISTINCT ON (c.custom_variable_1) {", ".join(select_values)}
+            FROM voluum_report_staging s
+            JOIN voluum_category_staging c
+              ON c.custom_variable_1 = s.custom_variable_1::varchar
+             AND c.category = s.category
+            WHERE c.category = %s
+            ORDER BY c.custom_variable_1
+            ON CONFLICT (custom_variable_1)
+            DO UPDATE SET {", ".join(f"{c} = EXCLUDED.{c}" for c in update_columns)};
         """
-        # 14, 18, 19, 2, timestamp, 29, 0, 1, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 15, 16, 17, 20, 21, 22, 23, 24, 25, 26, 27, 28
-        rows = []
-        now = datetime.now()
-        start_time = time()
-        for record in data:
-            rows.append((
-                record[0], record[1], record[2], int(record[14]), now, record[29], record[5], record[4], record[3], ",".join(record[6]), record[7], record[8], record[9], record[10], record[11], record[12], record[13], record[15], record[16], record[17], record[20], record[21], record[22], record[23], record[24], record[25], record[26], record[27], record[28], record[18], record[19], "VOLUUM"
-            ))
-        print(f"Data prepared for insertion in {time() - start_time} seconds.")
-        if rows:
-            with self._cursor() as cursor:
-                execute_values(cursor, insert_query, rows, page_size=self.batch_size)
-            self.connection.commit()
-            print(f"Inserted final batch of {len(rows)} records into api_voluum_ts_sources.")
-        return True
+        cursor.execute(query, (now, category))
+        return cursor.rowcount
 
-    def upsert_data_into_whitelist(self, table_name, data):
+    def sync_voluum_report_data(self, data: pd.DataFrame) -> dict:
         """
-        UPSERT data into whitelist table.
-        - Inserts new records
-        - Updates existing records based on custom_variable_1
-        - Detects country_code from the phone number (custom_variable_1)
+        Load a cleaned Voluum report (output of VoluumDataHandler.get_cleaned_data)
+        in one transaction:
+        - COPY the frame into a temp staging table
+        - INSERT ... SELECT everything into api_voluum_ts_sources
+        - reconcile categories: each number ends up in exactly one of
+          blacklist / monitor / whitelist (joined DELETEs from the others)
+        - INSERT ... ON CONFLICT merge each category into its table
+        Re-categorised keys are dropped from the suppression index after the commit.
+        Returns row counts per table.
         """
+        counts = {"ts_source_rows": 0, "blacklist_rows": 0, "whitelist_rows": 0, "monitor_rows": 0}
+        if data.empty:
+            return counts
 
-        query = f"""
-        INSERT INTO public."whitelist" ( custom_variable_1, ip, os_version, browser_version, timestamp_created, source, click_2_reg, reg_2_ftd, clicks, conversions, cost, cost_sources, cpv, custom_conversions_1, custom_conversions_2, custom_conversions_3, custom_revenue_1, custom_revenue_2, custom_revenue_3, cv, epv, errors, profit, revenue, roi, suspicious_clicks, suspicious_clicks_percentage, suspicious_visits, suspicious_visits_percentage, unique_visits, visits, country_code
-        )
-        VALUES %s
-        ON CONFLICT (custom_variable_1)
-        DO UPDATE SET
-            ip = EXCLUDED.ip,
-            os_version = EXCLUDED.os_version,
-            browser_version = EXCLUDED.browser_version,
-            click_2_reg = EXCLUDED.click_2_reg,
-            reg_2_ftd = EXCLUDED.reg_2_ftd,
-            clicks = EXCLUDED.clicks,
-            conversions = EXCLUDED.conversions,
-            cost = EXCLUDED.cost,
-            cost_sources = EXCLUDED.cost_sources,
-            cpv = EXCLUDED.cpv,
-            custom_conversions_1 = EXCLUDED.custom_conversions_1,
-            custom_conversions_2 = EXCLUDED.custom_conversions_2,
-            custom_conversions_3 = EXCLUDED.custom_conversions_3,
-            custom_revenue_1 = EXCLUDED.custom_revenue_1,
-            custom_revenue_2 = EXCLUDED.custom_revenue_2,
-            custom_revenue_3 = EXCLUDED.custom_revenue_3,
-            cv = EXCLUDED.cv,
-            epv = EXCLUDED.epv,
-            errors = EXCLUDED.errors,
-            profit = EXCLUDED.profit,
-            revenue = EXCLUDED.revenue,
-            roi = EXCLUDED.roi,
-            suspicious_clicks = EXCLUDED.suspicious_clicks,
-            suspicious_clicks_percentage = EXCLUDED.suspicious_clicks_percentage,
-            suspicious_visits = EXCLUDED.suspicious_visits,
-            suspicious_visits_percentage = EXCLUDED.suspicious_visits_percentage,
-            unique_visits = EXCLUDED.unique_visits,
-            visits = EXCLUDED.visits,
-            country_code = EXCLUDED.country_code
-        ;
-        """
         now = datetime.now()
-        rows = []
-
-        for record in data:
-            phone = str(record[14])
-            country_code = self.get_country_code_from_phone(phone)
-            rows.append((
-                int(record[14]), record[18], record[19], record[2], now, "VOLUUM", record[0], record[1], record[3], record[4], record[5], ",".join(record[6]), record[7], record[8], record[9], record[10], record[11], record[12], record[13], record[15], record[16], record[17], record[20], record[21], record[22], record[23], record[24], record[25], record[26], record[27], record[28], country_code
-        ))
+        start_time = time()
+        ts_columns = ["custom_variable_1", "ip", "os_version", "browser_version", "category"] + VOLUUM_METRIC_COLUMNS
+        with self._cursor() as cursor:
+            self._load_voluum_report_staging(cursor, data)
+            print(f"Copied {len(data)} report rows into staging in {time() - start_time} seconds.")
 
-        # Flush remaining
-        if rows:
-            with self._cursor() as cursor:
-                execute_values(cursor, query, rows, page_size=self.batch_size)
-            keys = [row[0] for row in rows]
-            self.remove_from_other_tables(keys, ["blacklist", "monitor"])
-            self.connection.commit()
-            print(f"Inserted/Updated final batch of {len(rows)} records into {table_name}.")
+            cursor.execute(f"""
+                INSERT INTO public."api_voluum_ts_sources" ({", ".join(ts_columns)}, timestamp_created, data_source)
+                SELECT {", ".join(ts_columns)}, %s, 'VOLUUM'
+                FROM voluum_report_staging;
+            """, (now,))
+            counts["ts_source_rows"] = cursor.rowcount
 
-        return len(rows)
+            deleted = self._reconcile_voluum_categories(cursor)
+            for table_name, category in CATEGORY_TABLES:
+                counts[f"{table_name}_rows"] = self._merge_voluum_report_staging(cursor, table_name, category, now)
+        if self.suppression_index is not None:
+            for table_name, keys in deleted.items():
+                self.suppression_index.remove(table_name, keys)
+        print(f"Merged report into ts_source/blacklist/whitelist/monitor in {time() - start_time} seconds: {counts}")
+        return counts
 
-    def upsert_data_into_main_database(self, data):
+    def upsert_data_into_main_database(self, data, cursor=None):
         """
         UPSERT data into main_database table.
         - Inserts new records
         - Updates existing records based on custom_variable_1
+        With `cursor` the insert runs in the caller's transaction.
+        Returns the keys this call inserted (as stored), i.e. not those already there
+        or added first by a concurrent transaction.
         """
 
         query = f"""
         INSERT INTO public."main_database" ( custom_variable_1)
         VALUES %s
         ON CONFLICT (custom_variable_1)
-        DO NOTHING;
+        DO NOTHING
+        RETURNING custom_variable_1;
         """
-        rows = []
-
-        for record in data:
-            rows.append((int(record),))
+        # Sorted so concurrent inserts of overlapping keys lock them in the same order
+        rows = sorted({(int(record),) for record in data})
+        inserted = []
         # Flush remaining
         if rows:
-            with self._cursor() as cursor:
-                execute_values(cursor, query, rows, page_size=self.batch_size)
-            self.connection.commit()
-            print(f"Inserted/Updated final batch of {len(rows)} records into Main Database.")
-
-        return len(rows)
-
-    def upsert_data_into_blacklist_and_monitor(self, table_name, data):
-        """
-        UPSERT data into blacklist and monitor tables.
-        - Inserts new records
-        - Updates existing records based on custom_variable_1
-        """
-
-        query = f"""
-        INSERT INTO public."{table_name}" ( custom_variable_1, ip, os_version, browser_version, timestamp_created, reason, source, click_2_reg, reg_2_ftd, clicks, conversions, cost, cost_sources, cpv, custom_conversions_1, custom_conversions_2, custom_conversions_3, custom_revenue_1, custom_revenue_2, custom_revenue_3, cv, epv, errors, profit, revenue, roi, suspicious_clicks, suspicious_clicks_percentage, suspicious_visits, suspicious_visits_percentage, unique_visits, visits
-        )
-        VALUES %s
-        ON CONFLICT (custom_variable_1)
-        DO UPDATE SET
-            ip = EXCLUDED.ip,
-            os_version = EXCLUDED.os_version,
-            browser_version = EXCLUDED.browser_version,
-            reason = EXCLUDED.reason,
-            click_2_reg = EXCLUDED.click_2_reg,
-            reg_2_ftd = EXCLUDED.reg_2_ftd,
-            clicks = EXCLUDED.clicks,
-            conversions = EXCLUDED.conversions,
-            cost = EXCLUDED.cost,
-            cost_sources = EXCLUDED.cost_sources,
-            cpv = EXCLUDED.cpv,
-            custom_conversions_1 = EXCLUDED.custom_conversions_1,
-            custom_conversions_2 = EXCLUDED.custom_conversions_2,
-            custom_conversions_3 = EXCLUDED.custom_conversions_3,
-            custom_revenue_1 = EXCLUDED.custom_revenue_1,
-            custom_revenue_2 = EXCLUDED.custom_revenue_2,
-            custom_revenue_3 = EXCLUDED.custom_revenue_3,
-            cv = EXCLUDED.cv,
-            epv = EXCLUDED.epv,
-            errors = EXCLUDED.errors,
-            profit = EXCLUDED.profit,
-            revenue = EXCLUDED.revenue,
-            roi = EXCLUDED.roi,
-            suspicious_clicks = EXCLUDED.suspicious_clicks,
-            suspicious_clicks_percentage = EXCLUDED.suspicious_clicks_percentage,
-            suspicious_visits = EXCLUDED.suspicious_visits,
-            suspicious_visits_percentage = EXCLUDED.suspicious_visits_percentage,
-            unique_visits = EXCLUDED.unique_visits,
-            visits = EXCLUDED.visits
-        ;
-        """
-
-        now = datetime.now()
-        rows = []
+            if cursor is not None:
+                inserted = execute_values(cursor, query, rows, page_size=self.batch_size, fetch=True)
+            else:
+                with self._cursor() as cursor:
+                    inserted = execute_values(cursor, query, rows, page_size=self.batch_size, fetch=True)
+            print(f"Inserted {len(inserted)} of {len(rows)} records into Main Database.")
 
-        for record in data:
-            rows.append((
-                int(record[14]), record[18], record[19], record[2], now, "OS_VERSION", "VOLUUM", record[0], record[1], record[3], record[4], record[5], ",".join(record[6]), record[7], record[8], record[9], record[10], record[11], record[12], record[13], record[15], record[16], record[17], record[20], record[21], record[22], record[23], record[24], record[25], record[26], record[27], record[28]
-            ))
-
-        # Flush remaining
-        if rows:
-            with self._cursor() as cursor:
-                execute_values(cursor, query, rows, page_size=self.batch_size)
-            self.remove_from_other_tables([row[0] for row in rows], ["whitelist", "blacklist" if table_name == "monitor" else "monitor"])
-            self.connection.commit()
-            print(f"Inserted/Updated final batch of {len(rows)} records into {table_name}.")
-        return len(rows)
+        return [row[0] for row in inserted]
 
     def empty_all_tables(self):
         tables = ["api_voluum_ts_sources", "blacklist", "whitelist", "monitor"]
@@ -277,26 +430,191 @@ class DBHandler:
             delete_query = f'DELETE FROM "{table}";'
             with self._cursor() as cursor:
                 cursor.execute(delete_query)
-            self.connection.commit()
+        if self.suppression_index is not None:
+            self.suppression_index.invalidate()
         return True
 
+    def _copy_keys(self, cursor, table_name, keys):
+        """
+        COPY a list of string keys into the single `key` column of `table_name`.
+        Every value is quoted so empty strings stay empty strings instead of NULL.
+        """
+        copy_query = sql.SQL("COPY {tbl} (key) FROM STDIN WITH (FORMAT csv)").format(tbl=sql.Identifier(table_name))
+        for i in range(0, len(keys), self.batch_size):
+            buffer = io.StringIO()
+            csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows([key] for key in keys[i:i + self.batch_size])
+            buffer.seek(0)
+            cursor.copy_expert(copy_query, buffer)
+
     def clean_csv_records(self, data, include_main_database, include_conversion, include_blacklist, include_monitor):
+        """Suppress one batch of uploaded records in its own transaction (see _clean_csv_records)."""
+        return self.clean_csv_chunk(data, include_main_database, include_conversion, include_blacklist, include_monitor)
+
+    def clean_csv_chunk(self, data, include_main_database, include_conversion, include_blacklist, include_monitor, commit_chunk=None, file_id=None):
+        """
+        clean_csv_records as a single transaction that also covers the caller's
+        bookkeeping: commit_chunk(cursor, result) runs after the main_database insert
+        but before the commit (a file job writes the chunk's output and checkpoints
+        there). If anything fails the main_database insert is rolled back with it,
+        so a retried chunk never finds its own clean keys already in main_database.
+        Suppression index updates are applied only after the commit.
+        With `file_id`, records already seen in an earlier chunk of that file are
+        dropped first (see _new_file_records) and counted like duplicates within a
+        chunk: in the first selected table's count. With no table selected nothing
+        is dropped, as clean_csv_records returns such a chunk unchanged.
+        """
+        selected = [include_blacklist, include_monitor, include_conversion, include_main_database]
+        main_database_keys = []
+        with self._cursor() as cursor:
+            dropped = 0
+            if file_id is not None and any(selected):
+                data, dropped = self._new_file_records(cursor, file_id, data)
+            result = self._clean_csv_records(
+                cursor, data, include_main_database, include_conversion, include_blacklist, include_monitor, main_database_keys,
+            )
+            if dropped:
+                result = list(result)
+                result[1 + next(index for index, include in enumerate(selected) if include)] += dropped
+                result = tuple(result)
+            if commit_chunk:
+                commit_chunk(cursor, result)
+        if main_database_keys and self.suppression_index is not None:
+            self.suppression_index.add("main_database", main_database_keys)
+        return result
+
+    def _new_file_records(self, cursor, file_id, data):
+        """
+        Rows of `data` whose record no earlier chunk of the file had, and the number
+        of rows dropped. The chunk's distinct records go into file_processing_keys;
+        duplicates within the chunk are kept so clean_csv_records counts them as before.
+        """
+        cursor.execute("CREATE TEMP TABLE file_chunk_keys (key varchar) ON COMMIT DROP")
+        self._copy_keys(cursor, "file_chunk_keys", [row["record"] for row in data])
+        cursor.execute("""
+            INSERT INTO public.file_processing_keys (file_id, key)
+            SELECT DISTINCT %s, key FROM file_chunk_keys
+            ON CONFLICT (file_id, key) DO NOTHING
+            RETURNING key
+        """, (file_id,))
+        new_keys = {row[0] for row in cursor.fetchall()}
+        rows = [row for row in data if row["record"] in new_keys]
+        return rows, len(data) - len(rows)
+
+    def clear_file_processing_keys(self, file_id: str):
+        with self._cursor() as cursor:
+            cursor.execute("DELETE FROM public.file_processing_keys WHERE file_id = %s;", (file_id,))
+
+    def _clean_csv_records(self, cursor, data, include_main_database, include_conversion, include_blacklist, include_monitor, main_database_keys):
+        """
+        Suppress uploaded records against blacklist -> monitor -> api_voluum_conversions -> main_database
+        in one pass:
+        - keys are COPYed once into a temp table,
+        - one statement flags every distinct key against all selected tables (indexed semi-joins),
+        - per-table removal counts come from those flags, each table only counting keys that
+          survived the tables before it,
+        - with include_main_database the surviving keys go to main_database with one INSERT ... SELECT,
+          and only the keys that insert returned are clean: a key another file's transaction
+          inserted first counts as removed by main_database, so no number is emitted twice.
+        Duplicate rows are folded into the first selected table's count, as before.
+        """
         values = [row['record'] for row in data]
-        cleaned_values = values
-        removed_blacklist_count, removed_monitor_count, removed_conversion_count, removed_main_database_count = 0, 0, 0, 0
-        if include_blacklist:
-            cleaned_values = self.filter_existing_keys(values, 'blacklist')
-            removed_blacklist_count = len(values) - len(cleaned_values)
-        if include_monitor:
-            cleaned_values = self.filter_existing_keys(cleaned_values, 'monitor')
-            removed_monitor_count = len(values) - removed_blacklist_count - len(cleaned_values)
-        if include_conversion:
-            cleaned_values = self.filter_existing_keys(cleaned_values, 'api_voluum_conversions')
-            removed_conversion_count = len(values) - removed_blacklist_count - removed_monitor_count - len(cleaned_values)
+        suppression = [
+            ("blacklist", include_blacklist),
+            ("monitor", include_monitor),
+            ("api_voluum_conversions", include_conversion),
+            ("main_database", include_main_database),
+        ]
+        if not values or not any(include for _, include in suppression):
+            return values, 0, 0, 0, 0
+        if self.suppression_index is not None:
+            return self._clean_csv_records_indexed(cursor, values, suppression, main_database_keys)
+
+        flags = sql.SQL(",\n").join(
+            sql.SQL("EXISTS (SELECT 1 FROM public.{tbl} t WHERE t.custom_variable_1 = k.key) AS {flag}").format(
+                tbl=sql.Identifier(table_name), flag=sql.Identifier(f"in_{table_name}")
+            ) if include else sql.SQL("FALSE AS {flag}").format(flag=sql.Identifier(f"in_{table_name}"))
+            for table_name, include in suppression
+        )
+        # Each table only counts keys that none of the earlier tables already removed
+        counts = []
+        earlier = []
+        for table_name, _ in suppression:
+            flag = sql.Identifier(f"in_{table_name}")
+            condition = sql.SQL(" AND ").join([sql.SQL("NOT {}").format(f) for f in earlier] + [flag])
+            counts.append(sql.SQL("count(*) FILTER (WHERE {})").format(condition))
+            earlier.append(flag)
+        any_flag = sql.SQL(" OR ").join(earlier)
+
+        cursor.execute("CREATE TEMP TABLE csv_clean_keys (key varchar) ON COMMIT DROP")
+        self._copy_keys(cursor, "csv_clean_keys", values)
+        cursor.execute("ANALYZE csv_clean_keys")
+
+        cursor.execute(sql.SQL("""
+            CREATE TEMP TABLE csv_clean_flags ON COMMIT DROP AS
+            SELECT k.key, {flags}
+            FROM (SELECT DISTINCT key FROM csv_clean_keys) k
+        """).format(flags=flags))
+        cursor.execute(sql.SQL("SELECT count(*), {counts} FROM csv_clean_flags").format(counts=sql.SQL(", ").join(counts)))
+        unique_count, *removed = cursor.fetchone()
+
         if include_main_database:
-            cleaned_values = self.filter_existing_keys(cleaned_values, "main_database")
-            removed_main_database_count = len(values) - removed_blacklist_count - removed_monitor_count - removed_conversion_count - len(cleaned_values)
-            self.upsert_data_into_main_database(cleaned_values)
+            # ::bigint keeps the old int(record) normalisation of stored keys; sorted so
+            # concurrent files lock overlapping keys in the same order
+            cursor.execute(sql.SQL("""
+                WITH inserted AS (
+                    INSERT INTO public."main_database" (custom_variable_1)
+                    SELECT DISTINCT key::bigint FROM csv_clean_flags WHERE NOT ({any_flag}) ORDER BY 1
+                    ON CONFLICT (custom_variable_1) DO NOTHING
+                    RETURNING custom_variable_1
+                )
+                SELECT f.key FROM csv_clean_flags f
+                JOIN inserted i ON i.custom_variable_1 = f.key::bigint::text
+                WHERE NOT ({any_flag})
+            """).format(any_flag=any_flag))
+            cleaned_values = [row[0] for row in cursor.fetchall()]
+            cursor.execute(sql.SQL("SELECT count(*) FROM csv_clean_flags WHERE NOT ({any_flag})").format(any_flag=any_flag))
+            removed[-1] += cursor.fetchone()[0] - len(cleaned_values)
+            print(f"Inserted {len(cleaned_values)} new records into Main Database.")
+        else:
+            cursor.execute(sql.SQL("SELECT key FROM csv_clean_flags WHERE NOT ({any_flag})").format(any_flag=any_flag))
+            cleaned_values = [row[0] for row in cursor.fetchall()]
+
+        first_selected = next(index for index, (_, include) in enumerate(suppression) if include)
+        removed[first_selected] += len(values) - unique_count
+        removed_blacklist_count, removed_monitor_count, removed_conversion_count, removed_main_database_count = removed
+        return cleaned_values, removed_blacklist_count, removed_monitor_count, removed_conversion_count, removed_main_database_count
+
+    def _clean_csv_records_indexed(self, cursor, values, suppression, main_database_keys):
+        """
+        clean_csv_records answered from the in-memory suppression index, same counts and cascade.
+        Keys inserted into main_database are appended to main_database_keys for the index.
+        """
+        unique_values = list(dict.fromkeys(values))
+        remaining = np.ones(len(unique_values), dtype=bool)
+        removed = []
+        for table_name, include in suppression:
+            if not include:
+                removed.append(0)
+                continue
+            hits = self._get_suppression_index(table_name).contains(table_name, unique_values) & remaining
+            removed.append(int(hits.sum()))
+            remaining &= ~hits
+        cleaned_values = [value for value, keep in zip(unique_values, remaining) if keep]
+
+        include_main_database = suppression[-1][1]
+        if include_main_database:
+            # Clean only what this insert added; the index may not know yet about keys a
+            # concurrent file inserted first
+            inserted = self.upsert_data_into_main_database(cleaned_values, cursor)
+            main_database_keys.extend(inserted)
+            inserted = set(inserted)
+            candidates = len(cleaned_values)
+            cleaned_values = [value for value in cleaned_values if str(int(value)) in inserted]
+            removed[-1] += candidates - len(cleaned_values)
+
+        first_selected = next(index for index, (_, include) in enumerate(suppression) if include)
+        removed[first_selected] += len(values) - len(unique_values)
+        removed_blacklist_count, removed_monitor_count, removed_conversion_count, removed_main_database_count = removed
         return cleaned_values, removed_blacklist_count, removed_monitor_count, removed_conversion_count, removed_main_database_count
 
     def encrypt_and_save_csv(self, phone_numbers):
@@ -317,6 +635,10 @@ class DBHandler:
         if not keys:
             return []
 
+        index = self._get_suppression_index(table_name)
+        if index is not None:
+            return list(set(np.asarray(keys, dtype=object)[~index.contains(table_name, keys)]))
+
         remaining_keys = set(keys)  # start with all keys
 
         # Process in batches
@@ -332,22 +654,6 @@ class DBHandler:
 
         return list(remaining_keys)
 
-    def remove_from_other_tables(self, keys, tables):
-        """
-        Delete rows from other tables if the key exists.
-        keys: list of custom_variable_1
-        tables: list of table names to delete from
-        """
-        if not keys:
-            return
-
-        for table in tables:
-            query = f'DELETE FROM "{table}" WHERE custom_variable_1 = ANY(%s::varchar[])'
-            with self._cursor() as cursor:
-                cursor.execute(query, (keys,))
-            self.connection.commit()
-            print(f"Deleted rows from {table}.")
-
     def find_records_in_ts_source(self, key):
         """
         Check which keys exist in the specified table.
@@ -392,7 +698,6 @@ class DBHandler:
         if rows:
             with self._cursor() as cursor:
                 execute_values(cursor, insert_query, rows, page_size=self.batch_size)
-            self.connection.commit()
             print(f"Inserted final batch of {len(rows)} records into api_voluum_conversions.")
         return True
 
@@ -459,7 +764,6 @@ class DBHandler:
         with self._cursor() as cursor:
             execute_values(cursor, update_query, rows, page_size=self.batch_size)
 
-        self.connection.commit()
         return True
 
     def update_unsuccessful_conversions(self, emails, reason='INAVLID_PHONE_NUMBER'):
@@ -525,7 +829,6 @@ class DBHandler:
         with self._cursor() as cursor:
             execute_values(cursor, update_query, rows, page_size=self.batch_size)
 
-        self.connection.commit()
         return True
 
     def get_counts(self, table_name: str, column_name: str):
@@ -560,7 +863,6 @@ class DBHandler:
         with self._cursor() as cursor:
             cursor.execute(q, (file_id, original_filename, raw_file_path, record_count_total))
             created = cursor.fetchone()
-        self.connection.commit()
         return {"id": created[0], "original_filename": original_filename, "status": "uploaded"}
 
     def list_files(self, statuses=None):
@@ -629,18 +931,13 @@ class DBHandler:
             WHERE id=%s::uuid
               AND status IN ('uploaded', 'failed');
         """
-        try:
-            with self._cursor() as cursor:
-                cursor.execute(q, (lock_owner, file_id))
-                if cursor.rowcount != 1:
-                    self.connection.rollback()
-                    return False
-            # The unique index one_processing_file_only enforces exclusivity
-            self.connection.commit()
-            return True
-        except psycopg2.Error:
-            self.connection.rollback()
-            raise
+        with self._cursor() as cursor:
+            cursor.execute(q, (lock_owner, file_id))
+            if cursor.rowcount != 1:
+                cursor.connection.rollback()
+                return False
+        # The unique index one_processing_file_only enforces exclusivity
+        return True
 
     def mark_failed(self, file_id: str, error_message: str):
         q = """
@@ -652,7 +949,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (error_message, file_id))
-        self.connection.commit()
 
     def mark_processed(self, file_id: str, processed_path: str, total: int, clean: int):
         q = """
@@ -667,7 +963,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (processed_path, total, clean, file_id))
-        self.connection.commit()
 
     def archive_file(self, file_id: str):
         q = """
@@ -677,7 +972,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (file_id,))
-        self.connection.commit()
 
     def delete_file_entry(self, file_id: str):
         q = """
@@ -686,7 +980,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (file_id,))
-        self.connection.commit()
 
     def upsert_stats(self, file_id: str, total: int, rb: int, rm: int, rc: int, rmd: int, final_clean: int):
         q = """
@@ -705,7 +998,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (file_id, total, rb, rm, rc, rmd, final_clean))
-        self.connection.commit()
 
     def get_stats(self, file_id: str):
         q = """
@@ -780,7 +1072,6 @@ class DBHandler:
                 import_id, original_filename, target, raw_file_path, result_file_path,
                 uploaded_count, accepted_count, rejected_count
             ))
-        self.connection.commit()
 
     def list_manual_update_imports(self, limit: int = 50):
         q = """
@@ -834,6 +1125,9 @@ class DBHandler:
     def _get_existing_keys_any_table(self, keys: list[str], table_name: str) -> set[str]:
         if not keys:
             return set()
+        index = self._get_suppression_index(table_name)
+        if index is not None:
+            return set(np.asarray(keys, dtype=object)[index.contains(table_name, keys)])
         existing = set()
         for i in range(0, len(keys), self.batch_size):
             chunk = keys[i:i+self.batch_size]
@@ -899,7 +1193,6 @@ class DBHandler:
         with self._cursor() as cursor:
             execute_values(cursor, q, to_insert, page_size=self.batch_size)
             inserted_rows = cursor.fetchall()
-        self.connection.commit()
 
         inserted = {r[0] for r in inserted_rows}
         return inserted, duplicates
@@ -919,22 +1212,19 @@ class DBHandler:
                 hlr_result_file_path=NULL,
                 hlr_num_items=NULL,
                 hlr_num_complete=NULL,
+                hlr_cache_lookups=NULL,
+                hlr_cache_hits=NULL,
                 lock_owner=%s
             WHERE id=%s::uuid
             AND status='processed'
             AND (hlr_status IS NULL OR hlr_status IN ('failed','complete'));
         """
-        try:
-            with self._cursor() as cursor:
-                cursor.execute(q, (lock_owner, file_id))
-                if cursor.rowcount != 1:
-                    self.connection.rollback()
-                    return False
-            self.connection.commit()
-            return True
-        except psycopg2.Error:
-            self.connection.rollback()
-            raise
+        with self._cursor() as cursor:
+            cursor.execute(q, (lock_owner, file_id))
+            if cursor.rowcount != 1:
+                cursor.connection.rollback()
+                return False
+        return True
 
     def set_hlr_batch_id(self, file_id: str, batch_id: str):
         q = """
@@ -944,7 +1234,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (batch_id, file_id))
-        self.connection.commit()
 
     def set_hlr_status(self, file_id: str, status: str):
         q = """
@@ -954,7 +1243,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (status, file_id))
-        self.connection.commit()
 
     def update_hlr_progress(self, file_id: str, hlr_status: str, num_items: int | None, num_complete: int | None):
         q = """
@@ -966,7 +1254,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (hlr_status, num_items, num_complete, file_id))
-        self.connection.commit()
 
     def mark_hlr_complete(self, file_id: str, result_path: str):
         q = """
@@ -979,7 +1266,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (result_path, file_id))
-        self.connection.commit()
 
     def mark_hlr_failed(self, file_id: str, error_message: str):
         q = """
@@ -991,12 +1277,12 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (error_message, file_id))
-        self.connection.commit()
 
     def get_hlr_info(self, file_id: str):
         q = """
             SELECT id::text, hlr_status, hlr_batch_id, hlr_result_file_path,
-                hlr_started_at, hlr_completed_at, hlr_num_items, hlr_num_complete, hlr_error_message, hlr_raw_file_path
+                hlr_started_at, hlr_completed_at, hlr_num_items, hlr_num_complete, hlr_error_message, hlr_raw_file_path,
+                hlr_cache_lookups, hlr_cache_hits
             FROM uploaded_csv_files
             WHERE id=%s::uuid;
         """
@@ -1015,32 +1301,86 @@ class DBHandler:
             "hlr_num_items": r[6],
             "hlr_num_complete": r[7],
             "hlr_error_message": r[8],
-            "hlr_raw_file_path": r[9]
+            "hlr_raw_file_path": r[9],
+            "hlr_cache_lookups": r[10],
+            "hlr_cache_hits": r[11],
+            "hlr_cache_hit_rate": round(r[11] / r[10], 4) if r[10] else None,
         }
 
+    def get_cached_hlr_results(self, numbers: list[str], ttl_days: dict):
+        """
+        Fresh hlr_lookup_cache entries for `numbers`: {number: (live_status, current_network_name)}.
+        An entry is fresh while checked_at is within ttl_days[live_status] days;
+        statuses missing from ttl_days are never served from the cache.
+        """
+        if not numbers or not ttl_days:
+            return {}
+        q = """
+            SELECT c.telephone_number, c.live_status, c.current_network_name
+            FROM public.hlr_lookup_cache c
+            JOIN unnest(%s::text[], %s::int[]) AS ttl(live_status, days) ON ttl.live_status = c.live_status
+            WHERE c.telephone_number = ANY(%s)
+              AND c.checked_at >= NOW() - make_interval(days => ttl.days);
+        """
+        with self._cursor() as cursor:
+            cursor.execute(q, (list(ttl_days), list(ttl_days.values()), numbers))
+            return {number: (live_status, network) for number, live_status, network in cursor.fetchall()}
+
+    def upsert_hlr_cache(self, results: list[tuple]):
+        """Record fresh provider results: list of (telephone_number, live_status, current_network_name)."""
+        # One row per number, or ON CONFLICT DO UPDATE would touch the same row twice
+        latest = {number: (number, live_status, network) for number, live_status, network in results if number and live_status}
+        if not latest:
+            return
+        columns = ["telephone_number", "live_status", "current_network_name"]
+        with self._cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE hlr_cache_staging (
+                    telephone_number TEXT, live_status TEXT, current_network_name TEXT
+                ) ON COMMIT DROP
+            """)
+            self._copy_rows(cursor, "hlr_cache_staging", columns, list(latest.values()))
+            cursor.execute("""
+                INSERT INTO public.hlr_lookup_cache (telephone_number, live_status, current_network_name, checked_at)
+                SELECT telephone_number, live_status, current_network_name, NOW() FROM hlr_cache_staging
+                ON CONFLICT (telephone_number) DO UPDATE
+                SET live_status = EXCLUDED.live_status,
+                    current_network_name = EXCLUDED.current_network_name,
+                    checked_at = EXCLUDED.checked_at;
+            """)
+
+    def set_hlr_cache_stats(self, file_id: str, lookups: int, hits: int):
+        q = """
+            UPDATE uploaded_csv_files
+            SET hlr_cache_lookups=%s,
+                hlr_cache_hits=%s
+            WHERE id=%s::uuid;
+        """
+        with self._cursor() as cursor:
+            cursor.execute(q, (lookups, hits, file_id))
+
     def insert_hlr_data(self, table_name, numbers, source, reason):
         """
         Bulk insert into table.
-        Duplicate-safe.
+        Duplicate-safe. Numbers are COPYed into a staging table typed like
+        table.custom_variable_1, then inserted with ON CONFLICT DO NOTHING.
+        ::bigint keeps the old int(record) normalisation ("+447...", surrounding spaces).
         """
         if not numbers:
             return
 
-        q = f"""
-            INSERT INTO public."{table_name}" ( custom_variable_1, timestamp_created, source, reason)
-            VALUES %s
-            ON CONFLICT (custom_variable_1) DO NOTHING;
-        """
-        now = datetime.now()
-        rows = []
-
-        for record in numbers:
-            rows.append((
-                int(record), now, source, reason
-            ))
+        table = sql.Identifier(table_name)
         with self._cursor() as cursor:
-            execute_values(cursor, q, rows, page_size=50000)
-        self.connection.commit()
+            cursor.execute(sql.SQL("""
+                CREATE TEMP TABLE hlr_numbers_staging ON COMMIT DROP AS
+                SELECT custom_variable_1 FROM public.{tbl} WITH NO DATA
+            """).format(tbl=table))
+            self._copy_rows(cursor, "hlr_numbers_staging", ["custom_variable_1"], [(number,) for number in numbers])
+            cursor.execute(sql.SQL("""
+                INSERT INTO public.{tbl} (custom_variable_1, timestamp_created, source, reason)
+                SELECT custom_variable_1::bigint, %s, %s, %s FROM hlr_numbers_staging
+                ON CONFLICT (custom_variable_1) DO NOTHING
+            """).format(tbl=table), (datetime.now(), source, reason))
 
     def set_hlr_raw_path(self, file_id: str, path: str):
         q = """
@@ -1050,84 +1390,37 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (path, file_id))
-        self.connection.commit()
 
     def insert_raw_hlr_data(self, payloads):
         """
         Insert HLR live numbers into api_hlr_live_numbers.
-        Accepts list of dicts with dotted keys.
-        Uses ON CONFLICT DO NOTHING.
+        Accepts list of dicts with dotted keys (HLR result rows); the first column is
+        used as custom_variable_1 when the row has no such key.
+        Rows are COPYed into a staging table, then inserted with ON CONFLICT DO NOTHING.
         """
 
         if not payloads:
             return
 
-        # Convert to DataFrame
-        df = pd.DataFrame(payloads)
-        if "custom_variable_1" not in df.columns:
-            first_col = df.columns[0]
-            df = df.rename(columns={first_col: "custom_variable_1"})
-
-        column_map = {
-            "custom_variable_1": "custom_variable_1",
-            "error": "error",
-
-            "request_parameters.telephone_number": "request_parameters_telephone_number",
-            "request_parameters.cache_days_private": "request_parameters_cache_days_private",
-            "request_parameters.cache_days_global": "request_parameters_cache_days_global",
-            "request_parameters.save_to_cache": "request_parameters_save_to_cache",
-            "request_parameters.output_format": "request_parameters_output_format",
-
-            "credits_spent": "credits_spent",
-
-            "detected_telephone_number": "detected_telephone_number",
-            "formatted_telephone_number": "formatted_telephone_number",
-            "telephone_number_type": "telephone_number_type",
-
-            "live_status": "live_status",
-
-            "original_network": "original_network",
-            "original_network_details.name": "original_network_details_name",
-            "original_network_details.mccmnc": "original_network_details_mccmnc",
-            "original_network_details.country_name": "original_network_details_country_name",
-            "original_network_details.country_iso3": "original_network_details_country_iso3",
-            "original_network_details.area": "original_network_details_area",
-            "original_network_details.country_prefix": "original_network_details_country_prefix",
-
-            "current_network": "current_network",
-            "current_network_details.name": "current_network_details_name",
-            "current_network_details.mccmnc": "current_network_details_mccmnc",
-            "current_network_details.country_name": "current_network_details_country_name",
-            "current_network_details.country_iso3": "current_network_details_country_iso3",
-            "current_network_details.country_prefix": "current_network_details_country_prefix",
-
-            "is_ported": "is_ported",
-            "timestamp": "timestamp",
-        }
-
-        df = df.rename(columns=column_map)
-
-        # Ensure all DB columns exist
-        for col in column_map.values():
-            if col not in df.columns:
-                df[col] = None
-
-        df = df[list(column_map.values())]
-        df = df.where(pd.notnull(df), None)
-
-        columns = df.columns.tolist()
-        values = df.values.tolist()
-
-        query = f"""
-            INSERT INTO api_hlr_live_numbers ({", ".join(columns)})
-            VALUES %s
-            ON CONFLICT (custom_variable_1) DO NOTHING
-        """
+        columns = ["custom_variable_1", *HLR_RAW_COLUMNS.values()]
+        rows = []
+        for payload in payloads:
+            key = payload["custom_variable_1"] if "custom_variable_1" in payload else next(iter(payload.values()), None)
+            rows.append((key, *(payload.get(field) for field in HLR_RAW_COLUMNS)))
 
+        column_list = sql.SQL(", ").join(sql.Identifier(c) for c in columns)
         with self._cursor() as cur:
-            execute_values(cur, query, values, page_size=1000)
+            cur.execute(sql.SQL("""
+                CREATE TEMP TABLE hlr_live_staging ON COMMIT DROP AS
+                SELECT {cols} FROM public.api_hlr_live_numbers WITH NO DATA
+            """).format(cols=column_list))
+            self._copy_rows(cur, "hlr_live_staging", columns, rows)
+            cur.execute(sql.SQL("""
+                INSERT INTO api_hlr_live_numbers ({cols})
+                SELECT {cols} FROM hlr_live_staging
+                ON CONFLICT (custom_variable_1) DO NOTHING
+            """).format(cols=column_list))
 
-        self.connection.commit()
 
     def create_db_entry(self, table_name: str, id: str, file_path: str):
         """
@@ -1140,10 +1433,8 @@ class DBHandler:
             """
             with self._cursor() as cursor:
                 cursor.execute(q, (id, table_name, file_path))
-            self.connection.commit()
             print(f"Created DB export entry for table {table_name} with id {id}.")
         except psycopg2.Error as e:
-            self.connection.rollback()
             print(f"Failed to create DB export entry: {e}")
             raise
 
@@ -1196,7 +1487,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (status, file_id))
-        self.connection.commit()
 
     def fetch_latest_db_export(self, table_name: str):
         """
@@ -1235,7 +1525,6 @@ class DBHandler:
         with self._cursor() as cursor:
             cursor.execute(q, (file_id, original_filename, raw_file_path))
             created = cursor.fetchone()
-        self.connection.commit()
         return {"id": created[0], "original_filename": original_filename, "status": "uploaded"}
 
     def list_encrypted_files(self, statuses=None):
@@ -1286,18 +1575,13 @@ class DBHandler:
             WHERE id=%s::uuid
             AND status IN ('uploaded', 'failed');
         """
-        try:
-            with self._cursor() as cursor:
-                cursor.execute(q, (file_id,))
-                if cursor.rowcount != 1:
-                    self.connection.rollback()
-                    return False
-            # The unique index one_processing_file_only enforces exclusivity
-            self.connection.commit()
-            return True
-        except psycopg2.Error as e:
-            self.connection.rollback()
-            raise
+        with self._cursor() as cursor:
+            cursor.execute(q, (file_id,))
+            if cursor.rowcount != 1:
+                cursor.connection.rollback()
+                return False
+        # The unique index one_processing_file_only enforces exclusivity
+        return True
 
     def get_encrypted_file_paths(self, file_id: str):
         q = """
@@ -1328,7 +1612,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (processed_path, file_id))
-        self.connection.commit()
 
     def mark_encrypted_failed(self, file_id: str, error_message: str):
         q = """
@@ -1339,7 +1622,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (error_message, file_id))
-        self.connection.commit()
 
     def archive_encrypted_file(self, file_id: str):
         q = """
@@ -1349,7 +1631,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (file_id,))
-        self.connection.commit()
 
     def delete_encrypted_file_entry(self, file_id: str):
         q = """
@@ -1358,7 +1639,134 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (file_id,))
-        self.connection.commit()
+
+    def get_campaign_window_totals(self, windows: list[tuple], open_ttl_seconds: float):
+        """
+        Cached Voluum totals for (from_date, to_date, campaign_id) windows, keyed by the
+        same tuples. Closed windows are always served; open ones while younger than
+        open_ttl_seconds.
+        """
+        windows = [window for window in windows if window[2]]
+        if not windows:
+            return {}
+        from_dates, to_dates, campaign_ids = (list(column) for column in zip(*windows))
+        q = """
+            SELECT w.from_date, w.to_date, w.campaign_id, c.totals
+            FROM unnest(%s::text[], %s::text[], %s::text[]) AS w(from_date, to_date, campaign_id)
+            JOIN public.voluum_campaign_window_totals c
+              ON c.campaign_id = w.campaign_id
+             AND c.window_from = w.from_date::timestamptz
+             AND c.window_to = w.to_date::timestamptz
+            WHERE (c.fetched_at >= c.window_to AND c.fetched_at >= c.window_from + INTERVAL '24 hours')
+               OR c.fetched_at >= NOW() - make_interval(secs => %s);
+        """
+        with self._cursor() as cursor:
+            cursor.execute(q, (from_dates, to_dates, campaign_ids, open_ttl_seconds))
+            return {(from_date, to_date, campaign_id): totals for from_date, to_date, campaign_id, totals in cursor.fetchall()}
+
+    def upsert_campaign_window_totals(self, totals: dict, open_ttl_seconds: float):
+        """
+        Store freshly fetched totals: {(from_date, to_date, campaign_id): totals}, and
+        delete these campaigns' open windows older than open_ttl_seconds. Those are never
+        served again, and since open windows move with every hour each refresh adds a row.
+        """
+        rows = [(campaign_id, from_date, to_date, Json(window_totals))
+                for (from_date, to_date, campaign_id), window_totals in totals.items() if campaign_id]
+        if not rows:
+            return
+        q = """
+            INSERT INTO public.voluum_campaign_window_totals (campaign_id, window_from, window_to, totals)
+            VALUES %s
+            ON CONFLICT (campaign_id, window_from, window_to) DO UPDATE
+            SET totals = EXCLUDED.totals,
+                fetched_at = NOW();
+        """
+        # Open = not closed as get_campaign_window_totals defines it; campaign_id uses the primary key
+        cleanup_q = """
+            DELETE FROM public.voluum_campaign_window_totals
+            WHERE campaign_id = ANY(%s)
+              AND NOT (fetched_at >= window_to AND fetched_at >= window_from + INTERVAL '24 hours')
+              AND fetched_at < NOW() - make_interval(secs => %s);
+        """
+        with self._cursor() as cursor:
+            execute_values(cursor, q, rows)
+            cursor.execute(cleanup_q, (sorted({row[0] for row in rows}), open_ttl_seconds))
+
+    def get_mmd_links(self, link_ids: list[int] | None = None) -> dict:
+        """Cached MessageWhiz links {id: url}; all of them when link_ids is None."""
+        with self._cursor() as cursor:
+            if link_ids is None:
+                cursor.execute("SELECT id, url FROM public.mmd_links;")
+            else:
+                cursor.execute("SELECT id, url FROM public.mmd_links WHERE id = ANY(%s::bigint[]);", (list(link_ids),))
+            return dict(cursor.fetchall())
+
+    def get_max_mmd_link_id(self) -> int | None:
+        with self._cursor() as cursor:
+            cursor.execute("SELECT MAX(id) FROM public.mmd_links;")
+            return cursor.fetchone()[0]
+
+    def upsert_mmd_links(self, links: dict):
+        """Store links {id: url}."""
+        if not links:
+            return
+        q = """
+            INSERT INTO public.mmd_links (id, url)
+            VALUES %s
+            ON CONFLICT (id) DO UPDATE
+            SET url = EXCLUDED.url,
+                fetched_at = NOW();
+        """
+        with self._cursor() as cursor:
+            execute_values(cursor, q, list(links.items()))
+
+    def get_mmd_broadcast_sync(self):
+        """(covered_from, synced_at, refreshed_at) of the local broadcast store, or None before the first sync."""
+        with self._cursor() as cursor:
+            cursor.execute("SELECT covered_from, synced_at, refreshed_at FROM public.mmd_broadcast_sync WHERE id = 1;")
+            return cursor.fetchone()
+
+    def set_mmd_broadcast_sync(self, covered_from, synced_at, refreshed_at=None):
+        """Advance the sync watermark; refreshed_at only for a sync that was also a settle refresh."""
+        q = """
+            INSERT INTO public.mmd_broadcast_sync (id, covered_from, synced_at, refreshed_at)
+            VALUES (1, %(covered_from)s, %(synced_at)s, COALESCE(%(refreshed_at)s, %(synced_at)s))
+            ON CONFLICT (id) DO UPDATE
+            SET covered_from = LEAST(mmd_broadcast_sync.covered_from, EXCLUDED.covered_from),
+                synced_at = GREATEST(mmd_broadcast_sync.synced_at, EXCLUDED.synced_at),
+                refreshed_at = GREATEST(mmd_broadcast_sync.refreshed_at, %(refreshed_at)s);
+        """
+        with self._cursor() as cursor:
+            cursor.execute(q, {"covered_from": covered_from, "synced_at": synced_at, "refreshed_at": refreshed_at})
+
+    def upsert_mmd_broadcasts(self, broadcasts: list[tuple]):
+        """Store broadcasts: list of (id, send_date, payload dict)."""
+        # One row per id, or ON CONFLICT DO UPDATE would touch the same row twice
+        rows = list({broadcast_id: (broadcast_id, send_date, Json(payload))
+                     for broadcast_id, send_date, payload in broadcasts}.values())
+        if not rows:
+            return
+        q = """
+            INSERT INTO public.mmd_broadcasts (id, send_date, payload)
+            VALUES %s
+            ON CONFLICT (id) DO UPDATE
+            SET send_date = EXCLUDED.send_date,
+                payload = EXCLUDED.payload,
+                synced_at = NOW();
+        """
+        with self._cursor() as cursor:
+            execute_values(cursor, q, rows)
+
+    def get_mmd_broadcasts(self, send_from, send_to=None) -> list[dict]:
+        """Stored broadcast payloads sent in [send_from, send_to), newest first."""
+        q = """
+            SELECT payload FROM public.mmd_broadcasts
+            WHERE send_date >= %s AND (%s::timestamptz IS NULL OR send_date < %s)
+            ORDER BY send_date DESC, id DESC;
+        """
+        with self._cursor() as cursor:
+            cursor.execute(q, (send_from, send_to, send_to))
+            return [payload for (payload,) in cursor.fetchall()]
 
     def create_broadcasts_file_entry(self, file_id, filename: str, raw_file_path: str, data_date: str, number_of_broadcasts: int) -> bool:
         """
@@ -1372,7 +1780,6 @@ class DBHandler:
         with self._cursor() as cursor:
             cursor.execute(q, (file_id, filename, raw_file_path, data_date, number_of_broadcasts))
             created = cursor.fetchone()
-        self.connection.commit()
         return
 
     def upsert_broadcast_campaign_stats(self, df):
@@ -1381,16 +1788,14 @@ class DBHandler:
         using execute_values for high performance.
         """
 
-        def remove_percentage(value: str):
-            return value.replace("%", "")
+        def remove_percentage(value: str | None):
+            # NaN/None for broadcasts without a resolvable Voluum campaign
+            return value.replace("%", "") if not pd.isna(value) else None
 
 
         if df.empty:
             return
 
-        # Replace NaN with None so PostgreSQL accepts NULLs
-        df = df.where(df.notna(), None)
-
         COLUMN_MAPPING = {
             "Campaign ID": "campaign_id",
             "Broadcast ID": "broadcast_id",
@@ -1416,6 +1821,10 @@ class DBHandler:
         df["ctr"] = df["ctr"].apply(remove_percentage)
         df["click_2_reg"] = df["click_2_reg"].apply(remove_percentage)
         df["reg_2_ftd"] = df["reg_2_ftd"].apply(remove_percentage)
+        # Visit counts are float (NaN) for broadcasts without Voluum totals; store them as integers
+        df = df.astype({"voluum_visits": "Int64", "voluum_unique_visits": "Int64"})
+        # Replace NaN with None so PostgreSQL accepts NULLs (object first: typed columns would keep NaN)
+        df = df.astype(object).where(df.notna(), None)
 
         columns = [
             "campaign_id",
@@ -1468,7 +1877,6 @@ class DBHandler:
 
         with self._cursor() as cursor:
             execute_values(cursor, sql_q, values, page_size=self.batch_size)
-        self.connection.commit()
 
     def list_broadcasts(self):
         q = """
@@ -1522,7 +1930,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (job_id, original_filename, interval_seconds, lower_limit, upper_limit))
-        self.connection.commit()
 
     def insert_csv_active_records(self, rows: list[tuple]) -> int:
         print("Hi")
@@ -1543,7 +1950,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             execute_values(cursor, q, rows, page_size=self.batch_size)
-        self.connection.commit()
         return len(rows)
 
     def update_csv_job_total_records(self, job_id: str, total_records: int):
@@ -1555,7 +1961,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (total_records, job_id))
-        self.connection.commit()
 
     def list_all_csv_ongage_files(self):
         try:
@@ -1596,7 +2001,6 @@ class DBHandler:
                     """,
                     (interval_seconds, lower_limit, upper_limit, job_id),
                 )
-            self.connection.commit()
             return {"ok": True, "job_id": job_id}
         except Exception as e:
             return e
@@ -1615,7 +2019,6 @@ class DBHandler:
                 (job_id,)
             )
             rowcount = cursor.rowcount
-        self.connection.commit()
         return rowcount
 
     def pause_ongage_csv_job(self, job_id):
@@ -1630,7 +2033,6 @@ class DBHandler:
                 (job_id,)
             )
             rowcount = cursor.rowcount
-        self.connection.commit()
         return rowcount
 
     def resume_ongage_csv_job(self, job_id):
@@ -1647,7 +2049,6 @@ class DBHandler:
                 (job_id,)
             )
             rowcount = cursor.rowcount
-        self.connection.commit()
         return rowcount
 
     def find_clickers_based_on_country_code(self, country_code, from_date=None, to_date=None):
@@ -1703,7 +2104,6 @@ class DBHandler:
         with self._cursor() as cursor:
             cursor.execute(q, (file_id, original_filename, raw_path, len(clickers), offer_count, offers, from_date, to_date))
             created = cursor.fetchone()
-        self.connection.commit()
         return {"id": created[0], "original_filename": original_filename, "status": "uploaded"}
 
     def create_smart_cleaning_voluum_file_entry_from_upload(self, file_id, raw_path, original_filename, row_count):
@@ -1731,7 +2131,6 @@ class DBHandler:
         with self._cursor() as cursor:
             cursor.execute(q, (file_id, original_filename, raw_path, row_count, offer_count, offers_str))
             created = cursor.fetchone()
-        self.connection.commit()
         return {"id": created[0], "original_filename": original_filename, "status": "uploaded"}
 
     def list_smart_cleaning_voluum_files(self, statuses=None):
@@ -1787,18 +2186,13 @@ class DBHandler:
             WHERE id=%s::uuid
             AND status IN ('uploaded', 'failed', 'processed');
         """
-        try:
-            with self._cursor() as cursor:
-                cursor.execute(q, (file_id,))
-                if cursor.rowcount != 1:
-                    self.connection.rollback()
-                    return False
-            # The unique index one_processing_file_only enforces exclusivity
-            self.connection.commit()
-            return True
-        except psycopg2.Error as e:
-            self.connection.rollback()
-            raise
+        with self._cursor() as cursor:
+            cursor.execute(q, (file_id,))
+            if cursor.rowcount != 1:
+                cursor.connection.rollback()
+                return False
+        # The unique index one_processing_file_only enforces exclusivity
+        return True
 
     def get_smart_cleaning_files_voluum_file_paths(self, file_id: str):
         q = """
@@ -1833,7 +2227,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (processed_path, record_count, offer_name, file_id))
-        self.connection.commit()
 
     def mark_smart_cleaning_files_voluum_failed(self, file_id: str, error_message: str):
         q = """
@@ -1844,7 +2237,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (error_message, file_id))
-        self.connection.commit()
 
     def archive_smart_cleaning_voluum_file(self, file_id: str):
         q = """
@@ -1854,7 +2246,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (file_id,))
-        self.connection.commit()
 
     def delete_smart_cleaning_voluum_file_entry(self, file_id: str):
         q = """
@@ -1863,7 +2254,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (file_id,))
-        self.connection.commit()
 
     def get_live_events_last_24h(self, offer_names: list[str]) -> set[str]:
         """
@@ -1986,7 +2376,6 @@ class DBHandler:
         with self._cursor() as cursor:
             cursor.execute(q, (file_id, original_filename, country_code, offer_count, offers_str, from_date, to_date))
             created = cursor.fetchone()
-        self.connection.commit()
         return {
             "id": created[0],
             "original_filename": original_filename,
@@ -2050,17 +2439,12 @@ class DBHandler:
             WHERE id=%s::uuid
               AND status IN ('uploaded', 'failed');
         """
-        try:
-            with self._cursor() as cursor:
-                cursor.execute(q, (file_id,))
-                if cursor.rowcount != 1:
-                    self.connection.rollback()
-                    return False
-            self.connection.commit()
-            return True
-        except psycopg2.Error:
-            self.connection.rollback()
-            raise
+        with self._cursor() as cursor:
+            cursor.execute(q, (file_id,))
+            if cursor.rowcount != 1:
+                cursor.connection.rollback()
+                return False
+        return True
 
     def get_reg_search_meta(self, file_id):
         q = """
@@ -2141,7 +2525,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (cleaned_path, total_regs, clean_count, offer_name, file_id))
-        self.connection.commit()
 
     def mark_reg_search_failed(self, file_id, error_message):
         q = """
@@ -2152,7 +2535,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (error_message, file_id))
-        self.connection.commit()
 
     def archive_reg_search_file(self, file_id):
         q = """
@@ -2162,7 +2544,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (file_id,))
-        self.connection.commit()
 
     def delete_reg_search_file(self, file_id):
         q = """
@@ -2171,7 +2552,6 @@ class DBHandler:
         """
         with self._cursor() as cursor:
             cursor.execute(q, (file_id,))
-        self.connection.commit()
 
     def import_csv_into_blacklist(self, csv_path: str):
         """
@@ -2219,7 +2599,6 @@ class DBHandler:
 
         with self._cursor() as cursor:
             execute_values(cursor, q, rows, page_size=self.batch_size)
-        self.connection.commit()
 
         return len(rows)
 
@@ -2256,7 +2635,6 @@ class DBHandler:
 
         with self._cursor() as cursor:
             execute_values(cursor, q, rows, page_size=self.batch_size)
-        self.connection.commit()
         print(f"Upserted {len(rows)} offers into voluum_offers.")
         return len(rows)
 
@@ -2288,7 +2666,6 @@ class DBHandler:
 
         with self._cursor() as cursor:
             execute_values(cursor, q, rows, page_size=self.batch_size)
-        self.connection.commit()
         print(f"Upserted {len(rows)} campaigns into voluum_campaigns.")
         return len(rows)
 
@@ -2328,76 +2705,69 @@ class DBHandler:
             rows = cursor.fetchall()
         return {r[0]: r[1] for r in rows}
 
+    def backfill_live_event_names(self):
+        """
+        Fill offer_name / campaign_name on live events that were stored before their
+        offer or campaign was known. Returns (offer rows, campaign rows) updated.
+        """
+        with self._cursor() as cursor:
+            cursor.execute("""
+                UPDATE public.voluum_live_events e
+                SET offer_name = o.offer_name
+                FROM public.voluum_offers o
+                WHERE e.offer_name IS NULL AND e.offer_id = o.offer_id AND o.offer_name IS NOT NULL
+            """)
+            offers_filled = cursor.rowcount
+            cursor.execute("""
+                UPDATE public.voluum_live_events e
+                SET campaign_name = c.campaign_name
+                FROM public.voluum_campaigns c
+                WHERE e.campaign_name IS NULL AND e.campaign_id = c.campaign_id AND c.campaign_name IS NOT NULL
+            """)
+            campaigns_filled = cursor.rowcount
+        return offers_filled, campaigns_filled
+
     # ============================================================
     # Voluum Live Events (SQS)
     # ============================================================
 
+    def _copy_rows(self, cursor, table_name, columns, rows):
+        """
+        COPY a list of tuples into `table_name` (`columns` in tuple order), batch_size rows
+        per COPY. None becomes NULL and empty strings stay empty strings.
+        """
+        copy_query = sql.SQL("COPY {tbl} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '\\N')").format(
+            tbl=sql.Identifier(table_name),
+            cols=sql.SQL(", ").join(sql.Identifier(c) for c in columns),
+        )
+        for i in range(0, len(rows), self.batch_size):
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(
+                tuple("\\N" if value is None else value for value in row) for row in rows[i:i + self.batch_size]
+            )
+            buffer.seek(0)
+            cursor.copy_expert(copy_query, buffer)
+
+    @staticmethod
+    def _to_pg_array(values):
+        if values is None:
+            return None
+        items = ("NULL" if v is None else '"' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values)
+        return "{" + ",".join(items) + "}"
+
     def insert_live_events(self, events: list[dict], offer_map: dict, campaign_map: dict):
         """
         Bulk upsert live events into voluum_live_events.
         Resolves offer_name and campaign_name from the provided lookup maps.
-        On duplicate custom_variable_1, updates the row with the latest data.
+        Events are COPYed into a staging table and merged with last-write-wins on the
+        event timestamp: per custom_variable_1 the newest event of the batch is kept, and
+        it only overwrites the stored row if its timestamp is not older. The result does
+        not depend on batch or delivery order.
         Returns count of rows processed.
         """
         if not events:
             return 0
 
-        q = """
-            INSERT INTO public.voluum_live_events (
-                click_id, campaign_id, campaign_name, offer_id, offer_name,
-                timestamp, external_id, traffic_source_id, lander_id, affiliate_network_id,
-                brand, browser, browser_version, device, model,
-                os, os_version, city, region, country_code,
-                isp, ip, referrer, url, user_agent,
-                language, mobile_carrier, connection_type, flow_id, path_id,
-                custom_variable_1, custom_variable_2, custom_variable_3, custom_variable_4, custom_variable_5,
-                custom_variable_6, custom_variable_7, custom_variable_8, custom_variable_9, custom_variable_10,
-                updated_at
-            )
-            VALUES %s
-            ON CONFLICT (custom_variable_1) DO UPDATE SET
-                click_id = EXCLUDED.click_id,
-                campaign_id = EXCLUDED.campaign_id,
-                campaign_name = EXCLUDED.campaign_name,
-                offer_id = EXCLUDED.offer_id,
-                offer_name = EXCLUDED.offer_name,
-                timestamp = EXCLUDED.timestamp,
-                external_id = EXCLUDED.external_id,
-                traffic_source_id = EXCLUDED.traffic_source_id,
-                lander_id = EXCLUDED.lander_id,
-                affiliate_network_id = EXCLUDED.affiliate_network_id,
-                brand = EXCLUDED.brand,
-                browser = EXCLUDED.browser,
-                browser_version = EXCLUDED.browser_version,
-                device = EXCLUDED.device,
-                model = EXCLUDED.model,
-                os = EXCLUDED.os,
-                os_version = EXCLUDED.os_version,
-                city = EXCLUDED.city,
-                region = EXCLUDED.region,
-                country_code = EXCLUDED.country_code,
-                isp = EXCLUDED.isp,
-                ip = EXCLUDED.ip,
-                referrer = EXCLUDED.referrer,
-                url = EXCLUDED.url,
-                user_agent = EXCLUDED.user_agent,
-                language = EXCLUDED.language,
-                mobile_carrier = EXCLUDED.mobile_carrier,
-                connection_type = EXCLUDED.connection_type,
-                flow_id = EXCLUDED.flow_id,
-                path_id = EXCLUDED.path_id,
-                custom_variable_2 = EXCLUDED.custom_variable_2,
-                custom_variable_3 = EXCLUDED.custom_variable_3,
-                custom_variable_4 = EXCLUDED.custom_variable_4,
-                custom_variable_5 = EXCLUDED.custom_variable_5,
-                custom_variable_6 = EXCLUDED.custom_variable_6,
-                custom_variable_7 = EXCLUDED.custom_variable_7,
-                custom_variable_8 = EXCLUDED.custom_variable_8,
-                custom_variable_9 = EXCLUDED.custom_variable_9,
-                custom_variable_10 = EXCLUDED.custom_variable_10,
-                updated_at = EXCLUDED.updated_at;
-        """
-
         now = datetime.now()
         rows = []
         for e in events:
@@ -2411,116 +2781,328 @@ class DBHandler:
 
             offer_id = e.get("offerId")
             campaign_id = e.get("campaignId")
-            offer_name = offer_map.get(offer_id)
-            campaign_name = campaign_map.get(campaign_id)
-
             rows.append((
-                e.get("clickId"),
-                campaign_id,
-                campaign_name,
-                offer_id,
-                offer_name,
-                e.get("timestamp"),
-                e.get("externalId"),
-                e.get("trafficSourceId"),
-                e.get("landerId"),
-                e.get("affiliateNetworkId"),
-                e.get("brand"),
-                e.get("browser"),
-                e.get("browserVersion"),
-                e.get("device"),
-                e.get("model"),
-                e.get("os"),
-                e.get("osVersion"),
-                e.get("city"),
-                e.get("region"),
-                e.get("countryCode"),
-                e.get("isp"),
-                e.get("ip"),
-                e.get("referrer"),
-                e.get("url"),
-                e.get("userAgent"),
-                e.get("language"),
-                e.get("mobileCarrier"),
-                e.get("connectionType"),
-                e.get("flowId"),
-                e.get("pathId"),
-                cvars[0], cvars[1], cvars[2], cvars[3], cvars[4],
-                cvars[5], cvars[6], cvars[7], cvars[8], cvars[9],
+                *(e.get(key) for key in LIVE_EVENT_FIELDS),
+                campaign_map.get(campaign_id),
+                offer_map.get(offer_id),
+                *cvars,
                 now,
             ))
 
         if not rows:
             return 0
 
+        columns = list(LIVE_EVENT_FIELDS.values()) + ["campaign_name", "offer_name"] + [f"custom_variable_{n}" for n in range(1, 11)] + ["updated_at"]
+        column_list = sql.SQL(", ").join(sql.Identifier(c) for c in columns)
+        updates = sql.SQL(", ").join(
+            sql.SQL("{col} = EXCLUDED.{col}").format(col=sql.Identifier(c)) for c in columns if c != "custom_variable_1"
+        )
         with self._cursor() as cursor:
-            execute_values(cursor, q, rows, page_size=self.batch_size)
-        self.connection.commit()
+            cursor.execute(sql.SQL("""
+                CREATE TEMP TABLE live_events_staging ON COMMIT DROP AS
+                SELECT {cols} FROM public.voluum_live_events WITH NO DATA
+            """).format(cols=column_list))
+            self._copy_rows(cursor, "live_events_staging", columns, rows)
+            cursor.execute(sql.SQL("""
+                INSERT INTO public.voluum_live_events ({cols})
+                SELECT DISTINCT ON (custom_variable_1) {cols}
+                FROM live_events_staging
+                ORDER BY custom_variable_1, timestamp DESC NULLS LAST, click_id DESC NULLS LAST
+                ON CONFLICT (custom_variable_1) DO UPDATE SET {updates}
+                WHERE voluum_live_events.timestamp IS NULL
+                   OR EXCLUDED.timestamp >= voluum_live_events.timestamp
+            """).format(cols=column_list, updates=updates))
         print(f"Upserted {len(rows)} live events into voluum_live_events.")
         return len(rows)
 
-    def insert_raw_live_events(self, events: list[dict]):
+    def insert_raw_live_events(self, events: list[dict], message_keys: list[tuple] | None = None):
         """
         Bulk insert raw live events into raw_live_voluum_sns_data.
         Stores everything as-is with customVariables as a TEXT[] array.
-        No deduplication — every event is stored.
+        Events are COPYed into a staging table and appended with one INSERT ... SELECT.
+        message_keys[i] is (SQS MessageId, index of the event in that message); rows whose
+        key is already stored are skipped, so a redelivered message is not written twice.
+        Returns the number of rows actually inserted.
         """
         if not events:
             return 0
+        if message_keys is None:
+            message_keys = [(None, None)] * len(events)
+
+        rows = [
+            (
+                *(e.get(key) for key in LIVE_EVENT_FIELDS),
+                self._to_pg_array(e.get("customVariables", [])),
+                message_id,
+                event_index,
+            )
+            for e, (message_id, event_index) in zip(events, message_keys)
+        ]
+        columns = list(LIVE_EVENT_FIELDS.values()) + ["custom_variables", "sqs_message_id", "sqs_event_index"]
+        column_list = sql.SQL(", ").join(sql.Identifier(c) for c in columns)
+
+        with self._cursor() as cursor:
+            cursor.execute(sql.SQL("""
+                CREATE TEMP TABLE raw_live_events_staging ON COMMIT DROP AS
+                SELECT {cols} FROM public.raw_live_voluum_sns_data WITH NO DATA
+            """).format(cols=column_list))
+            self._copy_rows(cursor, "raw_live_events_staging", columns, rows)
+            cursor.execute(sql.SQL("""
+                INSERT INTO public.raw_live_voluum_sns_data ({cols})
+                SELECT {cols} FROM raw_live_events_staging
+                ON CONFLICT DO NOTHING
+            """).format(cols=column_list))
+            inserted = cursor.rowcount
+        print(f"Inserted {inserted} raw events into raw_live_voluum_sns_data ({len(rows) - inserted} already stored).")
+        return inserted
+
+    def _raw_live_partition_bounds(self, day: date):
+        """(start, end) of the partition holding `day`; weekly partitions start on Monday."""
+        if RAW_LIVE_PARTITION_INTERVAL == "week":
+            start = day - timedelta(days=day.weekday())
+            return start, start + timedelta(days=7)
+        return day, day + timedelta(days=1)
+
+    def maintain_raw_live_partitions(self, today: date | None = None):
+        """
+        Partition housekeeping for raw_live_voluum_sns_data:
+        - creates the current partition and RAW_LIVE_PARTITIONS_AHEAD more,
+        - detaches and drops partitions whose whole range is older than RAW_LIVE_RETENTION_DAYS.
+        Dropping a partition is a metadata operation, so retention never runs a mass DELETE.
+        Partitions are named raw_live_voluum_sns_data_pYYYYMMDD after their first day.
+        Returns (created, dropped) partition names.
+        """
+        today = today or datetime.now().date()
+        prefix = "raw_live_voluum_sns_data_p"
+        created, dropped = [], []
+
+        with self._cursor() as cursor:
+            cursor.execute("""
+                SELECT 1 FROM pg_partitioned_table pt
+                JOIN pg_class c ON c.oid = pt.partrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'public' AND c.relname = 'raw_live_voluum_sns_data'
+            """)
+            if cursor.fetchone() is None:
+                print("raw_live_voluum_sns_data is not partitioned; run sql/partition_raw_live_voluum_sns_data.sql first.")
+                return created, dropped
+
+            cursor.execute("""
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'public.raw_live_voluum_sns_data'::regclass
+            """)
+            existing = {row[0] for row in cursor.fetchall()}
+
+        start, end = self._raw_live_partition_bounds(today)
+        for _ in range(RAW_LIVE_PARTITIONS_AHEAD + 1):
+            name = f"{prefix}{start:%Y%m%d}"
+            if name not in existing:
+                try:
+                    with self._cursor() as cursor:
+                        cursor.execute(sql.SQL(
+                            "CREATE TABLE IF NOT EXISTS public.{part} PARTITION OF public.raw_live_voluum_sns_data FOR VALUES FROM (%s) TO (%s)"
+                        ).format(part=sql.Identifier(name)), (start, end))
+                    created.append(name)
+                except psycopg2.Error as e:
+                    # e.g. the DEFAULT partition already holds rows for this range
+                    print(f"Could not create partition {name}: {e}")
+            start, end = end, self._raw_live_partition_bounds(end)[1]
+
+        if RAW_LIVE_RETENTION_DAYS > 0:
+            cutoff = today - timedelta(days=RAW_LIVE_RETENTION_DAYS)
+            for name in sorted(existing):
+                if not name.startswith(prefix):
+                    continue
+                try:
+                    partition_start = datetime.strptime(name[len(prefix):], "%Y%m%d").date()
+                except ValueError:
+                    continue
+                if self._raw_live_partition_bounds(partition_start)[1] <= cutoff:
+                    with self._cursor() as cursor:
+                        cursor.execute(sql.SQL("ALTER TABLE public.raw_live_voluum_sns_data DETACH PARTITION public.{part}").format(part=sql.Identifier(name)))
+                        cursor.execute(sql.SQL("DROP TABLE public.{part}").format(part=sql.Identifier(name)))
+                    dropped.append(name)
+
+        if created or dropped:
+            print(f"raw_live_voluum_sns_data partitions: created {created}, dropped {dropped}")
+        return created, dropped
+
+    def insert_sqs_dead_letters(self, dead_letters: list[dict]):
+        """
+        Park SQS messages that can't be processed in sqs_dead_letters.
+        Each item: message_id, body, error_message, receive_count.
+        """
+        if not dead_letters:
+            return 0
+        q = """
+            INSERT INTO public.sqs_dead_letters (message_id, body, error_message, receive_count)
+            VALUES %s
+            ON CONFLICT (message_id) DO NOTHING;
+        """
+        rows = [(d["message_id"], d["body"], d["error_message"], d["receive_count"]) for d in dead_letters]
+        with self._cursor() as cursor:
+            execute_values(cursor, q, rows, page_size=self.batch_size)
+        return len(rows)
 
+    # ============================================================
+    # Background job queue (job_queue)
+    # ============================================================
+
+    def enqueue_job(self, job_type: str, payload: dict) -> int:
+        """Queue a job for the worker processes (worker.py). Returns the job id."""
         q = """
-            INSERT INTO public.raw_live_voluum_sns_data (
-                click_id, campaign_id, offer_id,
-                timestamp, external_id, traffic_source_id, lander_id, affiliate_network_id,
-                brand, browser, browser_version, device, model,
-                os, os_version, city, region, country_code,
-                isp, ip, referrer, custom_variables, url, user_agent,
-                language, mobile_carrier, connection_type, flow_id, path_id
-            )
-            VALUES %s;
+            INSERT INTO public.job_queue (job_type, payload)
+            VALUES (%s, %s)
+            RETURNING id;
         """
+        with self._cursor() as cursor:
+            cursor.execute(q, (job_type, Json(payload)))
+            return cursor.fetchone()[0]
 
-        rows = []
-        for e in events:
-            cvars = e.get("customVariables", [])
+    def claim_job(self, worker_id: str, limits: dict):
+        """
+        Claim the oldest queued job whose type is below its concurrency limit.
+        `limits` maps job_type -> max running jobs of that type across all workers.
+        Claims of one type are serialized with an advisory lock so the running
+        count can't be overshot; rows are picked with FOR UPDATE SKIP LOCKED.
+        Returns the claimed job as a dict, or None.
+        """
+        if not limits:
+            return None
+        with self._cursor() as cursor:
+            cursor.execute("""
+                SELECT job_type FROM public.job_queue
+                WHERE status = 'queued' AND job_type = ANY(%s)
+                GROUP BY job_type
+                ORDER BY min(id);
+            """, (list(limits),))
+            job_types = [row[0] for row in cursor.fetchall()]
 
-            rows.append((
-                e.get("clickId"),
-                e.get("campaignId"),
-                e.get("offerId"),
-                e.get("timestamp"),
-                e.get("externalId"),
-                e.get("trafficSourceId"),
-                e.get("landerId"),
-                e.get("affiliateNetworkId"),
-                e.get("brand"),
-                e.get("browser"),
-                e.get("browserVersion"),
-                e.get("device"),
-                e.get("model"),
-                e.get("os"),
-                e.get("osVersion"),
-                e.get("city"),
-                e.get("region"),
-                e.get("countryCode"),
-                e.get("isp"),
-                e.get("ip"),
-                e.get("referrer"),
-                cvars,
-                e.get("url"),
-                e.get("userAgent"),
-                e.get("language"),
-                e.get("mobileCarrier"),
-                e.get("connectionType"),
-                e.get("flowId"),
-                e.get("pathId"),
-            ))
+        for job_type in job_types:
+            with self._cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext('job_queue'), hashtext(%s))", (job_type,))
+                if not cursor.fetchone()[0]:
+                    # Another worker is claiming this type right now
+                    continue
+                cursor.execute("SELECT count(*) FROM public.job_queue WHERE job_type = %s AND status = 'running'", (job_type,))
+                if cursor.fetchone()[0] >= limits[job_type]:
+                    continue
+                cursor.execute("""
+                    UPDATE public.job_queue
+                    SET status = 'running',
+                        attempts = attempts + 1,
+                        worker_id = %s,
+                        started_at = NOW(),
+                        heartbeat_at = NOW(),
+                        error_message = NULL
+                    WHERE id = (
+                        SELECT id FROM public.job_queue
+                        WHERE job_type = %s AND status = 'queued'
+                        ORDER BY id
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, job_type, payload, attempts, progress;
+                """, (worker_id, job_type))
+                row = cursor.fetchone()
+                if row:
+                    return {"id": row[0], "job_type": row[1], "payload": row[2], "attempts": row[3], "progress": row[4]}
+        return None
 
-        if not rows:
-            return 0
+    def heartbeat_job(self, job_id: int, worker_id: str, progress: dict | None = None, cursor=None) -> bool:
+        """
+        Refresh a running job's heartbeat, optionally saving a progress checkpoint.
+        Returns False if the job is no longer owned by this worker (e.g. it was recovered).
+        With `cursor` the checkpoint commits together with the caller's transaction.
+        """
+        q = """
+            UPDATE public.job_queue
+            SET heartbeat_at = NOW(),
+                progress = COALESCE(%s, progress)
+            WHERE id = %s AND worker_id = %s AND status = 'running';
+        """
+        params = (Json(progress) if progress is not None else None, job_id, worker_id)
+        if cursor is not None:
+            cursor.execute(q, params)
+            return cursor.rowcount == 1
+        with self._cursor() as cursor:
+            cursor.execute(q, params)
+            return cursor.rowcount == 1
+
+    def finish_job(self, job_id: int, worker_id: str, error_message: str | None = None):
+        """
+        Mark a running job done. With error_message the attempt failed: the job is
+        requeued (keeping its progress) while attempts < max_attempts, else failed.
+        Returns the new status, or None if the job is no longer owned by this worker.
+        """
+        q = """
+            UPDATE public.job_queue
+            SET status = CASE WHEN %(failed)s AND attempts < max_attempts THEN 'queued'
+                              WHEN %(failed)s THEN 'failed'
+                              ELSE 'done' END,
+                error_message = %(error_message)s,
+                finished_at = CASE WHEN %(failed)s AND attempts < max_attempts THEN NULL ELSE NOW() END,
+                worker_id = CASE WHEN %(failed)s AND attempts < max_attempts THEN NULL ELSE worker_id END
+            WHERE id = %(job_id)s AND worker_id = %(worker_id)s AND status = 'running'
+            RETURNING status;
+        """
+        params = {"failed": error_message is not None, "error_message": error_message, "job_id": job_id, "worker_id": worker_id}
+        with self._cursor() as cursor:
+            cursor.execute(q, params)
+            row = cursor.fetchone()
+        return row[0] if row else None
 
+    def recover_stale_jobs(self, heartbeat_timeout_seconds: float, dead_worker_ids: list[str] | None = None):
+        """
+        Crash recovery for running jobs whose worker died (listed in dead_worker_ids)
+        or stopped heartbeating. They are requeued, keeping their progress so the job
+        can resume, or failed once max_attempts is used up.
+        Returns the jobs that were failed: list of dicts with id, job_type, payload.
+        """
+        q = """
+            UPDATE public.job_queue
+            SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                error_message = 'Worker lost while running the job',
+                finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE NOW() END,
+                worker_id = NULL
+            WHERE status = 'running'
+              AND (heartbeat_at < NOW() - make_interval(secs => %s) OR worker_id = ANY(%s))
+            RETURNING id, job_type, payload, status;
+        """
         with self._cursor() as cursor:
-            execute_values(cursor, q, rows, page_size=self.batch_size)
-        self.connection.commit()
-        print(f"Inserted {len(rows)} raw events into raw_live_voluum_sns_data.")
-        return len(rows)
+            cursor.execute(q, (heartbeat_timeout_seconds, dead_worker_ids or []))
+            rows = cursor.fetchall()
+        for job_id, job_type, _, status in rows:
+            print(f"Recovered {job_type} job {job_id}: {'requeued' if status == 'queued' else 'failed after max attempts'}")
+        return [{"id": r[0], "job_type": r[1], "payload": r[2]} for r in rows if r[3] == "failed"]
+
+    def get_job(self, job_id: int):
+        q = """
+            SELECT id, job_type, payload, status, attempts, max_attempts, progress, worker_id,
+                   error_message, created_at, started_at, heartbeat_at, finished_at
+            FROM public.job_queue
+            WHERE id = %s;
+        """
+        with self._cursor() as cursor:
+            cursor.execute(q, (job_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            cols = [d[0] for d in cursor.description]
+        return dict(zip(cols, row))
+
+    def list_jobs(self, statuses: list[str] | None = None, limit: int = 100):
+        q = """
+            SELECT id, job_type, payload, status, attempts, max_attempts, progress, worker_id,
+                   error_message, created_at, started_at, heartbeat_at, finished_at
+            FROM public.job_queue
+            WHERE %s::text[] IS NULL OR status = ANY(%s::text[])
+            ORDER BY id DESC
+            LIMIT %s;
+        """
+        with self._cursor() as cursor:
+            cursor.execute(q, (statuses, statuses, limit))
+            rows = cursor.fetchall()
+            cols = [d[0] for d in cursor.description]
+        return [dict(zip(cols, r)) for r in rows]
@@ -0,0 +1,123 @@
+import psycopg2
+import os
+import threading
+from dotenv import load_dotenv
+from time import time
+
+load_dotenv()
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "60"))
+# Idle connections older than this are pinged with SELECT 1 before being handed out
+DB_POOL_HEALTHCHECK_SECONDS = float(os.getenv("DB_POOL_HEALTHCHECK_SECONDS", "30"))
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class DBConnectionPool:
+    """
+    Bounded, thread-safe psycopg2 connection pool.
+    - At most `max_size` connections are open at once; getconn() blocks
+      (up to `timeout` seconds) when all of them are checked out.
+    - `min_size` connections are opened eagerly and kept idle.
+    - Idle connections are health-checked on checkout and transparently
+      replaced if the socket is broken.
+    """
+
+    def __init__(self, dsn_kwargs: dict, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE, timeout=DB_POOL_TIMEOUT_SECONDS):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+        self.dsn_kwargs = dsn_kwargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = []  # list of (connection, last_used_at)
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time()))
+
+    def _connect(self):
+        try:
+            return psycopg2.connect(**self.dsn_kwargs)
+        except psycopg2.OperationalError:
+            # Retry once on transient connect failures
+            return psycopg2.connect(**self.dsn_kwargs)
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, connection, last_used_at):
+        if connection.closed:
+            return False
+        if time() - last_used_at < DB_POOL_HEALTHCHECK_SECONDS:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutError(f"No database connection available after {self.timeout} seconds (max_size={self.max_size})")
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return self._connect()
+                connection, last_used_at = item
+                if self._is_healthy(connection, last_used_at):
+                    return connection
+                self._close_quietly(connection)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection, discard=False):
+        try:
+            if discard or connection.closed:
+                self._close_quietly(connection)
+                return
+            if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            with self._lock:
+                self._idle.append((connection, time()))
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._close_quietly(connection)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close_quietly(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn_kwargs: dict) -> DBConnectionPool:
+    """
+    Return the process-wide pool for these connection settings, creating it on first use.
+    Every DBHandler instance in the process shares the same pool.
+    """
+    key = tuple(sorted(dsn_kwargs.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = DBConnectionPool(dsn_kwargs)
+            _pools[key] = pool
+        return pool
@@ -2,13 +2,37 @@ from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import os
 from dotenv import load_dotenv
 import base64
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 load_dotenv()
 
+# token -> plaintext entries kept across calls (one sync's clickers show up again in conversions)
+DECRYPT_CACHE_SIZE = int(os.getenv("DECRYPT_CACHE_SIZE", "1000000"))
+# Uncached tokens needed before decrypt_many fans out to worker processes
+DECRYPT_PARALLEL_THRESHOLD = int(os.getenv("DECRYPT_PARALLEL_THRESHOLD", "200000"))
+DECRYPT_WORKERS = int(os.getenv("DECRYPT_WORKERS", str(os.cpu_count() or 1)))
+
+_worker_handler = None
+
+
+def _init_decrypt_worker():
+    global _worker_handler
+    _worker_handler = EncryptionHandler()
+
+
+def _decrypt_chunk(encrypted_keys):
+    return [_worker_handler.decrypt_number(key) for key in encrypted_keys]
+
+
 class EncryptionHandler:
     def __init__(self):
         self.aesgcm = AESGCM(base64.urlsafe_b64decode(os.getenv("AES_KEY")))
-    
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
     def encrypt_number(self, phone_number):
         nonce = os.urandom(12)  # GCM standard
         ciphertext = self.aesgcm.encrypt(
@@ -18,17 +42,61 @@ class EncryptionHandler:
         )
         token = nonce + ciphertext
         return base64.urlsafe_b64encode(token).decode().rstrip("=")
-    
+
     def decrypt_number(self, encrypted_key):
         padded = encrypted_key + "=" * (-len(encrypted_key) % 4)
         raw = base64.urlsafe_b64decode(padded.encode())
         nonce = raw[:12]
         ciphertext = raw[12:]
         return self.aesgcm.decrypt(nonce, ciphertext, None).decode()
-    
+
+    def _decrypt_parallel(self, encrypted_keys):
+        chunk_size = -(-len(encrypted_keys) // DECRYPT_WORKERS)
+        chunks = [encrypted_keys[i:i + chunk_size] for i in range(0, len(encrypted_keys), chunk_size)]
+        # spawn, not fork: this runs inside a threaded uvicorn worker
+        with ProcessPoolExecutor(
+            max_workers=len(chunks),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_decrypt_worker,
+        ) as executor:
+            return [plaintext for chunk in executor.map(_decrypt_chunk, chunks) for plaintext in chunk]
+
+    def decrypt_many(self, encrypted_keys):
+        """
+        Decrypt a list of tokens, returning plaintexts in the same order.
+        - Each distinct token is decrypted at most once per call.
+        - Results are kept in an LRU cache (DECRYPT_CACHE_SIZE entries) shared by
+          every call on this handler, so tokens seen in an earlier sync are free.
+        - Large batches of uncached tokens are split across DECRYPT_WORKERS processes.
+        """
+        unique_keys = list(dict.fromkeys(encrypted_keys))
+        plaintexts = {}
+        misses = []
+        with self._cache_lock:
+            for key in unique_keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    plaintexts[key] = self._cache[key]
+                else:
+                    misses.append(key)
+
+        if misses:
+            if DECRYPT_WORKERS > 1 and len(misses) >= DECRYPT_PARALLEL_THRESHOLD:
+                decrypted = self._decrypt_parallel(misses)
+            else:
+                decrypted = [self.decrypt_number(key) for key in misses]
+            new_entries = dict(zip(misses, decrypted))
+            plaintexts.update(new_entries)
+            with self._cache_lock:
+                self._cache.update(new_entries)
+                while len(self._cache) > DECRYPT_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+
+        return [plaintexts[key] for key in encrypted_keys]
+
     def encrypt_list(self, phone_numbers):
         return [self.encrypt_number(number) for number in phone_numbers]
-    
+
 if __name__ == "__main__":
     encryption_handler = EncryptionHandler()
     encrypted_keys = encryption_handler.encrypt_list(["923244415089", "923241232323235089"])
@@ -0,0 +1,240 @@
+import os
+import csv
+import json
+import requests
+from time import time, sleep
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+load_dotenv()
+
+HLR_APIKEY = os.getenv("HLRLOOKUP_APIKEY")
+HLR_SECRET = os.getenv("HLRLOOKUP_SECRET")
+HLR_BATCH_URL = "https://batches.hlrlookup.com/batches"
+
+# Processed files larger than this are split into several batches that run concurrently
+HLR_BATCH_MAX_ROWS = int(os.getenv("HLR_BATCH_MAX_ROWS", "100000"))
+HLR_MAX_CONCURRENT_BATCHES = int(os.getenv("HLR_MAX_CONCURRENT_BATCHES", "4"))
+# Status polling starts at HLR_POLL_EVERY_SECONDS and adapts to the batch's completion rate,
+# backing off up to HLR_POLL_MAX_INTERVAL_SECONDS while nothing moves
+HLR_POLL_EVERY_SECONDS = float(os.getenv("HLR_POLL_EVERY_SECONDS", "5"))
+HLR_POLL_MAX_INTERVAL_SECONDS = float(os.getenv("HLR_POLL_MAX_INTERVAL_SECONDS", "120"))
+HLR_POLL_MAX_SECONDS = int(os.getenv("HLR_POLL_MAX_SECONDS", "18000"))  # 5 hour default
+HLR_DOWNLOAD_CHUNK_BYTES = int(os.getenv("HLR_DOWNLOAD_CHUNK_BYTES", str(1024 * 1024)))
+# Pre-HLR cache: "LIVE_STATUS=days,..." - a number checked within its status' TTL is resolved
+# from hlr_lookup_cache instead of the batch API; unlisted statuses are always looked up
+HLR_CACHE_TTL_DAYS = os.getenv(
+    "HLR_CACHE_TTL_DAYS",
+    "LIVE=30,DEAD=90,NOT_AVAILABLE_NETWORK_ONLY=90,NOT_APPLICABLE=90,NO_TELESERVICE_PROVISIONED=90,"
+    "ABSENT_SUBSCRIBER=7,NO_COVERAGE=7,INCONCLUSIVE=3",
+)
+HLR_CACHE_LOOKUP_CHUNK_ROWS = int(os.getenv("HLR_CACHE_LOOKUP_CHUNK_ROWS", "50000"))
+# Parsed HLR results are classified and written in chunks of this many rows
+HLR_RESULT_CHUNK_ROWS = int(os.getenv("HLR_RESULT_CHUNK_ROWS", "20000"))
+
+HLR_DEAD_STATUSES = ("NOT_AVAILABLE_NETWORK_ONLY", "NOT_APPLICABLE", "NO_TELESERVICE_PROVISIONED", "DEAD")
+HLR_MONITOR_STATUSES = ("NO_COVERAGE", "INCONCLUSIVE", "ABSENT_SUBSCRIBER")
+
+
+def normalize_network_name(name: str) -> str:
+    return (name or "").lower().replace(" ", "")
+
+
+def load_risky_networks(path="app/utils/risky_operators.json") -> frozenset:
+    with open(path, "r") as f:
+        return frozenset(normalize_network_name(name) for name in json.load(f)["risky_networks"])
+
+
+RISKY_NETWORKS = load_risky_networks()
+
+
+def parse_cache_ttl_days(spec: str) -> dict:
+    ttl_days = {}
+    for item in spec.split(","):
+        if "=" in item:
+            live_status, days = item.split("=", 1)
+            if int(days) > 0:
+                ttl_days[live_status.strip().upper()] = int(days)
+    return ttl_days
+
+
+def classify_hlr_result(live_status: str, network_name: str, risky_networks=RISKY_NETWORKS) -> str | None:
+    """"live", "risky", "dead", "monitor" or None (ignored) for one HLR result."""
+    live_status = (live_status or "").upper()
+    if live_status == "LIVE":
+        if normalize_network_name(network_name) in risky_networks:
+            return "risky"
+        return "live"
+    if live_status in HLR_DEAD_STATUSES:
+        return "dead"
+    if live_status in HLR_MONITOR_STATUSES:
+        return "monitor"
+    return None
+
+
+def create_hlr_session():
+    """Session for the batch API; only idempotent GETs are retried on 429/5xx."""
+    retry = Retry(
+        total=5,
+        backoff_factor=2,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        respect_retry_after_header=True,
+    )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(max_retries=retry, pool_maxsize=HLR_MAX_CONCURRENT_BATCHES * 2))
+    return session
+
+
+def split_csv_lines(path: str, rows_per_part: int, part_path_fmt: str) -> list[str]:
+    """
+    Split a headerless single-column CSV into files of at most `rows_per_part`
+    lines, named part_path_fmt.format(index). Streams; never loads the file.
+    """
+    part_paths = []
+    out = None
+    rows_in_part = rows_per_part
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if rows_in_part >= rows_per_part:
+                if out:
+                    out.close()
+                part_paths.append(part_path_fmt.format(len(part_paths)))
+                out = open(part_paths[-1], "w", encoding="utf-8", newline="")
+                rows_in_part = 0
+            out.write(line if line.endswith("\n") else line + "\n")
+            rows_in_part += 1
+    if out:
+        out.close()
+    return part_paths
+
+
+def iter_hlr_results(raw_path: str, chunk_rows=HLR_RESULT_CHUNK_ROWS):
+    """
+    Stream an HLR results CSV as lists of at most `chunk_rows` results:
+    (number, sent_number, live_status, network_name, row). Rows without a
+    formatted or detected number are skipped.
+    """
+    chunk = []
+    with open(raw_path, newline="", encoding="utf-8") as csvfile:
+        for row in csv.DictReader(csvfile):
+            number = (
+                row.get("formatted_telephone_number")
+                or row.get("detected_telephone_number")
+                or ""
+            ).strip()
+            if not number:
+                continue
+            # The number as we sent it; cache lookups on the next run use this form
+            sent_number = (row.get("request_parameters.telephone_number") or "").strip() or number
+            chunk.append((number, sent_number, (row.get("live_status") or "").upper(), row.get("current_network_details.name"), row))
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+class HLRBatchHandler:
+    """
+    Client for the HLRLookup Batch API (create -> upload source -> start -> poll -> results).
+    Thread-safe: one shared session, so several batches can run from a thread pool.
+    """
+
+    def __init__(self, apikey=HLR_APIKEY, secret=HLR_SECRET):
+        self.apikey = apikey
+        self.secret = secret
+        self.session = create_hlr_session()
+
+    def _url(self, path: str) -> str:
+        return f"{HLR_BATCH_URL}/{path}?apikey={self.apikey}&secret={self.secret}"
+
+    def create_batch(self, filename: str) -> str:
+        payload = {
+            "filename": filename,
+            "type": "HLR_V2",
+            "batchArguments": {
+                "cache_days_private": 30,
+                "cache_days_global": 30,
+                "save_to_cache": "YES",
+            }
+        }
+        r = self.session.post(self._url(""), json=payload, timeout=60)
+        r.raise_for_status()
+        batch = r.json()
+        batch_id = batch.get("id")
+        if not batch_id:
+            raise Exception(f"HLR batch create failed: {batch}")
+        return str(batch_id)
+
+    def upload_source(self, batch_id: str, source_path: str):
+        with open(source_path, "rb") as f:
+            r = self.session.post(
+                self._url(f"{batch_id}/source"),
+                data=f,
+                headers={"Content-Type": "text/csv"},
+                timeout=300,
+            )
+        r.raise_for_status()
+
+    def start_batch(self, batch_id: str):
+        r = self.session.put(self._url(f"{batch_id}/"), json={"status": "PROCESSING"}, timeout=60)
+        r.raise_for_status()
+
+    def get_status(self, batch_id: str) -> dict:
+        r = self.session.get(self._url(batch_id), timeout=60)
+        r.raise_for_status()
+        return r.json()
+
+    def wait_for_batch(self, batch_id: str, on_progress=None, max_wait_seconds=HLR_POLL_MAX_SECONDS, cancel_event=None):
+        """
+        Poll until the batch is COMPLETE; raises if it fails or times out.
+        While items complete, the next poll is scheduled for roughly halfway to the
+        projected finish (never below HLR_POLL_EVERY_SECONDS); without progress the
+        interval grows 1.5x up to HLR_POLL_MAX_INTERVAL_SECONDS.
+        on_progress(num_items, num_complete) is called after every poll; setting
+        cancel_event stops the wait early.
+        """
+        started_at = time()
+        interval = HLR_POLL_EVERY_SECONDS
+        last_complete, last_poll_at = None, started_at
+        while True:
+            info = self.get_status(batch_id)
+            now = time()
+            api_status = (info.get("status") or "").upper()
+            num_items = info.get("numItems")
+            num_complete = info.get("numComplete")
+            if on_progress:
+                on_progress(num_items, num_complete)
+
+            if api_status in ("COMPLETE", "COMPLETED"):
+                return info
+            if api_status in ("FAILED", "ERROR"):
+                raise Exception(f"HLR batch failed: {info}")
+            if now - started_at >= max_wait_seconds:
+                raise Exception("HLR polling timed out")
+
+            if num_complete is not None and last_complete is not None and num_complete > last_complete:
+                rate = (num_complete - last_complete) / max(now - last_poll_at, 1e-6)
+                remaining = max((num_items or num_complete) - num_complete, 0)
+                interval = min(max(remaining / rate / 2, HLR_POLL_EVERY_SECONDS), HLR_POLL_MAX_INTERVAL_SECONDS)
+            elif last_complete is not None:
+                interval = min(interval * 1.5, HLR_POLL_MAX_INTERVAL_SECONDS)
+            last_complete, last_poll_at = num_complete, now
+            if cancel_event is not None:
+                if cancel_event.wait(interval):
+                    raise Exception("HLR polling cancelled")
+            else:
+                sleep(interval)
+
+    def download_results(self, batch_id: str, results_path: str):
+        """Stream the results CSV to disk in HLR_DOWNLOAD_CHUNK_BYTES pieces."""
+        with self.session.get(self._url(f"{batch_id}/results"), stream=True, timeout=300) as r:
+            r.raise_for_status()
+            with open(results_path, "wb") as f:
+                for chunk in r.iter_content(chunk_size=HLR_DOWNLOAD_CHUNK_BYTES):
+                    f.write(chunk)
+        return results_path
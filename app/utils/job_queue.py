@@ -0,0 +1,164 @@
+import os
+import socket
+import inspect
+import importlib
+import threading
+import traceback
+import multiprocessing
+from time import sleep
+from dotenv import load_dotenv
+from app.utils.db_handler import DBHandler
+
+load_dotenv()
+
+# Worker processes started by worker.py; each runs one job at a time
+JOB_WORKER_PROCESSES = int(os.getenv("JOB_WORKER_PROCESSES", str(os.cpu_count() or 1)))
+# "job_type=limit,..." - max running jobs per type across all workers (unlisted types: 1)
+JOB_CONCURRENCY = os.getenv(
+    "JOB_CONCURRENCY",
+    "process_file=4,hlr=1,db_export=2,encrypt_file=2,smart_cleaning_voluum=4,reg_search=2",
+)
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+# A running job without a heartbeat for this long is requeued (or failed after max_attempts)
+JOB_HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("JOB_HEARTBEAT_TIMEOUT_SECONDS", "120"))
+
+
+def parse_concurrency(spec: str) -> dict:
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            job_type, limit = item.split("=", 1)
+            limits[job_type.strip()] = int(limit)
+    return limits
+
+
+def worker_id_for(pid: int) -> str:
+    return f"{socket.gethostname()}:{pid}"
+
+
+def load_job_handlers(handlers_module: str) -> dict:
+    """`handlers_module`.JOB_HANDLERS: job_type -> (job function, on_failure(file_id, error_message))."""
+    return importlib.import_module(handlers_module).JOB_HANDLERS
+
+
+class Job:
+    """
+    Passed to job functions that take a `job` argument.
+    - `progress` is the last checkpoint saved by a previous attempt ({} on the first),
+      so a job requeued after a crash can resume instead of starting over.
+    - checkpoint() saves new progress (and counts as a heartbeat). Given a cursor it
+      saves it inside the caller's transaction and raises if the job was recovered
+      elsewhere, so that work is rolled back rather than committed twice.
+    """
+
+    def __init__(self, db, job_id, worker_id, attempts, progress):
+        self._db = db
+        self.id = job_id
+        self.worker_id = worker_id
+        self.attempts = attempts
+        self.progress = progress or {}
+
+    def checkpoint(self, progress: dict, cursor=None):
+        if not self._db.heartbeat_job(self.id, self.worker_id, progress, cursor) and cursor is not None:
+            raise RuntimeError(f"Job {self.id} is no longer owned by {self.worker_id}")
+        self.progress = progress
+
+
+def _heartbeat_loop(db, job, stop):
+    while not stop.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            if not db.heartbeat_job(job.id, job.worker_id):
+                print(f"Job {job.id} is no longer owned by {job.worker_id}; it was recovered elsewhere")
+                return
+        except Exception as e:
+            print(f"Heartbeat for job {job.id} failed: {e}")
+
+
+def _run_job(db, handlers, claimed, worker_id):
+    run, on_failure = handlers[claimed["job_type"]]
+    payload = claimed["payload"]
+    job = Job(db, claimed["id"], worker_id, claimed["attempts"], claimed["progress"])
+    kwargs = dict(payload)
+    if "job" in inspect.signature(run).parameters:
+        kwargs["job"] = job
+
+    print(f"[{worker_id}] running {claimed['job_type']} job {job.id} (attempt {job.attempts}): {payload}")
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat_loop, args=(db, job, stop), daemon=True)
+    heartbeat.start()
+    try:
+        run(**kwargs)
+    except Exception as e:
+        traceback.print_exc()
+        status = db.finish_job(job.id, worker_id, str(e) or type(e).__name__)
+        if status == "queued":
+            print(f"[{worker_id}] job {job.id} requeued after attempt {job.attempts}")
+        elif status == "failed" and on_failure and payload.get("file_id"):
+            on_failure(payload["file_id"], str(e))
+    else:
+        db.finish_job(job.id, worker_id)
+    finally:
+        stop.set()
+        heartbeat.join()
+
+
+def worker_loop(handlers_module: str):
+    """One worker process: claim a job, run it, repeat."""
+    handlers = load_job_handlers(handlers_module)
+    configured = parse_concurrency(JOB_CONCURRENCY)
+    limits = {job_type: configured.get(job_type, 1) for job_type in handlers}
+    worker_id = worker_id_for(os.getpid())
+    db = DBHandler()
+    print(f"Job worker {worker_id} started with limits {limits}")
+
+    while True:
+        try:
+            claimed = db.claim_job(worker_id, limits)
+        except Exception as e:
+            print(f"[{worker_id}] claiming a job failed: {e}")
+            claimed = None
+        if claimed is None:
+            sleep(JOB_POLL_SECONDS)
+            continue
+        try:
+            _run_job(db, handlers, claimed, worker_id)
+        except Exception as e:
+            # DB errors while finishing; the job is recovered by heartbeat timeout
+            print(f"[{worker_id}] job {claimed['id']} bookkeeping failed: {e}")
+
+
+def run_workers(handlers_module: str, processes: int = JOB_WORKER_PROCESSES):
+    """
+    Supervisor: starts `processes` worker processes, restarts any that die, and
+    recovers their jobs (and jobs with a stale heartbeat from any host).
+    """
+    # spawn, not fork: workers build their own connection pools and handlers
+    ctx = multiprocessing.get_context("spawn")
+    handlers = load_job_handlers(handlers_module)
+    db = DBHandler()
+    workers = {}
+
+    def start(index):
+        process = ctx.Process(target=worker_loop, args=(handlers_module,), name=f"job-worker-{index}")
+        process.start()
+        workers[index] = process
+
+    for index in range(processes):
+        start(index)
+
+    while True:
+        dead_worker_ids = []
+        for index, process in list(workers.items()):
+            if not process.is_alive():
+                print(f"Job worker {index} (pid {process.pid}) exited with code {process.exitcode}; restarting")
+                dead_worker_ids.append(worker_id_for(process.pid))
+                start(index)
+        try:
+            for job in db.recover_stale_jobs(JOB_HEARTBEAT_TIMEOUT_SECONDS, dead_worker_ids):
+                _, on_failure = handlers.get(job["job_type"], (None, None))
+                if on_failure and job["payload"].get("file_id"):
+                    on_failure(job["payload"]["file_id"], "Worker lost while running the job")
+        except Exception as e:
+            print(f"Job recovery failed: {e}")
+        sleep(JOB_POLL_SECONDS)
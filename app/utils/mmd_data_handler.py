@@ -7,39 +7,92 @@ import psycopg2
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from app.utils.voluum_access_key_handler import VoluumAccessKeyHandler
+from app.utils.voluum_access_key_handler import access_key_handler
+from app.utils.voluum_data_handler import (
+    VOLUUM_BACKOFF_SECONDS,
+    VOLUUM_MAX_CONCURRENCY,
+    VOLUUM_REQUEST_TIMEOUT_SECONDS,
+    TokenBucket,
+    voluum_session,
+    voluum_request_slots,
+    voluum_report_limiter,
+)
 import time 
-import threading
 
 load_dotenv()
-access_key_handler = VoluumAccessKeyHandler()
-access_key_handler.get_access_token()
 
-MAX_CONCURRENT_REQUESTS = 10   # <-- tune this (start low)
-RATE_LIMIT_SLEEP = 0.25       # seconds between calls
+VOLUUM_WINDOW_FORMAT = "%Y-%m-%dT%H:00:00.000Z"
+# Campaign report totals for windows that are still open are reused from
+# voluum_campaign_window_totals for this long; closed windows never expire
+VOLUUM_TOTALS_OPEN_TTL_SECONDS = float(os.getenv("VOLUUM_TOTALS_OPEN_TTL_SECONDS", "300"))
+# Broadcast DLR and click counts still change for this long after send_date: a settle
+# refresh re-fetches that window, older days are served from mmd_broadcasts as stored
+MMD_BROADCAST_SETTLE_HOURS = float(os.getenv("MMD_BROADCAST_SETTLE_HOURS", "48"))
+# Queries inside today run a settle refresh at most this often; in between they only
+# fetch broadcasts sent since the last sync. Earlier days always get one until settled.
+MMD_BROADCAST_REFRESH_SECONDS = float(os.getenv("MMD_BROADCAST_REFRESH_SECONDS", "600"))
+# Tail syncs reach this far before the last sync, for broadcasts listed with a send_date
+# slightly before they showed up
+MMD_BROADCAST_SYNC_OVERLAP_SECONDS = float(os.getenv("MMD_BROADCAST_SYNC_OVERLAP_SECONDS", "300"))
+# Cost updates: campaigns per POST /report/cost, POSTs per second, and attempts for a
+# batch that hit 429 / 5xx / a network error
+VOLUUM_COST_UPDATE_BATCH_SIZE = int(os.getenv("VOLUUM_COST_UPDATE_BATCH_SIZE", "50"))
+VOLUUM_COST_UPDATE_RATE_PER_SECOND = float(os.getenv("VOLUUM_COST_UPDATE_RATE_PER_SECOND", "1"))
+VOLUUM_COST_UPDATE_MAX_ATTEMPTS = int(os.getenv("VOLUUM_COST_UPDATE_MAX_ATTEMPTS", "3"))
+
+voluum_cost_limiter = TokenBucket(VOLUUM_COST_UPDATE_RATE_PER_SECOND, 1)
+
+BROADCAST_DLR_COUNTS = [
+    "sent_count", "delivered_count", "undelivered_count", "rejected_count",
+    "expired_count", "failed_count", "read_count",
+]
+# Output column -> prepared broadcast column (see prepare_broadcasts / add_campaign_totals)
+BROADCAST_STATS_COLUMNS = {
+    "Campaign ID": "campaign_id",
+    "Broadcast ID": "id",
+    "Name": "name",
+    "Send Date": "send_date_seconds",
+    "Estimated Price": "estimated_price_units",
+    "Recipient Count": "recipient_count",
+    "BC Unique Clicks": "broadcastConversion.uniqueClicks",
+    "BC Total Clicks": "broadcastConversion.totalClicks",
+    "CTR": "ctr",
+    "DLR Delivered Count": "dlr.delivered_count",
+    "DLR Sent Count": "dlr.sent_count",
+    "DLR Undelivered Count": "dlr.undelivered_count",
+    "DLR Rejected Count": "dlr.rejected_count",
+    "Voluum Visits": "voluum_visits",
+    "Voluum Unique Visits": "voluum_unique_visits",
+    "Click 2 REG": "click_2_reg",
+    "Reg 2 FTD": "reg_2_ftd",
+    "message_body": "message_body",
+}
+
+
+
+def parse_send_date(send_date: str) -> datetime:
+    """MessageWhiz send_date (ISO 8601, UTC) as an aware datetime."""
+    parsed = datetime.fromisoformat(send_date.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
 
-semaphore = threading.Semaphore(MAX_CONCURRENT_REQUESTS)
 
 class MMDDataHandler:
-    def __init__(self):
+    def __init__(self, db=None):
         self.access_token = None
         self.links_dict = {}
-
-    def get_broadcasts(self, date):
-        # date = "2026-01-20"
+        # DBHandler for the broadcast store and the campaign totals / link caches; None fetches everything from the APIs
+        self.db = db
+
+    def fetch_broadcasts(self, stop_before):
+        """
+        Page through /Broadcast/List (newest first) until the first broadcast sent
+        before `stop_before` (aware datetime) and return the ones sent at or after it.
+        Raises on a failed page.
+        """
         url = "https://sms.messagewhiz.com/api/3/Broadcast/List"
 
         start = 0  # Initialize starting point for pagination
-        total_fetched = 0 
         list_of_broadcasts = []
-        dt = datetime.strptime(date, "%Y-%m-%d")
-
-        # subtract one day
-        prev_day = dt - timedelta(days=1)
-
-        # format back to same string format
-        previous_date = prev_day.strftime("%Y-%m-%d")
-        global_check = True
         while True:
             params = {
                 'limit': 100,
@@ -54,92 +107,105 @@ class MMDDataHandler:
             # Send the request
             response = requests.get(url, headers=headers, params=params)
             if response.status_code != 200:
-                print(f"Failed to retrieve data: {response.status_code}")
-                break   
-            # year, month, day = date.split("-")
-            broadcast_json = response.json()
-            broadcast_res = broadcast_json["result"]
-            count = len(broadcast_res)  # Count the number of items fetched in this iteration
-            # Process each item
-            for item in broadcast_res:
-                if date in item["send_date"]:
-                    list_of_broadcasts.append(item)
-                else:
-                    if previous_date in item["send_date"]:
-                        global_check = False           
-                        break
-            total_fetched += count
-
-            if not global_check:
-                break
-
-            if count < 100:  # If less than 100 items, stop fetching
-                break
-
-            start += count
-        
-        return list_of_broadcasts
-    
-    def get_broadcasts_until_day(self, date):
-        url = "https://sms.messagewhiz.com/api/3/Broadcast/List"
-
-        start = 0  # Initialize starting point for pagination
-        total_fetched = 0 
-        list_of_broadcasts = []
-        dt = datetime.strptime(date, "%Y-%m-%d")
+                raise Exception(f"Failed to retrieve broadcasts: {response.status_code}")
 
-        # subtract one day
-        prev_day = dt - timedelta(days=1)
-
-        # format back to same string format
-        previous_date = prev_day.strftime("%Y-%m-%d")
-        global_check = True
-        while True:
-            params = {
-                'limit': 100,
-                'start': start,
-            }
-
-            headers = {
-                "apikey": "fc416a66-fdcc-480b-a693-f85007723364",
-                "Content-Type": "application/json"
-            }
-
-            # Send the request
-            response = requests.get(url, headers=headers, params=params)
-            if response.status_code != 200:
-                print(f"Failed to retrieve data: {response.status_code}")
-                break   
-            # year, month, day = date.split("-")
-            broadcast_json = response.json()
-            broadcast_res = broadcast_json["result"]
+            broadcast_res = response.json()["result"]
             count = len(broadcast_res)  # Count the number of items fetched in this iteration
-            # Process each item
+            reached_stop = False
             for item in broadcast_res:
-                list_of_broadcasts.append(item)
-                if previous_date in item["send_date"]:
-                    global_check = False           
+                if parse_send_date(item["send_date"]) < stop_before:
+                    reached_stop = True
                     break
-            total_fetched += count
+                list_of_broadcasts.append(item)
 
-            if not global_check:
-                break
-
-            if count < 100:  # If less than 100 items, stop fetching
+            if reached_stop or count < 100:  # If less than 100 items, stop fetching
                 break
 
             start += count
-        
+
         return list_of_broadcasts
 
-    def get_links(self):
+    def sync_broadcasts(self, send_from, refresh=True):
+        """
+        Bring mmd_broadcasts up to date for everything sent since `send_from`.
+        While the store does not reach back to send_from, everything since send_from
+        is fetched. Otherwise only the tail is: back to the last sync (less
+        MMD_BROADCAST_SYNC_OVERLAP_SECONDS), or with `refresh`
+        back to the last settle refresh minus MMD_BROADCAST_SETTLE_HOURS, so every
+        broadcast whose counts may still have changed is fetched again.
+        """
+        sync_started_at = datetime.now(timezone.utc)
+        state = self.db.get_mmd_broadcast_sync()
+        settle_window = timedelta(hours=MMD_BROADCAST_SETTLE_HOURS)
+        if state and state[0] <= send_from:
+            if refresh:
+                stop_before = state[2] - settle_window
+            else:
+                stop_before = state[1] - timedelta(seconds=MMD_BROADCAST_SYNC_OVERLAP_SECONDS)
+        else:
+            stop_before = send_from
+        broadcasts = self.fetch_broadcasts(stop_before)
+        self.db.upsert_mmd_broadcasts([(item["id"], parse_send_date(item["send_date"]), item) for item in broadcasts])
+        refreshed = state is None or stop_before <= state[2] - settle_window
+        self.db.set_mmd_broadcast_sync(stop_before, sync_started_at, sync_started_at if refreshed else None)
+        print(f"Synced {len(broadcasts)} MMD broadcasts sent since {stop_before:%Y-%m-%d %H:%M}")
+
+    def get_stored_broadcasts(self, send_from, send_to=None):
+        """
+        Broadcasts sent in [send_from, send_to) from the local store, syncing first unless
+        already settled. Queries inside today only fetch the tail, with a settle refresh
+        at most every MMD_BROADCAST_REFRESH_SECONDS; earlier days get one until settled.
+        A failed sync falls back to the stored broadcasts only for queries inside today
+        (the live view); for earlier days it is raised, so cost updates and day exports
+        never run on a partial day.
+        """
+        state = self.db.get_mmd_broadcast_sync()
+        settle_window = timedelta(hours=MMD_BROADCAST_SETTLE_HOURS)
+        settled = (
+            state is not None and send_to is not None
+            and state[0] <= send_from
+            and send_to <= state[2] - settle_window
+        )
+        if not settled:
+            now = datetime.now(timezone.utc)
+            today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            refresh = (
+                state is None or send_from < today_start
+                or (now - state[2]).total_seconds() >= MMD_BROADCAST_REFRESH_SECONDS
+            )
+            try:
+                self.sync_broadcasts(send_from, refresh)
+            except Exception as e:
+                if send_from < today_start:
+                    raise
+                print(f"MMD broadcast sync failed, serving stored broadcasts: {e}")
+        return self.db.get_mmd_broadcasts(send_from, send_to)
+
+    def get_broadcasts(self, date):
+        # date = "2026-01-20"
+        day_start = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        day_end = day_start + timedelta(days=1)
+        if self.db:
+            return self.get_stored_broadcasts(day_start, day_end)
+        return [item for item in self.fetch_broadcasts(day_start) if parse_send_date(item["send_date"]) < day_end]
+
+    def get_broadcasts_until_day(self, date):
+        """Everything sent since the start of `date`, newest first."""
+        day_start = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        if self.db:
+            return self.get_stored_broadcasts(day_start)
+        return self.fetch_broadcasts(day_start)
+
+    def fetch_links(self, after_id=None):
+        """
+        Page through /api/3/Link (newest first) and return {id: url}. With after_id,
+        only newer links are returned and paging stops at the first page that reaches it.
+        Raises on a failed page so a partial catalogue is never cached.
+        """
         url = "https://sms.messagewhiz.com/api/3/Link"
 
         start = 0  # Initialize starting point for pagination
-        total_fetched = 0 
-        list_of_links = []
-        
-        global_check = True
+        links = {}
         while True:
             params = {
                 'limit': 100,
@@ -154,28 +220,56 @@ class MMDDataHandler:
             # Send the request
             response = requests.get(url, headers=headers, params=params)
             if response.status_code != 200:
-                print(f"Failed to retrieve data: {response.status_code}")
-                break   
+                raise Exception(f"Failed to retrieve links: {response.status_code}")
 
-            link_json = response.json()
-            link_res = link_json["result"]
+            link_res = response.json()["result"]
             count = len(link_res)  # Count the number of items fetched in this iteration
-            # Process each item
             for item in link_res:
-                list_of_links.append(item)
-
-            total_fetched += count
+                if after_id is None or item["id"] > after_id:
+                    links[item["id"]] = item["url"].split("?")[0]
 
-            if not global_check:
+            if after_id is not None and any(item["id"] <= after_id for item in link_res):
                 break
 
             if count < 100:  # If less than 100 items, stop fetching
                 break
 
             start += count
-        
-        for link in list_of_links:
-            self.links_dict[link["id"]] = link["url"].split("?")[0]
+
+        return links
+
+    def sync_links(self):
+        """Fetch links newer than the highest cached id into mmd_links and links_dict."""
+        after_id = self.db.get_max_mmd_link_id() if self.db else (max(self.links_dict) if self.links_dict else None)
+        links = self.fetch_links(after_id)
+        if self.db:
+            self.db.upsert_mmd_links(links)
+        self.links_dict.update(links)
+        print(f"Synced {len(links)} MMD links newer than {after_id}")
+
+    def get_links(self):
+        """Load every known link into links_dict (after syncing new ones)."""
+        self.sync_links()
+        if self.db:
+            self.links_dict.update(self.db.get_mmd_links())
+
+    def resolve_links(self, link_ids):
+        """
+        Make sure links_dict covers `link_ids`: memory first, then mmd_links, and only
+        if some are still unknown, one incremental sync. Unresolvable ids are left out.
+        """
+        missing = {link_id for link_id in link_ids if link_id not in self.links_dict}
+        if missing and self.db:
+            self.links_dict.update(self.db.get_mmd_links(list(missing)))
+            missing -= self.links_dict.keys()
+        if missing:
+            try:
+                self.sync_links()
+            except Exception as e:
+                print(f"MMD link sync failed: {e}")
+            missing -= self.links_dict.keys()
+        if missing:
+            print(f"Unknown MMD link ids: {sorted(missing)}")
 
     def extract_link_id(self, message):
         return message.split("{{link:")[1].split("}}")[0]
@@ -189,9 +283,32 @@ class MMDDataHandler:
     def format_real_price(self, price):
         return price / 100
 
+    def prepare_broadcasts(self, broadcasts):
+        """
+        Broadcast list -> DataFrame shared by every MMD path. The nested dlr and
+        broadcastConversion dicts become "dlr.<field>" / "broadcastConversion.<field>"
+        columns (DLR counts are 0 when missing); link_id, url and campaign_id are
+        parsed from the message (NaN without a link or for an unknown link) and
+        real_price is converted from cents. Only the referenced links are resolved.
+        """
+        broadcast_df = pd.json_normalize(broadcasts, max_level=1)
+        if broadcast_df.empty:
+            return broadcast_df
+        dlr_columns = [f"dlr.{count}" for count in BROADCAST_DLR_COUNTS]
+        broadcast_df = broadcast_df.drop(columns=["dlr"], errors="ignore")
+        broadcast_df[dlr_columns] = broadcast_df.reindex(columns=dlr_columns).fillna(0).astype("int64")
+        broadcast_df["link_id"] = broadcast_df["message_body"].str.extract(r"\{\{link:(\d+)\}\}", expand=False)
+        link_ids = pd.to_numeric(broadcast_df["link_id"])
+        self.resolve_links(link_ids.dropna().astype("int64").unique().tolist())
+        broadcast_df["url"] = link_ids.map(self.links_dict).astype(object)
+        broadcast_df["campaign_id"] = broadcast_df["url"].str.split("m/").str[1]
+        broadcast_df["real_price"] = broadcast_df["real_price"] / 100
+        return broadcast_df
+
     def rate_limited_get_campaign(self, *args, **kwargs):
-        with semaphore:
-            time.sleep(RATE_LIMIT_SLEEP)  # smooths bursts
+        # Shares the process-wide Voluum concurrency cap and report token bucket
+        with voluum_request_slots:
+            voluum_report_limiter.acquire()
             return self.get_campaign_data(*args, **kwargs)
     
     def get_campaign_data(self, campaign_id, from_date, to_date):
@@ -201,12 +318,12 @@ class MMDDataHandler:
             "cwauth-token": access_token
         }
         try:
-            response = requests.get(url, headers=headers)
+            response = voluum_session.get(url, headers=headers, timeout=VOLUUM_REQUEST_TIMEOUT_SECONDS)
             campaigns = response.json()
         except Exception as e:
             print(f"Error fetching campaign data for campaign ID {campaign_id}: {e}")
             time.sleep(10)
-            response = requests.get(url, headers=headers)
+            response = voluum_session.get(url, headers=headers, timeout=VOLUUM_REQUEST_TIMEOUT_SECONDS)
             campaigns = response.json()
         return campaigns
 
@@ -218,7 +335,7 @@ class MMDDataHandler:
         # STEP 1: FILTER & LIMIT FIRST
         # ----------------------------
         for _, row in broadcast_df.iterrows():
-            if row["state"] in [0, 2]:
+            if row["state"] in [0, 2] or pd.isna(row["campaign_id"]):
                 continue
 
             if search_filter.lower() not in row["name"].lower():
@@ -256,13 +373,8 @@ class MMDDataHandler:
                 f"T{str(later_hour).zfill(2)}:00:00.000Z"
             )
 
-            totals = self.rate_limited_get_campaign(
-                row["campaign_id"],
-                from_date=from_date,
-                to_date=to_date,
-            )
             try:
-                totals = totals["totals"]
+                totals = self.get_window_totals(row["campaign_id"], from_date, to_date)
                 return broadcast_name, {
                     "Broadcast ID": row["id"],
                     "Name": row["name"],
@@ -272,18 +384,18 @@ class MMDDataHandler:
                     "Estimated Price": round(row["estimated_price"] / 100, 2),
                     "Recipient Count": row["recipient_count"],
 
-                    "DLR Sent Count": row["dlr"]["sent_count"] if row.get("dlr") else 0,
-                    "DLR Delivered Count": row["dlr"]["delivered_count"] if row.get("dlr") else 0,
-                    "DLR Undelivered Count": row["dlr"]["undelivered_count"] if row.get("dlr") else 0,
-                    "DLR Rejected Count": row["dlr"]["rejected_count"] if row.get("dlr") else 0,
-                    "DLR Expired Count": row["dlr"]["expired_count"] if row.get("dlr") else 0,
-                    "DLR Failed Count": row["dlr"]["failed_count"] if row.get("dlr") else 0,
-                    "DLR Read Count": row["dlr"]["read_count"] if row.get("dlr") else 0,
+                    "DLR Sent Count": row["dlr.sent_count"],
+                    "DLR Delivered Count": row["dlr.delivered_count"],
+                    "DLR Undelivered Count": row["dlr.undelivered_count"],
+                    "DLR Rejected Count": row["dlr.rejected_count"],
+                    "DLR Expired Count": row["dlr.expired_count"],
+                    "DLR Failed Count": row["dlr.failed_count"],
+                    "DLR Read Count": row["dlr.read_count"],
 
-                    "BC Unique Clicks": row["broadcastConversion"]["uniqueClicks"],
-                    "BC Total Clicks": row["broadcastConversion"]["totalClicks"],
-                    "BC Recipient Count": row["broadcastConversion"]["recipientCount"],
-                    "CTR": f'{round(float(row["broadcastConversion"]["conversion"]), 2)}%',
+                    "BC Unique Clicks": row["broadcastConversion.uniqueClicks"],
+                    "BC Total Clicks": row["broadcastConversion.totalClicks"],
+                    "BC Recipient Count": row["broadcastConversion.recipientCount"],
+                    "CTR": f'{round(float(row["broadcastConversion.conversion"]), 2)}%',
 
                     "unique_visits": totals["uniqueVisits"],
                     "visits": totals["visits"],
@@ -323,83 +435,22 @@ class MMDDataHandler:
         broadcasts = self.get_broadcasts(date)
         print(f"Number of broadcasts fetched for date: {date} are {len(broadcasts)}")
 
-        # Get links
-        self.get_links()
-
-        # Process broadcasts into DataFrame
-        broadcast_df = pd.DataFrame(broadcasts)
-        broadcast_df["link_id"] = broadcast_df["message_body"].apply(lambda x: x.split("{{link:")[1].split("}}")[0])
-        broadcast_df["url"] = broadcast_df["link_id"].apply(lambda x: self.links_dict.get(int(x), None))
-        broadcast_df["campaign_id"] = broadcast_df["url"].apply(lambda x: x.split("m/")[1] if x else None)
-        broadcast_df["real_price"] = broadcast_df["real_price"].apply(lambda price: price / 100)
+        broadcast_df = self.prepare_broadcasts(broadcasts)
+        if broadcast_df.empty:
+            return {}
 
         grouped_rows = self.add_broadcast_campaign_data(broadcast_df, search_filter)
         return grouped_rows
     
-    def process_single_row(self, row, grouped_rows):
-        date, time = row["send_date"].split("T")
-        hour = int(time.split(":")[0])
-
-        from_dt = datetime.strptime(
-            f"{date} {hour:02d}:00:00",
-            "%Y-%m-%d %H:%M:%S"
-        ).replace(tzinfo=timezone.utc)
-
-        # Current time rounded down to hour
-        now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    def broadcast_stats(self, df):
+        """Project prepared broadcasts with campaign totals onto the BROADCAST_STATS_COLUMNS output."""
+        df = df.assign(
+            send_date_seconds=df["send_date"].str.split(".").str[0],
+            estimated_price_units=(df["estimated_price"] / 100).round(2),
+            ctr=df["broadcastConversion.conversion"].astype(float).round(2).astype(str) + "%",
+        )
+        return df[list(BROADCAST_STATS_COLUMNS.values())].set_axis(list(BROADCAST_STATS_COLUMNS), axis=1)
 
-        # Decide to_date
-        if now - from_dt > timedelta(hours=24):
-            to_dt = from_dt + timedelta(hours=24)
-        else:
-            to_dt = now
-
-        # Format back to string
-        from_date = from_dt.strftime("%Y-%m-%dT%H:00:00.000Z")
-        to_date = to_dt.strftime("%Y-%m-%dT%H:00:00.000Z")
-        if (from_date, to_date, row["campaign_id"]) not in grouped_rows:
-            grouped_rows[from_date, to_date, row["campaign_id"]] = self.rate_limited_get_campaign(
-                                                                    row["campaign_id"],
-                                                                    from_date=from_date,
-                                                                    to_date=to_date
-                                                                )["totals"]
-        totals = grouped_rows[from_date, to_date, row["campaign_id"]]
-
-        return grouped_rows, {
-            "Campaign ID": row["campaign_id"],
-            "Broadcast ID": row["id"],
-            "Name": row["name"],
-            "Send Date": row["send_date"].split(".")[0],
-
-            # "Real Price": round(row["real_price"], 2),
-            "Estimated Price": round(row["estimated_price"] / 100, 2),
-            "Recipient Count": row["recipient_count"],
-
-            "BC Unique Clicks": row["broadcastConversion"]["uniqueClicks"],
-            "BC Total Clicks": row["broadcastConversion"]["totalClicks"],
-            # "BC Recipient Count": row["broadcastConversion"]["recipientCount"],
-            "CTR": f'{round(float(row["broadcastConversion"]["conversion"]), 2)}%',
-
-            "DLR Delivered Count": row["dlr"]["delivered_count"] if row.get("dlr") else 0,
-            "DLR Sent Count": row["dlr"]["sent_count"] if row.get("dlr") else 0,
-            "DLR Undelivered Count": row["dlr"]["undelivered_count"] if row.get("dlr") else 0,
-            "DLR Rejected Count": row["dlr"]["rejected_count"] if row.get("dlr") else 0,
-            # "DLR Expired Count": row["dlr"]["expired_count"] if row.get("dlr") else 0,
-            # "DLR Failed Count": row["dlr"]["failed_count"] if row.get("dlr") else 0,
-            # "DLR Read Count": row["dlr"]["read_count"] if row.get("dlr") else 0,
-
-
-            "Voluum Visits": totals["visits"],
-            "Voluum Unique Visits": totals["uniqueVisits"],
-            "Click 2 REG": f'{round(totals["Click2Reg"], 2)}%',
-            "Reg 2 FTD": f'{totals["Reg2FTD"]}%',
-            # "Clicks": totals["clicks"],
-            # "Conversions": totals["conversions"],
-            # "revenue": totals["revenue"],
-
-            "message_body": row["message_body"],
-        }
-    
     def update_prices(self):
         date = (datetime.utcnow() - timedelta(days=1)).strftime("%Y-%m-%d")
         # date = "2026-01-27"
@@ -407,70 +458,167 @@ class MMDDataHandler:
         next_date = datetime.utcnow().strftime("%Y-%m-%d")
         print(f'Updating costs for date {date} to date: {next_date}')
         broadcasts = self.get_broadcasts(date)
-        
-        self.get_links()
-
-        broadcast_df = pd.DataFrame(broadcasts)
-        broadcast_df["link_id"] = broadcast_df["message_body"].apply(lambda x: x.split("{{link:")[1].split("}}")[0])
-        broadcast_df["url"] = broadcast_df["link_id"].apply(lambda x: self.links_dict.get(int(x), None))
-        broadcast_df["campaign_id"] = broadcast_df["url"].apply(lambda x: x.split("m/")[1] if x else None)
-        broadcast_df["real_price"] = broadcast_df["real_price"].apply(lambda price: price / 100)
-        cost_update_url = "https://api.voluum.com/report/cost"
-        headers = {
-            "cwauth-token": access_key_handler.get_access_token()
-        }
 
-        campaign_ids = broadcast_df["campaign_id"].unique().tolist()
-        i=0
-        cost_updates = []
-        for id in campaign_ids:
-            rows = broadcast_df[broadcast_df.campaign_id==id]
-            total_cost = rows['real_price'].sum()
-            body = {
-                "costUpdateRequests":[
-                    {
-                        "campaignId": rows.iloc[0]['campaign_id'],
-                        "from":f"{date}T00:00:00Z",
-                        "to":f"{next_date}T00:00:00Z",
-                        "timezone":"Etc/GMT",
-                        "cost":total_cost,
-                        "currency":"USD"
-                    }
-                ]
+        broadcast_df = self.prepare_broadcasts(broadcasts)
+        if broadcast_df.empty:
+            return {"total_rows": 0, "updates": []}
+        # Broadcasts without a resolvable campaign have no cost to report
+        broadcast_df = broadcast_df[broadcast_df["campaign_id"].notna()]
+        # One aggregation pass instead of filtering the frame once per campaign
+        costs = broadcast_df.groupby("campaign_id", sort=False).agg(
+            rows=("id", "size"),
+            total_cost=("real_price", "sum"),
+            chunk=("name", "first"),
+        ).reset_index()
+        cost_update_requests = [
+            {
+                "campaignId": campaign_id,
+                "from": f"{date}T00:00:00Z",
+                "to": f"{next_date}T00:00:00Z",
+                "timezone": "Etc/GMT",
+                "cost": float(total_cost),
+                "currency": "USD"
+            }
+            for campaign_id, total_cost in zip(costs["campaign_id"], costs["total_cost"])
+        ]
+        statuses = self.submit_cost_updates(cost_update_requests)
+
+        cost_updates = [
+            {
+                "index": str(i),
+                "rows": int(row.rows),
+                "campaign_id": row.campaign_id,
+                "total_cost": round(float(row.total_cost), 3),
+                "chunk": row.chunk,
+                "response": statuses.get(row.campaign_id),
             }
-            response = requests.post(cost_update_url, headers=headers, json=body)
-            cost_updates.append({
-                    "index": str(i), 
-                    "rows": len(rows), 
-                    "campaign_id": rows.iloc[0]['campaign_id'], 
-                    "total_cost": round(total_cost, 3), 
-                    "chunk": rows.iloc[0]["name"], 
-                    "response": response.status_code
-                })
-            i+=1
-            time.sleep(5)
+            for i, row in enumerate(costs.itertuples(index=False))
+        ]
         return {
-            "total_rows": len(campaign_ids),
+            "total_rows": len(costs),
             "updates": cost_updates
         }
 
+    def submit_cost_updates(self, cost_update_requests):
+        """
+        POST costUpdateRequests to /report/cost, VOLUUM_COST_UPDATE_BATCH_SIZE per call,
+        under voluum_cost_limiter. Returns {campaignId: HTTP status} (0 for a network error).
+        Only failed entries are sent again: a batch rejected with a 4xx is split in
+        halves until the rejected entries are isolated, and a batch that hit 429, 5xx or
+        a network error is retried with backoff up to VOLUUM_COST_UPDATE_MAX_ATTEMPTS times.
+        """
+        cost_update_url = "https://api.voluum.com/report/cost"
+        batch_size = max(VOLUUM_COST_UPDATE_BATCH_SIZE, 1)
+        pending = [
+            (cost_update_requests[i:i + batch_size], 1)
+            for i in range(0, len(cost_update_requests), batch_size)
+        ]
+        statuses = {}
+        while pending:
+            batch, attempt = pending.pop(0)
+            voluum_cost_limiter.acquire()
+            try:
+                status = voluum_session.post(
+                    cost_update_url,
+                    headers={"cwauth-token": access_key_handler.get_access_token()},
+                    json={"costUpdateRequests": batch},
+                    timeout=VOLUUM_REQUEST_TIMEOUT_SECONDS,
+                ).status_code
+            except requests.RequestException as e:
+                print(f"Cost update of {len(batch)} campaigns failed: {e}")
+                status = 0
+
+            if 200 <= status < 300:
+                statuses.update({entry["campaignId"]: status for entry in batch})
+            elif 400 <= status < 500 and status not in (401, 403, 429) and len(batch) > 1:
+                middle = len(batch) // 2
+                pending[:0] = [(batch[:middle], attempt), (batch[middle:], attempt)]
+            elif (status == 0 or status == 429 or status >= 500) and attempt < VOLUUM_COST_UPDATE_MAX_ATTEMPTS:
+                time.sleep(VOLUUM_BACKOFF_SECONDS * 2 ** (attempt - 1))
+                pending.append((batch, attempt + 1))
+            else:
+                print(f"Cost update rejected ({status}) for {[entry['campaignId'] for entry in batch]}")
+                statuses.update({entry["campaignId"]: status for entry in batch})
+        return statuses
+
+    def campaign_windows(self, send_dates):
+        """
+        Campaign report window per send date: the send hour (UTC) to 24h later, or to
+        the current hour while that is still open. Returns (from_date, to_date) string Series.
+        """
+        from_dt = pd.to_datetime(send_dates.str.slice(0, 13), format="%Y-%m-%dT%H", utc=True)
+        now = pd.Timestamp.now(tz="UTC").floor("h")
+        to_dt = (from_dt + pd.Timedelta(hours=24)).where(now - from_dt > pd.Timedelta(hours=24), now)
+        return from_dt.dt.strftime(VOLUUM_WINDOW_FORMAT), to_dt.dt.strftime(VOLUUM_WINDOW_FORMAT)
+
+    def fetch_campaign_totals(self, windows):
+        """
+        Voluum report totals for each distinct (from_date, to_date, campaign_id) window,
+        served from voluum_campaign_window_totals where possible, the rest fetched
+        concurrently under the shared rate limit. Fails if any window fails.
+        """
+        totals = self.db.get_campaign_window_totals(windows, VOLUUM_TOTALS_OPEN_TTL_SECONDS) if self.db else {}
+        misses = [window for window in windows if window not in totals]
+        if len(windows) > 1:
+            print(f"Campaign totals: {len(windows) - len(misses)} of {len(windows)} windows cached")
+        fetched = {}
+        if len(misses) == 1:
+            from_date, to_date, campaign_id = misses[0]
+            fetched[misses[0]] = self.rate_limited_get_campaign(campaign_id, from_date=from_date, to_date=to_date)["totals"]
+        elif misses:
+            with ThreadPoolExecutor(max_workers=min(VOLUUM_MAX_CONCURRENCY, len(misses))) as executor:
+                futures = {
+                    executor.submit(self.rate_limited_get_campaign, campaign_id, from_date=from_date, to_date=to_date):
+                        (from_date, to_date, campaign_id)
+                    for from_date, to_date, campaign_id in misses
+                }
+                try:
+                    for future in tqdm(as_completed(futures), total=len(futures)):
+                        fetched[futures[future]] = future.result()["totals"]
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        if fetched and self.db:
+            self.db.upsert_campaign_window_totals(fetched, VOLUUM_TOTALS_OPEN_TTL_SECONDS)
+        totals.update(fetched)
+        return totals
+
+    def get_window_totals(self, campaign_id, from_date, to_date):
+        return self.fetch_campaign_totals([(from_date, to_date, campaign_id)])[from_date, to_date, campaign_id]
+
+    def add_campaign_totals(self, df):
+        """
+        Adds each broadcast's report window (from_date, to_date) and that window's
+        Voluum stats. One lookup per distinct (from_date, to_date, campaign_id);
+        broadcasts without a campaign get NaN stats (<NA> visits, kept as Int64 so
+        the left merge does not turn the counts into floats).
+        """
+        df = df.reset_index(drop=True)
+        df["from_date"], df["to_date"] = self.campaign_windows(df["send_date"])
+        window_keys = ["from_date", "to_date", "campaign_id"]
+        windows = df.loc[df["campaign_id"].notna(), window_keys].drop_duplicates()
+        keys = list(windows.itertuples(index=False, name=None))
+        totals = self.fetch_campaign_totals(keys)
+        window_totals = [totals[key] for key in keys]
+        windows = windows.assign(
+            voluum_visits=[t["visits"] for t in window_totals],
+            voluum_unique_visits=[t["uniqueVisits"] for t in window_totals],
+            click_2_reg=[f'{round(t["Click2Reg"], 2)}%' for t in window_totals],
+            reg_2_ftd=[f'{t["Reg2FTD"]}%' for t in window_totals],
+        )
+        return df.merge(windows, on=window_keys, how="left").astype(
+            {"voluum_visits": "Int64", "voluum_unique_visits": "Int64"}
+        )
+
     def save_data_for_day(self, previous_date):
         broadcasts = self.get_broadcasts(previous_date)
-        self.get_links()
-        broadcast_df = pd.DataFrame(broadcasts)
-        broadcast_df["link_id"] = broadcast_df["message_body"].apply(lambda x: x.split("{{link:")[1].split("}}")[0])
-        broadcast_df["url"] = broadcast_df["link_id"].apply(lambda x: self.links_dict.get(int(x), None))
-        broadcast_df["campaign_id"] = broadcast_df["url"].apply(lambda x: x.split("m/")[1] if x else None)
-        broadcast_df["real_price"] = broadcast_df["real_price"].apply(lambda price: price / 100)
-
-        total_rows = []
-        grouped_rows = {}
-        for _, row in tqdm(broadcast_df.iterrows(), total=len(broadcast_df)):
-            if row["state"] in [0, 2]:
-                continue
-            grouped_rows, processed_row = self.process_single_row(row, grouped_rows)
-            total_rows.append(processed_row)
-        total_rows_df = pd.DataFrame(total_rows)
+        broadcast_df = self.prepare_broadcasts(broadcasts)
+        if broadcast_df.empty:
+            return pd.DataFrame(), 0
+
+        broadcast_df = broadcast_df[~broadcast_df["state"].isin([0, 2])]
+        total_rows_df = self.broadcast_stats(self.add_campaign_totals(broadcast_df))
 
         return total_rows_df, len(total_rows_df)
 
@@ -1,8 +1,11 @@
 import json
 import time
+import queue
+import threading
 import boto3
 import os
 import logging
+from datetime import datetime, timedelta
 from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
 from app.utils.db_handler import DBHandler
@@ -13,6 +16,30 @@ load_dotenv()
 LOG_DIR = "logs"
 os.makedirs(LOG_DIR, exist_ok=True)
 
+# Parallel long-polling receive_message loops
+SQS_RECEIVER_THREADS = int(os.getenv("SQS_RECEIVER_THREADS", "4"))
+# Received-but-unwritten messages held in memory; receivers block when it is full
+SQS_BUFFER_MAX_MESSAGES = int(os.getenv("SQS_BUFFER_MAX_MESSAGES", "500"))
+# A batch is written once it reaches this many events or its first message is this old
+SQS_BATCH_MAX_EVENTS = int(os.getenv("SQS_BATCH_MAX_EVENTS", "2000"))
+SQS_BATCH_MAX_WAIT_SECONDS = float(os.getenv("SQS_BATCH_MAX_WAIT_SECONDS", "5"))
+SQS_VISIBILITY_TIMEOUT = int(os.getenv("SQS_VISIBILITY_TIMEOUT", "60"))
+# How often received-but-undeleted messages are checked; any not extended for half the
+# visibility timeout get extended
+SQS_VISIBILITY_HEARTBEAT_SECONDS = float(os.getenv("SQS_VISIBILITY_HEARTBEAT_SECONDS", "5"))
+# A message that still fails after this many deliveries is moved to sqs_dead_letters
+SQS_MAX_RECEIVE_COUNT = int(os.getenv("SQS_MAX_RECEIVE_COUNT", "5"))
+SQS_METRICS_INTERVAL_SECONDS = float(os.getenv("SQS_METRICS_INTERVAL_SECONDS", "60"))
+SQS_METRICS_FILE = os.path.join(LOG_DIR, "sqs_metrics.json")
+# Offer/campaign lookups: at most one Voluum refresh per interval; IDs Voluum still doesn't
+# know after a refresh are not asked for again until the negative TTL expires
+LOOKUP_REFRESH_MIN_INTERVAL_SECONDS = float(os.getenv("LOOKUP_REFRESH_MIN_INTERVAL_SECONDS", "60"))
+LOOKUP_NEGATIVE_TTL_SECONDS = float(os.getenv("LOOKUP_NEGATIVE_TTL_SECONDS", "21600"))
+# Report window used for the first incremental refresh after startup
+LOOKUP_INITIAL_WINDOW_DAYS = int(os.getenv("LOOKUP_INITIAL_WINDOW_DAYS", "7"))
+# How often the consumer creates upcoming / drops expired raw_live_voluum_sns_data partitions
+RAW_LIVE_PARTITION_MAINTENANCE_SECONDS = float(os.getenv("RAW_LIVE_PARTITION_MAINTENANCE_SECONDS", "3600"))
+
 
 def setup_logger(name: str, filename: str) -> logging.Logger:
     logger = logging.getLogger(name)
@@ -57,46 +84,12 @@ class SQSHandler:
         self.db = DBHandler()
         self.voluum = VoluumDataHandler()
 
-        # In-memory caches for name resolution
-        self.offer_map = {}
-        self.campaign_map = {}
-
-    def _load_lookup_caches(self):
-        """Load offer & campaign name caches from DB."""
-        self.offer_map = self.db.get_all_offer_names()
-        self.campaign_map = self.db.get_all_campaign_names()
-        logger.info(f"Loaded {len(self.offer_map)} offers and {len(self.campaign_map)} campaigns into cache.")
-
-    def _refresh_offers_and_campaigns(self):
-        """Fetch latest offers & campaigns from Voluum API and upsert into DB."""
-        logger.info("Refreshing offers and campaigns from Voluum API...")
-        offers = self.voluum.get_offers_data()
-        campaigns = self.voluum.get_campaigns_data()
-        self.db.upsert_offers(offers)
-        self.db.upsert_campaigns(campaigns)
-        self._load_lookup_caches()
+        # In-memory offer/campaign name caches, refreshed in the background
+        self.lookups = VoluumLookupCache(self.db, self.voluum)
 
-    def _resolve_missing_ids(self, events: list[dict]):
-        """
-        Check if any offer_id or campaign_id in the events batch is missing
-        from our cache. If so, refresh from Voluum API.
-        """
-        missing_offer = False
-        missing_campaign = False
-
-        for e in events:
-            offer_id = e.get("offerId")
-            campaign_id = e.get("campaignId")
-            if offer_id and offer_id not in self.offer_map:
-                missing_offer = True
-            if campaign_id and campaign_id not in self.campaign_map:
-                missing_campaign = True
-            if missing_offer and missing_campaign:
-                break
-
-        if missing_offer or missing_campaign:
-            logger.info(f"Missing IDs detected (offers={missing_offer}, campaigns={missing_campaign}). Refreshing from Voluum API...")
-            self._refresh_offers_and_campaigns()
+        # ReceiptHandle -> item for every received message not yet deleted or given up on
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
 
     def _delete_messages(self, receipt_handles: list[str]):
         """Delete processed messages from the queue in batches of 10."""
@@ -116,101 +109,423 @@ class SQSHandler:
 
         logger.info(f"Deleted {len(receipt_handles)} messages from queue.")
 
-    def _process_batch(self, messages: list[dict]):
+    def _parse_message(self, msg: dict):
+        """Events carried by one SNS-wrapped SQS message, or None if the body can't be parsed."""
+        try:
+            body = json.loads(msg["Body"])
+            raw_events = json.loads(body["Message"])
+        except Exception as e:
+            logger.error(f"Error parsing message {msg.get('MessageId')}: {e}")
+            return None
+        return raw_events if isinstance(raw_events, list) else [raw_events]
+
+    def _process_batch(self, items: list[dict]):
         """
-        Process a single batch of SQS messages:
-        1. Parse events from messages
+        Write one batch of received messages:
+        1. Insert raw events (idempotent on MessageId + event index)
         2. Resolve any missing offer/campaign IDs
-        3. Insert events into DB
-        4. Delete the messages from the queue immediately
+        3. Upsert into voluum_live_events
         """
         events = []
-        receipt_handles = []
+        message_keys = []
+        for item in items:
+            for event_index, event in enumerate(item["events"] or []):
+                events.append(event)
+                message_keys.append((item["message"]["MessageId"], event_index))
 
-        for msg in messages:
-            try:
-                body = json.loads(msg["Body"])
-                raw_events = json.loads(body["Message"])
+        if events:
+            # Insert raw data first (stores everything as-is, redeliveries skipped)
+            self.db.insert_raw_live_events(events, message_keys)
+
+            # Queue unknown offer/campaign IDs for the background refresh; their
+            # events are written without names now and backfilled once resolved
+            self.lookups.request(events)
 
-                if isinstance(raw_events, list):
-                    events.extend(raw_events)
-                else:
-                    events.append(raw_events)
+            # Upsert into processed live events table (dedup on custom_variable_1)
+            self.db.insert_live_events(events, self.lookups.offer_map, self.lookups.campaign_map)
 
-                receipt_handles.append(msg["ReceiptHandle"])
+        return len(events)
+
+    def _dead_letter(self, items: list[dict], error_message: str):
+        self.db.insert_sqs_dead_letters([
+            {
+                "message_id": item["message"]["MessageId"],
+                "body": item["message"]["Body"],
+                "error_message": error_message,
+                "receive_count": int(item["message"].get("Attributes", {}).get("ApproximateReceiveCount", 1)),
+            }
+            for item in items
+        ])
+        self.metrics.record_dead_letters(len(items))
+        logger.warning(f"Moved {len(items)} messages to sqs_dead_letters: {error_message}")
+
+    def _extend_visibility(self, items: list[dict]):
+        for i in range(0, len(items), 10):
+            entries = [
+                {"Id": str(idx), "ReceiptHandle": item["message"]["ReceiptHandle"], "VisibilityTimeout": SQS_VISIBILITY_TIMEOUT}
+                for idx, item in enumerate(items[i:i + 10])
+            ]
+            try:
+                resp = self.sqs.change_message_visibility_batch(QueueUrl=self.queue_url, Entries=entries)
+                failed = resp.get("Failed", [])
+                if failed:
+                    logger.warning(f"Failed to extend visibility of {len(failed)} messages: {failed}")
             except Exception as e:
-                logger.error(f"Error parsing message: {e}")
-                # Still delete bad messages so they don't block the queue
-                receipt_handles.append(msg["ReceiptHandle"])
+                logger.error(f"Error extending message visibility: {e}")
 
-        if events:
-            # Insert raw data first (no dedup, stores everything as-is)
-            self.db.insert_raw_live_events(events)
+    def _track(self, items: list[dict]):
+        """Register received messages for the visibility heartbeat until _untrack()."""
+        with self._in_flight_lock:
+            for item in items:
+                self._in_flight[item["message"]["ReceiptHandle"]] = item
 
-            # Check for unknown offer/campaign IDs and refresh if needed
-            self._resolve_missing_ids(events)
+    def _untrack(self, items: list[dict]):
+        with self._in_flight_lock:
+            for item in items:
+                self._in_flight.pop(item["message"]["ReceiptHandle"], None)
 
-            # Upsert into processed live events table (dedup on custom_variable_1)
-            self.db.insert_live_events(events, self.offer_map, self.campaign_map)
+    def _visibility_heartbeat(self):
+        """
+        Keep every received-but-undeleted message invisible, whether it is waiting in
+        the buffer, held by a receiver blocked on a full buffer, or being written:
+        every SQS_VISIBILITY_HEARTBEAT_SECONDS, messages last made invisible half a
+        visibility timeout ago (counted from receive_message) are extended.
+        """
+        half_timeout = SQS_VISIBILITY_TIMEOUT / 2
+        while not self._stop.wait(SQS_VISIBILITY_HEARTBEAT_SECONDS):
+            now = time.time()
+            with self._in_flight_lock:
+                due = [item for item in self._in_flight.values() if now - item["extended_at"] >= half_timeout]
+            if due:
+                self._extend_visibility(due)
+                for item in due:
+                    item["extended_at"] = now
+
+    def _write_batch(self, items: list[dict]):
+        """
+        At-least-once write + acknowledge:
+        - unparseable messages go straight to sqs_dead_letters,
+        - the rest are written; a failing batch is retried one message at a time, and a
+          message still failing on its SQS_MAX_RECEIVE_COUNT-th delivery is dead-lettered,
+        - only messages whose writes committed (or that were dead-lettered) are deleted;
+          anything else stops being extended, becomes visible again and is retried on redelivery.
+        """
+        unparseable = [item for item in items if item["events"] is None]
+        parsed = [item for item in items if item["events"] is not None]
+        acknowledged = []
 
-        # # Delete immediately after processing
-        # if receipt_handles:
-        #     self._delete_messages(receipt_handles)
+        try:
+            if unparseable:
+                self._dead_letter(unparseable, "Unparseable message body")
+                acknowledged.extend(unparseable)
 
-        return len(events)
+            event_count = 0
+            try:
+                event_count = self._process_batch(parsed)
+                acknowledged.extend(parsed)
+            except Exception as e:
+                logger.error(f"Batch of {len(parsed)} messages failed, retrying one by one: {e}")
+                for item in parsed:
+                    try:
+                        event_count += self._process_batch([item])
+                        acknowledged.append(item)
+                    except Exception as item_error:
+                        receive_count = int(item["message"].get("Attributes", {}).get("ApproximateReceiveCount", 1))
+                        if receive_count >= SQS_MAX_RECEIVE_COUNT:
+                            self._dead_letter([item], str(item_error))
+                            acknowledged.append(item)
+                        else:
+                            logger.error(f"Message {item['message']['MessageId']} failed (delivery {receive_count}/{SQS_MAX_RECEIVE_COUNT}): {item_error}")
+        finally:
+            self._untrack(items)
+
+        if acknowledged:
+            self._delete_messages([item["message"]["ReceiptHandle"] for item in acknowledged])
+        return event_count
+
+    def _receive_loop(self, buffer: queue.Queue):
+        """Long-poll the queue back to back and hand parsed messages to the batcher."""
+        while not self._stop.is_set():
+            try:
+                resp = self.sqs.receive_message(
+                    QueueUrl=self.queue_url,
+                    MaxNumberOfMessages=10,
+                    WaitTimeSeconds=20,
+                    VisibilityTimeout=SQS_VISIBILITY_TIMEOUT,
+                    AttributeNames=["SentTimestamp", "ApproximateReceiveCount"],
+                )
+            except Exception as e:
+                logger.error(f"Error receiving from SQS: {e}")
+                self._stop.wait(5)
+                continue
+
+            # Stamped at receipt: the visibility timeout runs from here, not from buffer.put
+            received_at = time.time()
+            messages = resp.get("Messages", [])
+            self.metrics.record_received(len(messages))
+            items = [
+                {"message": msg, "events": self._parse_message(msg), "received_at": received_at, "extended_at": received_at}
+                for msg in messages
+            ]
+            self._track(items)
+            for item in items:
+                buffer.put(item)
 
-    def run(self, sleep_seconds=300):
+    def _next_batch(self, buffer: queue.Queue):
         """
-        Continuous polling loop:
-        1. Load offer/campaign caches from DB
-        2. Poll queue — for each batch of messages: parse, insert into DB, delete immediately
-        3. When queue is empty (3 consecutive empty receives), sleep for 5 minutes
-        4. Repeat
+        Block until a message arrives, then keep collecting until the batch holds
+        SQS_BATCH_MAX_EVENTS events or SQS_BATCH_MAX_WAIT_SECONDS have passed.
+        Returns [] if nothing arrived within a second, so the caller can do housekeeping.
         """
-        logger.info("SQS Handler starting...")
-        self._load_lookup_caches()
+        try:
+            first = buffer.get(timeout=1)
+        except queue.Empty:
+            return []
+        items = [first]
+        event_count = len(first["events"] or [])
+        deadline = time.time() + SQS_BATCH_MAX_WAIT_SECONDS
+        while event_count < SQS_BATCH_MAX_EVENTS:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = buffer.get(timeout=remaining)
+            except queue.Empty:
+                break
+            items.append(item)
+            event_count += len(item["events"] or [])
+        return items
 
+    def run(self):
+        """
+        Pipelined consumer:
+        1. Load offer/campaign caches from DB and start their background refresher
+        2. SQS_RECEIVER_THREADS receivers long-poll continuously into a bounded buffer
+        3. This thread drains the buffer into size/time-bounded batches, writes them and
+           deletes the messages once the writes committed
+        4. Throughput and end-to-end lag are logged and written to SQS_METRICS_FILE
+        5. raw_live_voluum_sns_data partitions are maintained every RAW_LIVE_PARTITION_MAINTENANCE_SECONDS
+        """
+        logger.info(f"SQS Handler starting with {SQS_RECEIVER_THREADS} receivers...")
+        self.lookups.load()
+        self.lookups.start()
+
+        buffer = queue.Queue(maxsize=SQS_BUFFER_MAX_MESSAGES)
+        self._stop = threading.Event()
+        self.metrics = SQSMetrics()
+        threading.Thread(target=self._visibility_heartbeat, name="sqs-visibility", daemon=True).start()
+        receivers = [
+            threading.Thread(target=self._receive_loop, args=(buffer,), name=f"sqs-receiver-{i}", daemon=True)
+            for i in range(SQS_RECEIVER_THREADS)
+        ]
+        for receiver in receivers:
+            receiver.start()
+
+        last_metrics_at = time.time()
+        last_partition_maintenance_at = 0
         while True:
             try:
-                logger.info(f"{'='*60}")
-                logger.info("Polling SQS queue...")
-
-                total_events = 0
-                empty_receives = 0
-                max_empty = 3
-
-                while True:
-                    resp = self.sqs.receive_message(
-                        QueueUrl=self.queue_url,
-                        MaxNumberOfMessages=10,
-                        WaitTimeSeconds=20,
-                        VisibilityTimeout=60,
-                    )
-
-                    messages = resp.get("Messages", [])
-
-                    if not messages:
-                        empty_receives += 1
-                        logger.info(f"Empty receive #{empty_receives}/{max_empty}")
-                        if empty_receives >= max_empty:
-                            break
-                        continue
-
-                    empty_receives = 0
-                    batch_count = self._process_batch(messages)
-                    total_events += batch_count
-                    logger.info(f"Batch done: {batch_count} events. Total this cycle: {total_events}")
-
-                logger.info(f"Queue drained. Processed {total_events} events total this cycle.")
-                logger.info(f"Sleeping for {sleep_seconds} seconds...")
-                time.sleep(sleep_seconds)
+                if time.time() - last_partition_maintenance_at >= RAW_LIVE_PARTITION_MAINTENANCE_SECONDS:
+                    self.db.maintain_raw_live_partitions()
+                    last_partition_maintenance_at = time.time()
+
+                items = self._next_batch(buffer)
+                if items:
+                    event_count = self._write_batch(items)
+                    self.metrics.record_batch(items, event_count)
+                    logger.info(f"Batch done: {len(items)} messages, {event_count} events.")
+
+                if time.time() - last_metrics_at >= SQS_METRICS_INTERVAL_SECONDS:
+                    self.metrics.export(buffer.qsize())
+                    last_metrics_at = time.time()
 
             except KeyboardInterrupt:
                 logger.info("SQS Handler stopped by user.")
+                self._stop.set()
                 break
             except Exception as e:
-                logger.error(f"Error in polling loop: {e}", exc_info=True)
-                logger.info(f"Sleeping for {sleep_seconds} seconds before retry...")
-                time.sleep(sleep_seconds)
+                logger.error(f"Error writing batch: {e}", exc_info=True)
+                time.sleep(5)
+
+
+class VoluumLookupCache:
+    """
+    offer_id -> offer_name and campaign_id -> campaign_name maps for live events.
+    - request() only queues unknown IDs; a background thread resolves them so the
+      consumer never waits on Voluum.
+    - A refresh pulls the offers/campaigns report for the window since the previous
+      refresh (an ID that shows up in live events has traffic now, so it is in that
+      window) instead of everything since 2025-10-01.
+    - Refreshes are at least LOOKUP_REFRESH_MIN_INTERVAL_SECONDS apart; IDs still
+      unknown afterwards are negatively cached for LOOKUP_NEGATIVE_TTL_SECONDS.
+    - After each refresh, live events stored without names are backfilled in SQL.
+    """
+
+    def __init__(self, db, voluum):
+        self.db = db
+        self.voluum = voluum
+        self.offer_map = {}
+        self.campaign_map = {}
+        self._negative = {}  # ("offer" | "campaign", id) -> expires_at
+        self._pending_offers = set()
+        self._pending_campaigns = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._last_refresh_at = 0
+        self._last_refresh_day = None
+
+    def load(self):
+        """Load offer & campaign name caches from DB."""
+        self.offer_map = self.db.get_all_offer_names()
+        self.campaign_map = self.db.get_all_campaign_names()
+        logger.info(f"Loaded {len(self.offer_map)} offers and {len(self.campaign_map)} campaigns into cache.")
+
+    def start(self):
+        threading.Thread(target=self._run, name="voluum-lookups", daemon=True).start()
+        # Pick up events left without names by a previous run
+        self._wake.set()
+
+    def _is_negative(self, kind, entity_id, now):
+        expires_at = self._negative.get((kind, entity_id))
+        return expires_at is not None and expires_at > now
+
+    def request(self, events: list[dict]):
+        """Queue offer/campaign IDs from `events` that are neither cached nor known-missing."""
+        now = time.time()
+        offer_map, campaign_map = self.offer_map, self.campaign_map
+        missing_offers = {
+            e["offerId"] for e in events
+            if e.get("offerId") and e["offerId"] not in offer_map and not self._is_negative("offer", e["offerId"], now)
+        }
+        missing_campaigns = {
+            e["campaignId"] for e in events
+            if e.get("campaignId") and e["campaignId"] not in campaign_map and not self._is_negative("campaign", e["campaignId"], now)
+        }
+        if missing_offers or missing_campaigns:
+            with self._lock:
+                self._pending_offers |= missing_offers
+                self._pending_campaigns |= missing_campaigns
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            wait_seconds = self._last_refresh_at + LOOKUP_REFRESH_MIN_INTERVAL_SECONDS - time.time()
+            if wait_seconds > 0:
+                time.sleep(wait_seconds)
+            self._wake.clear()
+
+            with self._lock:
+                offers, self._pending_offers = self._pending_offers, set()
+                campaigns, self._pending_campaigns = self._pending_campaigns, set()
+            try:
+                self._refresh(offers, campaigns)
+            except Exception as e:
+                logger.error(f"Offer/campaign refresh failed, will retry: {e}", exc_info=True)
+                with self._lock:
+                    self._pending_offers |= offers
+                    self._pending_campaigns |= campaigns
+                self._wake.set()
+            finally:
+                self._last_refresh_at = time.time()
+
+    def _refresh(self, wanted_offers: set, wanted_campaigns: set):
+        if wanted_offers or wanted_campaigns:
+            today = datetime.now().date()
+            since = (self._last_refresh_day or today - timedelta(days=LOOKUP_INITIAL_WINDOW_DAYS)) - timedelta(days=1)
+            from_date = f"{since:%Y-%m-%d}T00:00:00.000Z"
+            to_date = f"{today + timedelta(days=1):%Y-%m-%d}T00:00:00.000Z"
+            logger.info(f"Resolving {len(wanted_offers)} offers and {len(wanted_campaigns)} campaigns from Voluum ({from_date} -> {to_date})...")
+
+            offers = self.voluum.get_offers_data(from_date, to_date) if wanted_offers else []
+            campaigns = self.voluum.get_campaigns_data(from_date, to_date) if wanted_campaigns else []
+            self.db.upsert_offers(offers)
+            self.db.upsert_campaigns(campaigns)
+            self.offer_map = {**self.offer_map, **{o["offerId"]: o.get("offerName") for o in offers if o.get("offerId")}}
+            self.campaign_map = {**self.campaign_map, **{c["campaignId"]: c.get("campaignName") for c in campaigns if c.get("campaignId")}}
+            self._last_refresh_day = today
+
+            expires_at = time.time() + LOOKUP_NEGATIVE_TTL_SECONDS
+            unresolved = [("offer", i) for i in wanted_offers if i not in self.offer_map]
+            unresolved += [("campaign", i) for i in wanted_campaigns if i not in self.campaign_map]
+            now = time.time()
+            self._negative = {key: exp for key, exp in self._negative.items() if exp > now}
+            self._negative.update({key: expires_at for key in unresolved})
+            if unresolved:
+                logger.warning(f"{len(unresolved)} offer/campaign IDs unknown to Voluum, not retried for {LOOKUP_NEGATIVE_TTL_SECONDS}s.")
+
+        offers_filled, campaigns_filled = self.db.backfill_live_event_names()
+        if offers_filled or campaigns_filled:
+            logger.info(f"Backfilled names on {offers_filled} offer and {campaigns_filled} campaign live events.")
+
+
+class SQSMetrics:
+    """
+    Consumer counters, exported every SQS_METRICS_INTERVAL_SECONDS as a log line
+    and as JSON in SQS_METRICS_FILE. Lag is SQS SentTimestamp -> batch written.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.totals = {"messages_received": 0, "messages_written": 0, "events_written": 0, "batches_written": 0, "messages_dead_lettered": 0}
+        self._reset_window()
+
+    def _reset_window(self):
+        self.window_started_at = time.time()
+        self.window = {"messages_received": 0, "messages_written": 0, "events_written": 0, "batches_written": 0, "messages_dead_lettered": 0}
+        self.lags = []
+
+    def record_received(self, message_count):
+        with self._lock:
+            self.window["messages_received"] += message_count
+            self.totals["messages_received"] += message_count
+
+    def record_dead_letters(self, message_count):
+        with self._lock:
+            self.window["messages_dead_lettered"] += message_count
+            self.totals["messages_dead_lettered"] += message_count
+
+    def record_batch(self, items, event_count):
+        now = time.time()
+        lags = [
+            now - int(item["message"]["Attributes"]["SentTimestamp"]) / 1000
+            for item in items
+            if "SentTimestamp" in item["message"].get("Attributes", {})
+        ]
+        with self._lock:
+            for counters in (self.window, self.totals):
+                counters["messages_written"] += len(items)
+                counters["events_written"] += event_count
+                counters["batches_written"] += 1
+            self.lags.extend(lags)
+
+    def export(self, buffered_messages):
+        with self._lock:
+            elapsed = max(time.time() - self.window_started_at, 1e-9)
+            lags = sorted(self.lags)
+            snapshot = {
+                "timestamp": time.time(),
+                "window_seconds": round(elapsed, 1),
+                "messages_received_per_second": round(self.window["messages_received"] / elapsed, 2),
+                "events_written_per_second": round(self.window["events_written"] / elapsed, 2),
+                "batches_written": self.window["batches_written"],
+                "messages_dead_lettered": self.window["messages_dead_lettered"],
+                "avg_events_per_batch": round(self.window["events_written"] / self.window["batches_written"], 1) if self.window["batches_written"] else 0,
+                "lag_seconds_p50": round(lags[len(lags) // 2], 2) if lags else None,
+                "lag_seconds_p95": round(lags[int(len(lags) * 0.95)], 2) if lags else None,
+                "lag_seconds_max": round(lags[-1], 2) if lags else None,
+                "buffered_messages": buffered_messages,
+                "totals": dict(self.totals),
+                "uptime_seconds": round(time.time() - self.started_at),
+            }
+            self._reset_window()
+
+        logger.info(f"Metrics: {json.dumps(snapshot)}")
+        tmp_path = f"{SQS_METRICS_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, SQS_METRICS_FILE)
+        return snapshot
 
 SQSHandler().run()
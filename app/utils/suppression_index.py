@@ -0,0 +1,205 @@
+import os
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from time import time
+from dotenv import load_dotenv
+from psycopg2 import sql
+
+load_dotenv()
+
+SUPPRESSION_INDEX_ENABLED = os.getenv("SUPPRESSION_INDEX_ENABLED", "false").lower() == "true"
+# Pull rows added since the last refresh at most this often
+SUPPRESSION_INDEX_DELTA_SECONDS = float(os.getenv("SUPPRESSION_INDEX_DELTA_SECONDS", "60"))
+# Deltas re-read rows stamped up to this long before the watermark: timestamps are taken
+# when a transaction starts, so a long one commits rows older than what was already seen
+SUPPRESSION_INDEX_DELTA_LAG_SECONDS = float(os.getenv("SUPPRESSION_INDEX_DELTA_LAG_SECONDS", "900"))
+# Deltas only see inserts; deletes we make ourselves go through remove(), and a
+# periodic full rebuild also drops keys deleted elsewhere
+SUPPRESSION_INDEX_REBUILD_SECONDS = float(os.getenv("SUPPRESSION_INDEX_REBUILD_SECONDS", "3600"))
+SUPPRESSION_INDEX_LOAD_CHUNK_ROWS = int(os.getenv("SUPPRESSION_INDEX_LOAD_CHUNK_ROWS", "1000000"))
+
+# table -> timestamp column used for incremental deltas
+SUPPRESSION_INDEX_TABLES = {
+    "blacklist": "timestamp_created",
+    "monitor": "timestamp_created",
+    "main_database": "timestamp_created",
+    "api_voluum_conversions": "processed_at",
+}
+
+# Keys that round-trip through int64 unchanged; everything else is kept as a string
+CANONICAL_NUMBER = r"0|[1-9][0-9]{0,17}"
+
+
+def _split_keys(keys: pd.Series):
+    """
+    Split string keys into (int64 numbers, non-numeric strings). Only canonical
+    numbers go into the int64 array, so "0044..." or "+44..." never collide with "44...".
+    """
+    keys = keys.astype(str)
+    canonical = keys.str.fullmatch(CANONICAL_NUMBER).fillna(False).to_numpy(dtype=bool)
+    numbers = keys[canonical].astype("int64").to_numpy()
+    return numbers, set(keys[~canonical])
+
+
+class SuppressionIndex:
+    """
+    In-process membership index for the suppression tables.
+    - Each table is a sorted, de-duplicated int64 array of numeric phone keys
+      (8 bytes per key) plus a small set of non-numeric keys.
+    - Built with COPY ... TO STDOUT, then kept fresh with deltas on the
+      table's timestamp column; ensure_fresh() decides which one is due.
+    - Lookups are np.searchsorted over the whole key list, no DB round-trips.
+    """
+
+    def __init__(self, cursor_factory, tables=SUPPRESSION_INDEX_TABLES):
+        self._cursor = cursor_factory
+        self.tables = dict(tables)
+        self._indexes = {}  # table -> (sorted int64 keys, set of other keys)
+        self._watermarks = {}
+        self._refresh_lock = threading.Lock()
+        self._stale = False
+        self.last_rebuild_at = None
+        self.last_delta_at = None
+
+    @property
+    def ready(self):
+        return len(self._indexes) == len(self.tables)
+
+    def _load_table(self, table_name):
+        column = sql.Identifier(self.tables[table_name])
+        table = sql.Identifier(table_name)
+        numeric_parts, extras = [], set()
+        with self._cursor() as cursor:
+            cursor.execute(sql.SQL("SELECT max({col}) FROM public.{tbl}").format(col=column, tbl=table))
+            watermark = cursor.fetchone()[0]
+            with tempfile.TemporaryFile() as f:
+                cursor.copy_expert(
+                    sql.SQL("COPY (SELECT custom_variable_1 FROM public.{tbl} WHERE custom_variable_1 IS NOT NULL) TO STDOUT WITH (FORMAT csv)").format(tbl=table),
+                    f
+                )
+                if f.tell():
+                    f.seek(0)
+                    for chunk in pd.read_csv(f, header=None, names=["key"], dtype=str, keep_default_na=False, chunksize=SUPPRESSION_INDEX_LOAD_CHUNK_ROWS):
+                        numbers, others = _split_keys(chunk["key"])
+                        numeric_parts.append(numbers)
+                        extras |= others
+        numbers = np.unique(np.concatenate(numeric_parts)) if numeric_parts else np.empty(0, dtype=np.int64)
+        return (numbers, extras), watermark
+
+    def rebuild(self):
+        with self._refresh_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        start_time = time()
+        indexes, watermarks = {}, {}
+        for table_name in self.tables:
+            indexes[table_name], watermarks[table_name] = self._load_table(table_name)
+        self._indexes, self._watermarks = indexes, watermarks
+        self._stale = False
+        self.last_rebuild_at = self.last_delta_at = time()
+        print(f"Suppression index rebuilt in {time() - start_time:.1f}s: " + ", ".join(f"{t}={len(i[0]) + len(i[1])}" for t, i in indexes.items()))
+
+    def _apply_deltas(self):
+        indexes, watermarks = dict(self._indexes), dict(self._watermarks)
+        for table_name, column in self.tables.items():
+            query = sql.SQL("SELECT custom_variable_1, {col} FROM public.{tbl} WHERE custom_variable_1 IS NOT NULL").format(
+                col=sql.Identifier(column), tbl=sql.Identifier(table_name)
+            )
+            params = ()
+            if watermarks[table_name] is not None:
+                # Minus the lag so rows committed late with an earlier timestamp are not
+                # missed; re-adding a key is harmless
+                query = query + sql.SQL(" AND {col} >= %s - %s * INTERVAL '1 second'").format(col=sql.Identifier(column))
+                params = (watermarks[table_name], SUPPRESSION_INDEX_DELTA_LAG_SECONDS)
+            with self._cursor() as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+            if not rows:
+                continue
+            keys, stamps = zip(*rows)
+            indexes[table_name] = self._merged(indexes[table_name], pd.Series(keys))
+            # Never move back: the lag window re-reads rows older than the watermark
+            stamps = [stamp for stamp in (*stamps, watermarks[table_name]) if stamp is not None]
+            if stamps:
+                watermarks[table_name] = max(stamps)
+        self._indexes, self._watermarks = indexes, watermarks
+        self.last_delta_at = time()
+
+    @staticmethod
+    def _merged(index, keys: pd.Series):
+        numbers, extras = index
+        new_numbers, new_extras = _split_keys(keys)
+        return np.union1d(numbers, new_numbers), extras | new_extras
+
+    def ensure_fresh(self):
+        """Build on first use, rebuild when invalidated or the full-rebuild window passed, otherwise apply due deltas."""
+        now = time()
+        if self.ready and not self._stale and now - self.last_delta_at < SUPPRESSION_INDEX_DELTA_SECONDS:
+            return
+        with self._refresh_lock:
+            now = time()
+            if not self.ready or self._stale or now - self.last_rebuild_at >= SUPPRESSION_INDEX_REBUILD_SECONDS:
+                self._rebuild()
+            elif now - self.last_delta_at >= SUPPRESSION_INDEX_DELTA_SECONDS:
+                self._apply_deltas()
+
+    def add(self, table_name, keys):
+        """Record keys we just inserted ourselves so they are visible before the next delta."""
+        if not keys or table_name not in self._indexes:
+            return
+        with self._refresh_lock:
+            self._indexes = {**self._indexes, table_name: self._merged(self._indexes[table_name], pd.Series(keys))}
+
+    def remove(self, table_name, keys):
+        """Drop keys we just deleted ourselves; deltas only ever add keys."""
+        if not keys or table_name not in self._indexes:
+            return
+        with self._refresh_lock:
+            numbers, extras = self._indexes[table_name]
+            old_numbers, old_extras = _split_keys(pd.Series(keys))
+            self._indexes = {**self._indexes, table_name: (np.setdiff1d(numbers, old_numbers), extras - old_extras)}
+
+    def invalidate(self):
+        """Make the next ensure_fresh() rebuild from the database; lookups keep the current index until then."""
+        self._stale = True
+
+    def contains(self, table_name, keys) -> np.ndarray:
+        """Boolean mask: keys[i] is present in table_name."""
+        numbers, extras = self._indexes[table_name]
+        keys = pd.Series(keys, dtype=object).astype(str)
+        result = np.zeros(len(keys), dtype=bool)
+        canonical = keys.str.fullmatch(CANONICAL_NUMBER).fillna(False).to_numpy(dtype=bool)
+        if len(numbers) and canonical.any():
+            values = keys[canonical].astype("int64").to_numpy()
+            positions = np.minimum(np.searchsorted(numbers, values), len(numbers) - 1)
+            result[canonical] = numbers[positions] == values
+        if extras and not canonical.all():
+            result[~canonical] = keys[~canonical].isin(extras).to_numpy()
+        return result
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "last_rebuild_at": self.last_rebuild_at,
+            "last_delta_at": self.last_delta_at,
+            "tables": {
+                table_name: {"keys": int(len(numbers) + len(extras)), "bytes": int(numbers.nbytes)}
+                for table_name, (numbers, extras) in self._indexes.items()
+            },
+        }
+
+
+_suppression_index = None
+_suppression_index_lock = threading.Lock()
+
+
+def get_suppression_index(cursor_factory) -> SuppressionIndex:
+    """Process-wide index, created on first use (it is built lazily or by rebuild())."""
+    global _suppression_index
+    with _suppression_index_lock:
+        if _suppression_index is None:
+            _suppression_index = SuppressionIndex(cursor_factory)
+        return _suppression_index
@@ -2,14 +2,35 @@ import requests
 from dotenv import load_dotenv
 from time import time, sleep
 import os
+import json
+import fcntl
+import threading
 
 load_dotenv()
 
+VOLUUM_TOKEN_TTL_SECONDS = int(os.getenv("VOLUUM_TOKEN_TTL_SECONDS", "14400"))
+# Tokens are renewed this long before they expire so no request goes out with a dying token
+VOLUUM_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("VOLUUM_TOKEN_REFRESH_MARGIN_SECONDS", "600"))
+# Optional: path of a small JSON file used to share one token between worker processes
+VOLUUM_TOKEN_CACHE_FILE = os.getenv("VOLUUM_TOKEN_CACHE_FILE")
+
 class VoluumAccessKeyHandler:
-    def __init__(self):
+    """
+    Voluum session token provider. Use the module-level `access_key_handler`
+    so every Voluum caller in the process shares one token.
+    - Thread-safe: only one thread refreshes; while the current token is still
+      valid the others keep using it instead of waiting.
+    - Refreshes VOLUUM_TOKEN_REFRESH_MARGIN_SECONDS before expiry.
+    - With VOLUUM_TOKEN_CACHE_FILE set, processes on the same host share the
+      token through that file (refresh guarded by an flock).
+    """
+
+    def __init__(self, cache_file=VOLUUM_TOKEN_CACHE_FILE):
         self.access_key = None
         self.creation_time = None
         self.expiry_time = None
+        self.cache_file = cache_file
+        self._refresh_lock = threading.Lock()
 
     def get_session_token(self):
         url = "https://api.voluum.com/auth/access/session"
@@ -23,32 +44,81 @@ class VoluumAccessKeyHandler:
             "Content-Type": "application/json; charset=utf-8",
             "Accept": "application/json"
         }
-        response = None
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            response.raise_for_status()
+            access_key = response.json()["token"]
         except Exception as e:
             print(e)
             return False
-        
-        self.access_key = response.json()["token"]
+
+        self.access_key = access_key
         self.creation_time = time()
-        self.expiry_time = self.creation_time + 14400
+        self.expiry_time = self.creation_time + VOLUUM_TOKEN_TTL_SECONDS
         return True
-    
+
     def create_session_token(self):
         while(not self.get_session_token()):
             print('Trying to get Voluum Access Key after failure.')
             sleep(10)
 
-    def get_access_token(self):
-        if not self.access_key or self.expiry_time - time() < 0:
+    def _is_fresh(self):
+        return bool(self.access_key) and time() < self.expiry_time - VOLUUM_TOKEN_REFRESH_MARGIN_SECONDS
+
+    def _is_valid(self):
+        return bool(self.access_key) and time() < self.expiry_time
+
+    def _load_cache_file(self):
+        try:
+            with open(self.cache_file) as f:
+                cached = json.load(f)
+            self.access_key = cached["token"]
+            self.creation_time = cached["creation_time"]
+            self.expiry_time = cached["expiry_time"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _write_cache_file(self):
+        tmp_path = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"token": self.access_key, "creation_time": self.creation_time, "expiry_time": self.expiry_time}, f)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.cache_file)
+
+    def _refresh(self):
+        if not self.cache_file:
             self.create_session_token()
-        
+            return
+        with open(f"{self.cache_file}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have refreshed while we waited for the lock
+                self._load_cache_file()
+                if not self._is_fresh():
+                    self.create_session_token()
+                    self._write_cache_file()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_access_token(self):
+        if self._is_fresh():
+            return self.access_key
+
+        # Inside the refresh margin the old token still works, so don't block on another thread's refresh
+        if not self._refresh_lock.acquire(blocking=not self._is_valid()):
+            return self.access_key
+        try:
+            if not self._is_fresh():
+                self._refresh()
+        finally:
+            self._refresh_lock.release()
         return self.access_key
-    
+
+
+access_key_handler = VoluumAccessKeyHandler()
+
 if __name__ == "__main__":
     handler = VoluumAccessKeyHandler()
     print(handler.get_access_token())
     sleep(10)
     print(handler.get_access_token())
-    
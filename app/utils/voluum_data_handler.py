@@ -1,13 +1,80 @@
 import pandas as pd
 import requests
 import os
+import threading
+from time import monotonic, sleep
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from app.utils.encryption_handler import EncryptionHandler
+from app.utils.voluum_access_key_handler import access_key_handler
 
 load_dotenv()
 
+# Max Voluum report requests in flight across the whole process
+VOLUUM_MAX_CONCURRENCY = int(os.getenv("VOLUUM_MAX_CONCURRENCY", "4"))
+VOLUUM_MAX_RETRIES = int(os.getenv("VOLUUM_MAX_RETRIES", "5"))
+VOLUUM_BACKOFF_SECONDS = float(os.getenv("VOLUUM_BACKOFF_SECONDS", "1"))
+VOLUUM_REQUEST_TIMEOUT_SECONDS = float(os.getenv("VOLUUM_REQUEST_TIMEOUT_SECONDS", "120"))
+# Report API request budget shared by every caller in the process: sustained requests per
+# second, plus how many may go out back to back after an idle period (0 disables the limit)
+VOLUUM_REPORT_RATE_PER_SECOND = float(os.getenv("VOLUUM_REPORT_RATE_PER_SECOND", "2"))
+VOLUUM_REPORT_BURST = int(os.getenv("VOLUUM_REPORT_BURST", "10"))
+
 encryption_handler = EncryptionHandler()
 
+
+def create_voluum_session():
+    """
+    Keep-alive session for Voluum API calls. 429 and 5xx responses are retried with
+    exponential backoff (honouring Retry-After), connection pool sized to the concurrency cap.
+    """
+    retry = Retry(
+        total=VOLUUM_MAX_RETRIES,
+        backoff_factor=VOLUUM_BACKOFF_SECONDS,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=VOLUUM_MAX_CONCURRENCY, pool_maxsize=VOLUUM_MAX_CONCURRENCY)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+
+voluum_session = create_voluum_session()
+voluum_request_slots = threading.BoundedSemaphore(VOLUUM_MAX_CONCURRENCY)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second, up to `capacity` saved up for bursts."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated_at = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+voluum_report_limiter = TokenBucket(VOLUUM_REPORT_RATE_PER_SECOND, VOLUUM_REPORT_BURST)
+
 class VoluumDataHandler:
     def __init__(self):
         pass
@@ -40,8 +107,17 @@ class VoluumDataHandler:
             return 'WHITELIST'  
         return 'UNKNOWN'
     
+    def classify_os_versions(self, os_versions):
+        """
+        Same result as os_versions.apply(self.classifyRecord), but classifyRecord
+        only runs once per distinct osVersion (a few hundred per report) and the
+        categories are mapped back onto the full column.
+        """
+        categories = {os_version: self.classifyRecord(os_version) for os_version in os_versions.unique()}
+        return os_versions.map(categories)
+
     def sort_data(self):
-        self.data["category"] = self.data["osVersion"].apply(self.classifyRecord)
+        self.data["category"] = self.classify_os_versions(self.data["osVersion"])
     
     def clean_unique_visits(self):
         # 1. Sort so valid rows come first
@@ -72,57 +148,63 @@ class VoluumDataHandler:
         self.data = final_data
 
     def create_session_token(self):
-        url = "https://api.voluum.com/auth/access/session"
-
-        payload = {
-            "accessId": os.getenv("VOLUUM_ACCESS_ID"),
-            "accessKey": os.getenv("VOLUUM_ACCESS_KEY")
-        }
-
-        headers = {
-            "Content-Type": "application/json; charset=utf-8",
-            "Accept": "application/json"
-        }
-
-        response = requests.post(url, json=payload, headers=headers)
-
-        return response.json()["token"]
+        # Shared, cached token; only hits /auth/access/session when it is about to expire
+        return access_key_handler.get_access_token()
+
+    def get_report_page(self, url, access_token, offset):
+        with voluum_request_slots:
+            voluum_report_limiter.acquire()
+            response = voluum_session.get(
+                url.replace("OFFSET_VALUE", str(offset)),
+                headers={"cwauth-token": access_token},
+                timeout=VOLUUM_REQUEST_TIMEOUT_SECONDS
+            )
+        response.raise_for_status()
+        return response.json()
+
+    def fetch_paginated(self, url, access_token, limit, label="rows"):
+        """
+        Fetch every page of a Voluum report. `url` carries an OFFSET_VALUE placeholder.
+        The first page tells us totalRows; the remaining offsets are independent and
+        fetched concurrently (bounded by VOLUUM_MAX_CONCURRENCY), rows returned in offset order.
+        """
+        limit = int(limit)
+        first_page = self.get_report_page(url, access_token, 0)
+        total_rows = int(first_page["totalRows"])
+        total_data = list(first_page["rows"])
+        print(f"Fetched {len(total_data)} {label} at offset 0 out of {total_rows} total. Current total: {len(total_data)}")
+
+        offsets = list(range(limit, total_rows, limit)) if len(total_data) < total_rows else []
+        if offsets:
+            with ThreadPoolExecutor(max_workers=min(VOLUUM_MAX_CONCURRENCY, len(offsets))) as executor:
+                pages = executor.map(lambda offset: self.get_report_page(url, access_token, offset), offsets)
+                for offset, page in zip(offsets, pages):
+                    total_data.extend(page["rows"])
+                    print(f"Fetched {len(page['rows'])} {label} at offset {offset} out of {total_rows} total. Current total: {len(total_data)}")
+        return total_data
 
     def get_traffic_source_data(self, traffic_source_id, limit="1000", from_date="2025-12-06T00:00:00.000Z", to_date="2025-12-13T00:00:00.000Z"):
         access_token = self.create_session_token()
 
         url = f"https://panel-api2.voluum.com/report?reportType=table&limit={limit}&dateRange=custom-date-time&from={from_date}&to={to_date}&searchMode=TEXT&currency=EUR&sort=visits&direction=ASC&reportDataType=0&offset=OFFSET_VALUE&groupBy=custom-variable-1&groupBy=ip&groupBy=browser-version&groupBy=os-version&column=profit&column=customVariable1&column=visits&column=uniqueVisits&column=suspiciousVisitsPercentage&column=campaignNoConversionsWarning&column=conversions&column=costSources&column=cost&column=revenue&column=roi&column=cv&column=epv&column=cpv&column=errors&column=Click2Reg&column=Reg2FTD&column=customConversions1&column=customRevenue1&column=customConversions2&column=customRevenue2&column=customConversions3&column=customRevenue3&column=osVersion&column=browserVersion&column=actions&column=type&column=clicks&column=suspiciousClicksPercentage&column=suspiciousVisits&column=suspiciousClicks&tz=Etc/GMT&filter1=traffic-source&filter1Value={traffic_source_id}"
-        
-        headers = {
-            "cwauth-token": access_token
-        }
-
-        total_data = []
-        offset = 0
-        while True:
-            paginated_url = url.replace("OFFSET_VALUE", str(offset))
-            response = requests.get(paginated_url, headers=headers)
-            data = response.json()
-            total_data.extend(data['rows'])
-            print(f"Fetched {len(data['rows'])} rows at offset {offset} out of {data['totalRows']} total rows. Current total: {len(total_data)}")
-            if len(total_data) == int(data["totalRows"]):
-                break
-            offset += int(limit)
-        return total_data
+        return self.fetch_paginated(url, access_token, limit, "rows")
 
     def get_data(self, limit="1000", from_date="2025-12-06T00:00:00.000Z", to_date="2025-12-13T00:00:00.000Z"):
         traffic_source_ids = ["61a5a37e-cf24-46cd-8a2f-038fd9c8d5f8", "4b62c9a1-6c3e-434b-aa7a-fbdf721f7e89"]
         # traffic_source_ids = ["4b62c9a1-6c3e-434b-aa7a-fbdf721f7e89"]
-        total_data = []
-        for traffic_source in traffic_source_ids:
-            total_data.extend(self.get_traffic_source_data(traffic_source, limit, from_date, to_date))
-        
+        with ThreadPoolExecutor(max_workers=len(traffic_source_ids)) as executor:
+            results = executor.map(
+                lambda traffic_source: self.get_traffic_source_data(traffic_source, limit, from_date, to_date),
+                traffic_source_ids
+            )
+            total_data = [row for rows in results for row in rows]
+
         return total_data
     
     def get_data_as_dataframe(self, limit="10000", from_date="2025-12-12T00:00:00.000Z", to_date="2025-12-13T00:00:00.000Z"):
         data = self.get_data(limit, from_date, to_date)
         df = pd.DataFrame(data)
-        df["customVariable1"] = df["customVariable1"].apply(self.decrypt_number)
+        df["customVariable1"] = self.decrypt_numbers(df["customVariable1"])
         return df
 
     def remove_wrong_phone_numbers(self):
@@ -171,74 +253,68 @@ class VoluumDataHandler:
         url = f"https://api.voluum.com/report/conversions?column=clickId&column=transactionId&column=visitTimestamp&column=postbackTimestamp&column=revenue&column=cost&column=profit&column=campaignId&column=campaignName&column=offerId&column=offerName&column=landerId&column=landerName&column=flowId&column=pathId&column=trafficSourceId&column=trafficSourceName&column=conversionType&column=conversionTypeId&column=referrer&column=affiliateNetworkId&column=affiliateNetworkName&column=countryCode&column=countryName&column=region&column=city&column=ip&column=isp&column=connectionType&column=deviceName&column=os&column=osVersion&column=browser&column=browserVersion&column=userAgent&column=language&column=status&column=customVariable1&column=customVariable2&column=customVariable3&column=customVariable4&column=customVariable5&column=customVariable6&column=customVariable7&column=customVariable8&column=customVariable9&column=customVariable10&column=externalId&column=externalIdType&from={from_date}&to={to_date}&limit={limit}&offset=OFFSET_VALUE&currency=EUR"
         access_token = self.create_session_token()
 
-        headers = {
-            "cwauth-token": access_token
-        }
-        total_data = []
-        offset = 0
-
-        while True:
-            paginated_url = url.replace("OFFSET_VALUE", str(offset))
-            response = requests.get(paginated_url, headers=headers)
-            data = response.json()
-            total_data.extend(data['rows'])
-            print(f"Fetched {len(data['rows'])} rows at offset {offset} out of {data['totalRows']} total rows. Current total: {len(total_data)}")
-            if len(total_data) == int(data["totalRows"]):
-                break
-            offset += int(limit)
-        return total_data
+        return self.fetch_paginated(url, access_token, limit, "rows")
     
     def decrypt_number(self, phone_number):
         if not phone_number or len(phone_number) < 25:
             return phone_number
         return encryption_handler.decrypt_number(phone_number)
 
+    def decrypt_numbers(self, phone_numbers):
+        """
+        Column version of decrypt_number: values shorter than 25 chars (plain
+        numbers, placeholders) pass through, encrypted tokens are decrypted in
+        bulk through the shared handler's cache.
+        """
+        tokens = [value for value in phone_numbers.dropna().unique() if value and len(value) >= 25]
+        plaintexts = dict(zip(tokens, encryption_handler.decrypt_many(tokens)))
+        decrypted = phone_numbers.map(plaintexts)
+        return decrypted.where(decrypted.notna(), phone_numbers)
+
     def get_offers_data(self, from_date="2025-10-01T00:00:00.000Z", to_date="2026-02-14T00:00:00.000Z"):
         limit = 1000
         url = f"https://panel-api2.voluum.com/report?reportType=tree&limit={limit}&dateRange=custom-date-time&from={from_date}&to={to_date}&searchMode=TEXT&include=ALL&currency=EUR&direction=DESC&offset=OFFSET_VALUE&groupBy=offer&conversionTimeMode=CONVERSION&column=offerId&column=offerName&tz=Etc/GMT"
         access_token = self.create_session_token()
 
-        headers = {
-            "cwauth-token": access_token
-        }
-
-        total_data = []
-        offset = 0
-        while True:
-            paginated_url = url.replace("OFFSET_VALUE", str(offset))
-            response = requests.get(paginated_url, headers=headers)
-            data = response.json()
-            total_data.extend(data['rows'])
-            print(f"Fetched {len(data['rows'])} offers at offset {offset} out of {data['totalRows']} total. Current total: {len(total_data)}")
-            if len(total_data) >= int(data["totalRows"]):
-                break
-            offset += limit
-        return total_data
+        return self.fetch_paginated(url, access_token, limit, "offers")
 
     def get_campaigns_data(self, from_date="2025-10-01T00:00:00.000Z", to_date="2026-02-14T00:00:00.000Z"):
         limit = 1000
         url = f"https://panel-api2.voluum.com/report?reportType=tree&limit={limit}&dateRange=custom-date-time&from={from_date}&to={to_date}&searchMode=TEXT&include=ALL&currency=EUR&direction=DESC&offset=OFFSET_VALUE&groupBy=campaign&conversionTimeMode=CONVERSION&column=campaignId&column=campaignName&tz=Etc/GMT"
         access_token = self.create_session_token()
 
-        headers = {
-            "cwauth-token": access_token
-        }
-
-        total_data = []
-        offset = 0
-        while True:
-            paginated_url = url.replace("OFFSET_VALUE", str(offset))
-            response = requests.get(paginated_url, headers=headers)
-            data = response.json()
-            total_data.extend(data['rows'])
-            print(f"Fetched {len(data['rows'])} campaigns at offset {offset} out of {data['totalRows']} total. Current total: {len(total_data)}")
-            if len(total_data) >= int(data["totalRows"]):
-                break
-            offset += limit
-        return total_data
+        return self.fetch_paginated(url, access_token, limit, "campaigns")
 
     def get_conversions_data_as_dataframe(self, limit="10000", from_date="2025-12-06T00:00:00.000Z", to_date="2025-12-13T00:00:00.000Z"):
         data = self.get_conversions_data(limit, from_date, to_date)
         df = pd.DataFrame(data)
-        df["customVariable1"] = df["customVariable1"].apply(self.decrypt_number)
+        df["customVariable1"] = self.decrypt_numbers(df["customVariable1"])
         return df
+
+if __name__ == "__main__":
+    # Benchmark: per-row classifyRecord vs classify_os_versions on a 1M-row report
+    import numpy as np
+    from time import time
+
+    handler = VoluumDataHandler()
+    rng = np.random.default_rng(0)
+    distinct_versions = (
+        [f"IOS {major}.{minor}" for major in range(8, 19) for minor in range(0, 8)]
+        + [f"Android {major}" for major in range(4, 16)]
+        + [f"Android {major}.{minor}.{patch}" for major in range(4, 16) for minor in range(0, 3) for patch in range(0, 3)]
+        + ["Android", "IOS", "Windows 7", "Windows XP", "Windows 10", "Windows 11", "Ubuntu", "Linux", "MacOS", "Mac OS X 10.15", "Chrome OS"]
+    )
+    os_versions = pd.Series(rng.choice(distinct_versions, size=1_000_000))
+    print(f"{len(os_versions)} rows, {os_versions.nunique()} distinct osVersion values")
+
+    start_time = time()
+    expected = os_versions.apply(handler.classifyRecord)
+    apply_seconds = time() - start_time
+
+    start_time = time()
+    result = handler.classify_os_versions(os_versions)
+    vectorized_seconds = time() - start_time
+
+    assert result.equals(expected), "classify_os_versions disagrees with classifyRecord"
+    print(f"apply(classifyRecord): {apply_seconds:.3f}s")
+    print(f"classify_os_versions:  {vectorized_seconds:.3f}s ({apply_seconds / vectorized_seconds:.1f}x faster)")
@@ -0,0 +1,13 @@
+-- ============================================================
+-- Per-file record de-duplication (_process_file_job)
+-- ============================================================
+-- Every distinct record of an uploaded CSV that is being processed.
+-- Each chunk inserts its records here (ON CONFLICT DO NOTHING) in the
+-- same transaction as its cleaning and job checkpoint, and keeps only
+-- the records that were new to the file. Rows are removed once the
+-- file is processed or its job has failed.
+CREATE TABLE IF NOT EXISTS public.file_processing_keys (
+    file_id  TEXT    NOT NULL,
+    key      VARCHAR NOT NULL,
+    PRIMARY KEY (file_id, key)
+);
@@ -0,0 +1,27 @@
+-- ============================================================
+-- HLR lookup cache (pre-HLR stage of _hlr_job)
+-- ============================================================
+-- Latest HLR result per number we sent to the provider. Numbers
+-- checked within the TTL for their live_status (HLR_CACHE_TTL_DAYS)
+-- are resolved from here instead of being sent to the batch API.
+CREATE TABLE IF NOT EXISTS public.hlr_lookup_cache (
+    telephone_number      TEXT PRIMARY KEY,
+    live_status           TEXT        NOT NULL,
+    current_network_name  TEXT,
+    checked_at            TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Seed from the LIVE history we already keep
+INSERT INTO public.hlr_lookup_cache (telephone_number, live_status, current_network_name, checked_at)
+SELECT custom_variable_1::text,
+       UPPER(live_status),
+       current_network_details_name,
+       COALESCE(NULLIF("timestamp"::text, '')::timestamptz, '-infinity')
+FROM public.api_hlr_live_numbers
+WHERE custom_variable_1 IS NOT NULL AND live_status IS NOT NULL
+ON CONFLICT (telephone_number) DO NOTHING;
+
+-- Cache hit rate per HLR run
+ALTER TABLE public.uploaded_csv_files
+    ADD COLUMN IF NOT EXISTS hlr_cache_lookups INTEGER,
+    ADD COLUMN IF NOT EXISTS hlr_cache_hits INTEGER;
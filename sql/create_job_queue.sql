@@ -0,0 +1,64 @@
+-- ============================================================
+-- Background job queue (app/utils/job_queue.py, worker.py)
+-- ============================================================
+-- Heavy jobs (file cleaning, HLR, DB exports, encryption, smart
+-- cleaning, REG search) are enqueued here by the API and claimed by
+-- worker processes with SELECT ... FOR UPDATE SKIP LOCKED.
+CREATE TABLE IF NOT EXISTS public.job_queue (
+    id             BIGSERIAL PRIMARY KEY,
+    job_type       TEXT        NOT NULL,
+    payload        JSONB       NOT NULL DEFAULT '{}'::jsonb,
+    status         TEXT        NOT NULL DEFAULT 'queued',  -- queued | running | done | failed
+    attempts       INTEGER     NOT NULL DEFAULT 0,
+    max_attempts   INTEGER     NOT NULL DEFAULT 3,
+    progress       JSONB,                                  -- last checkpoint reported by the job
+    worker_id      TEXT,
+    error_message  TEXT,
+    created_at     TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    started_at     TIMESTAMPTZ,
+    heartbeat_at   TIMESTAMPTZ,
+    finished_at    TIMESTAMPTZ
+);
+
+-- Claim path: oldest queued job of a type
+CREATE INDEX IF NOT EXISTS idx_job_queue_queued
+    ON public.job_queue (job_type, id) WHERE status = 'queued';
+
+-- Crash recovery: running jobs by heartbeat
+CREATE INDEX IF NOT EXISTS idx_job_queue_running
+    ON public.job_queue (heartbeat_at) WHERE status = 'running';
+
+-- Exclusivity is now enforced by the per-type concurrency limits in
+-- JOB_CONCURRENCY, so independent files can be processed in parallel
+-- (clean_csv_records only emits keys its own main_database insert added,
+-- so concurrent process_file jobs never both emit a number as clean).
+-- Drop the named "only one file may be processing" unique index, after
+-- checking it is the partial unique index on status = 'processing' it is
+-- expected to be. Its definition is kept in job_queue_dropped_indexes;
+-- to roll back (and set process_file=1 in JOB_CONCURRENCY):
+--   DO $$ DECLARE d text; BEGIN
+--       FOR d IN SELECT indexdef FROM public.job_queue_dropped_indexes LOOP EXECUTE d; END LOOP;
+--   END $$;
+CREATE TABLE IF NOT EXISTS public.job_queue_dropped_indexes (
+    indexname   TEXT PRIMARY KEY,
+    indexdef    TEXT        NOT NULL,
+    dropped_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+DO $$
+DECLARE
+    idx RECORD;
+BEGIN
+    FOR idx IN
+        SELECT i.schemaname, i.indexname, i.indexdef FROM pg_indexes i
+        WHERE i.schemaname = 'public'
+          AND (i.tablename, i.indexname) IN (('uploaded_csv_files', 'one_processing_file_only'))
+          AND i.indexdef LIKE 'CREATE UNIQUE INDEX%'
+          AND i.indexdef LIKE '%WHERE (status = ''processing''::%'
+    LOOP
+        INSERT INTO public.job_queue_dropped_indexes (indexname, indexdef)
+        VALUES (idx.indexname, idx.indexdef)
+        ON CONFLICT (indexname) DO UPDATE SET indexdef = EXCLUDED.indexdef, dropped_at = NOW();
+        EXECUTE format('DROP INDEX %I.%I', idx.schemaname, idx.indexname);
+    END LOOP;
+END $$;
@@ -90,11 +90,23 @@ CREATE INDEX IF NOT EXISTS idx_voluum_live_events_country_code
 CREATE INDEX IF NOT EXISTS idx_voluum_live_events_custom_variable_1
     ON public.voluum_live_events (custom_variable_1);
 
+-- Live events still waiting for an offer/campaign name (backfill_live_event_names)
+CREATE INDEX IF NOT EXISTS idx_voluum_live_events_missing_offer_name
+    ON public.voluum_live_events (offer_id) WHERE offer_name IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_voluum_live_events_missing_campaign_name
+    ON public.voluum_live_events (campaign_id) WHERE campaign_name IS NULL;
+
 -- ============================================================
 -- 4. Raw live SNS data (stores everything as-is, no dedup)
 -- ============================================================
+-- Range-partitioned on the event timestamp. Day (or week) partitions are
+-- created ahead of time and dropped after the retention window by
+-- DBHandler.maintain_raw_live_partitions; rows without a timestamp or
+-- outside every partition land in the DEFAULT partition.
+-- Existing non-partitioned installs: run sql/partition_raw_live_voluum_sns_data.sql
 CREATE TABLE IF NOT EXISTS public.raw_live_voluum_sns_data (
-    id                  BIGSERIAL PRIMARY KEY,
+    id                  BIGSERIAL,
     click_id            VARCHAR(64),
     campaign_id         VARCHAR(64),
     offer_id            VARCHAR(64),
@@ -124,5 +136,68 @@ CREATE TABLE IF NOT EXISTS public.raw_live_voluum_sns_data (
     connection_type     TEXT,
     flow_id             VARCHAR(64),
     path_id             VARCHAR(64),
+    -- SQS MessageId + position of the event inside the message: a redelivered
+    -- message maps to the same keys, so raw inserts are idempotent
+    sqs_message_id      VARCHAR(128),
+    sqs_event_index     INTEGER,
+    created_at          TIMESTAMP DEFAULT NOW()
+) PARTITION BY RANGE (timestamp);
+
+-- Installs created before the SQS keys existed: CREATE TABLE above is a
+-- no-op there, so add the columns before the unique index (and before
+-- running the partition migration, which copies the table's layout)
+ALTER TABLE public.raw_live_voluum_sns_data
+    ADD COLUMN IF NOT EXISTS sqs_message_id VARCHAR(128),
+    ADD COLUMN IF NOT EXISTS sqs_event_index INTEGER;
+
+-- Skipped on a not yet migrated (non-partitioned) table
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'public.raw_live_voluum_sns_data'::regclass) = 'p' THEN
+        CREATE TABLE IF NOT EXISTS public.raw_live_voluum_sns_data_default
+            PARTITION OF public.raw_live_voluum_sns_data DEFAULT;
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_raw_live_voluum_sns_data_id
+    ON public.raw_live_voluum_sns_data (id);
+
+-- Unique indexes on a partitioned table must contain the partition key;
+-- timestamp comes from the event itself, so redeliveries still collide.
+-- NULLS NOT DISTINCT (PostgreSQL 15+) makes events without a timestamp
+-- collide too; rows stored without an SQS key are left out.
+-- Installs with the older index (nulls distinct) drop the duplicates it
+-- let through and rebuild it.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_indexes
+        WHERE schemaname = 'public'
+          AND indexname = 'uq_raw_live_voluum_sns_data_sqs_message'
+          AND indexdef NOT LIKE '%NULLS NOT DISTINCT%'
+    ) THEN
+        DROP INDEX public.uq_raw_live_voluum_sns_data_sqs_message;
+        DELETE FROM public.raw_live_voluum_sns_data r
+        USING public.raw_live_voluum_sns_data k
+        WHERE r.timestamp IS NULL AND k.timestamp IS NULL
+          AND r.sqs_message_id = k.sqs_message_id
+          AND r.sqs_event_index IS NOT DISTINCT FROM k.sqs_event_index
+          AND r.id > k.id;
+    END IF;
+END $$;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_raw_live_voluum_sns_data_sqs_message
+    ON public.raw_live_voluum_sns_data (sqs_message_id, sqs_event_index, timestamp)
+    NULLS NOT DISTINCT WHERE sqs_message_id IS NOT NULL;
+
+-- ============================================================
+-- 5. SQS dead letters (unparseable / repeatedly failing messages)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS public.sqs_dead_letters (
+    id                  BIGSERIAL PRIMARY KEY,
+    message_id          VARCHAR(128) UNIQUE,
+    body                TEXT,
+    error_message       TEXT,
+    receive_count       INTEGER,
     created_at          TIMESTAMP DEFAULT NOW()
 );
@@ -0,0 +1,33 @@
+-- ============================================================
+-- Local MessageWhiz broadcast store (app/utils/mmd_data_handler.py)
+-- ============================================================
+-- Every broadcast seen on /api/3/Broadcast/List, as returned by the
+-- API. Syncs fetch only the newest broadcasts: back to the last sync,
+-- or for a settle refresh back to the last refresh minus
+-- MMD_BROADCAST_SETTLE_HOURS (DLR and click counts still change);
+-- older days are served from here.
+CREATE TABLE IF NOT EXISTS public.mmd_broadcasts (
+    id         BIGINT PRIMARY KEY,
+    send_date  TIMESTAMPTZ NOT NULL,
+    payload    JSONB       NOT NULL,
+    synced_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_mmd_broadcasts_send_date
+    ON public.mmd_broadcasts (send_date);
+
+-- Sync watermark: the store holds every broadcast sent in
+-- [covered_from, synced_at) as of the sync that started at synced_at;
+-- broadcasts sent before refreshed_at - MMD_BROADCAST_SETTLE_HOURS
+-- have their final counts
+CREATE TABLE IF NOT EXISTS public.mmd_broadcast_sync (
+    id            SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    covered_from  TIMESTAMPTZ NOT NULL,
+    synced_at     TIMESTAMPTZ NOT NULL,
+    refreshed_at  TIMESTAMPTZ NOT NULL
+);
+
+-- Stores created before refreshed_at: every earlier sync was a settle refresh
+ALTER TABLE public.mmd_broadcast_sync ADD COLUMN IF NOT EXISTS refreshed_at TIMESTAMPTZ;
+UPDATE public.mmd_broadcast_sync SET refreshed_at = synced_at WHERE refreshed_at IS NULL;
+ALTER TABLE public.mmd_broadcast_sync ALTER COLUMN refreshed_at SET NOT NULL;
@@ -0,0 +1,11 @@
+-- ============================================================
+-- MessageWhiz link cache (app/utils/mmd_data_handler.py)
+-- ============================================================
+-- Link id -> tracking URL (query string stripped) for resolving the
+-- {{link:ID}} placeholders in broadcast messages. Kept current by
+-- fetching only links newer than MAX(id) from /api/3/Link.
+CREATE TABLE IF NOT EXISTS public.mmd_links (
+    id          BIGINT PRIMARY KEY,
+    url         TEXT        NOT NULL,
+    fetched_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,7 @@
+-- ============================================================
+-- Indexes backing DBHandler.clean_csv_records suppression
+-- ============================================================
+-- blacklist, monitor and main_database are already keyed on
+-- custom_variable_1 (ON CONFLICT target); conversions are not.
+CREATE INDEX IF NOT EXISTS idx_api_voluum_conversions_custom_variable_1
+    ON public.api_voluum_conversions (custom_variable_1);
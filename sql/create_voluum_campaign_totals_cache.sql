@@ -0,0 +1,15 @@
+-- ============================================================
+-- Voluum campaign report totals cache (app/utils/mmd_data_handler.py)
+-- ============================================================
+-- Report totals per campaign and [window_from, window_to) window as
+-- used by the broadcast routes. A window fetched once it had ended and
+-- at least 24h after it started is closed and served from here forever;
+-- other (still open) windows are reused for VOLUUM_TOTALS_OPEN_TTL_SECONDS.
+CREATE TABLE IF NOT EXISTS public.voluum_campaign_window_totals (
+    campaign_id  TEXT        NOT NULL,
+    window_from  TIMESTAMPTZ NOT NULL,
+    window_to    TIMESTAMPTZ NOT NULL,
+    totals       JSONB       NOT NULL,
+    fetched_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (campaign_id, window_from, window_to)
+);
@@ -0,0 +1,70 @@
+-- ============================================================
+-- One-off migration: convert an existing (non-partitioned)
+-- raw_live_voluum_sns_data into the day-partitioned layout from
+-- create_live_events_tables.sql. Rows are copied into the new
+-- table; the old heap is kept as raw_live_voluum_sns_data_legacy
+-- until the copy has been checked, then it can be dropped.
+-- Stop the SQS consumer while this runs.
+-- ============================================================
+BEGIN;
+
+-- Tables created before the SQS keys existed lack these columns; add them
+-- first so the new table (copied with LIKE) and its unique index have them
+ALTER TABLE public.raw_live_voluum_sns_data
+    ADD COLUMN IF NOT EXISTS sqs_message_id VARCHAR(128),
+    ADD COLUMN IF NOT EXISTS sqs_event_index INTEGER;
+
+ALTER TABLE public.raw_live_voluum_sns_data RENAME TO raw_live_voluum_sns_data_legacy;
+ALTER INDEX IF EXISTS public.uq_raw_live_voluum_sns_data_sqs_message RENAME TO uq_raw_live_voluum_sns_data_legacy_sqs_message;
+
+CREATE TABLE public.raw_live_voluum_sns_data (
+    LIKE public.raw_live_voluum_sns_data_legacy INCLUDING DEFAULTS
+) PARTITION BY RANGE (timestamp);
+
+-- Keep handing out ids from the old sequence
+ALTER SEQUENCE public.raw_live_voluum_sns_data_id_seq OWNED BY public.raw_live_voluum_sns_data.id;
+
+CREATE TABLE public.raw_live_voluum_sns_data_default
+    PARTITION OF public.raw_live_voluum_sns_data DEFAULT;
+
+-- Day partitions for the retention window (RAW_LIVE_RETENTION_DAYS, 90 by
+-- default) up to a week ahead. Older rows land in the DEFAULT partition
+-- rather than creating one partition per historical day; once checked they
+-- can be removed with
+--   DELETE FROM public.raw_live_voluum_sns_data_default WHERE timestamp < CURRENT_DATE - 90;
+DO $$
+DECLARE
+    day DATE;
+    first_day DATE := CURRENT_DATE - 90;
+    last_day DATE := CURRENT_DATE + 7;
+BEGIN
+    SELECT GREATEST(COALESCE(MIN(timestamp)::date, CURRENT_DATE), first_day) INTO day
+    FROM public.raw_live_voluum_sns_data_legacy;
+    WHILE day <= last_day LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS public.%I PARTITION OF public.raw_live_voluum_sns_data FOR VALUES FROM (%L) TO (%L)',
+            'raw_live_voluum_sns_data_p' || to_char(day, 'YYYYMMDD'), day, day + 1
+        );
+        day := day + 1;
+    END LOOP;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_raw_live_voluum_sns_data_id
+    ON public.raw_live_voluum_sns_data (id);
+
+-- Same index as create_live_events_tables.sql: NULLS NOT DISTINCT so that
+-- events without a timestamp are deduplicated as well
+CREATE UNIQUE INDEX IF NOT EXISTS uq_raw_live_voluum_sns_data_sqs_message
+    ON public.raw_live_voluum_sns_data (sqs_message_id, sqs_event_index, timestamp)
+    NULLS NOT DISTINCT WHERE sqs_message_id IS NOT NULL;
+
+-- Redeliveries stored twice under the old index are copied once
+INSERT INTO public.raw_live_voluum_sns_data
+SELECT * FROM public.raw_live_voluum_sns_data_legacy
+ORDER BY id
+ON CONFLICT DO NOTHING;
+
+COMMIT;
+
+-- After checking row counts:
+-- DROP TABLE public.raw_live_voluum_sns_data_legacy;
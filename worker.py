@@ -0,0 +1,5 @@
+from app.utils.job_queue import run_workers
+
+if __name__ == "__main__":
+    # Job functions and their failure hooks are registered in app.router.JOB_HANDLERS
+    run_workers("app.router")